@@ -0,0 +1,178 @@
+'''Cache of diff results keyed by the contents of the inputs.'''
+
+
+import hashlib
+import marshal
+import os
+import tempfile
+from collections import OrderedDict
+
+from src.srcdiff.costs import CostModel, UNIT_COSTS
+from src.srcdiff.diff2 import BYTES_LIKE, Text, diff2
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+
+
+# CLASSES
+
+class DiffCache:
+    """Memoizes `tree_diff2` and `diff2` results.
+    Results are keyed by the digests of both inputs, the engine and the settings that change the result, so equal inputs hit the cache even if they are different objects, files or revisions.
+    Settings that only change how a result is computed (e.g. `jobs`) are not part of the key.
+    Cached results are shared between callers and must not be modified.
+    Recent results are kept in memory. If a `directory` is given, every result is also stored there, one file per result, and reused by later processes.
+
+    Attributes:
+    - `max_entries` is the maximum number of results kept in memory.
+    - `directory` is the directory of the on-disk layer, or `None` to keep results only in memory.
+    - `max_disk_bytes` is the maximum total size of the files of the on-disk layer, or `None` for no limit. The least recently used files are removed first.
+    - `hits`, `disk_hits` and `misses` count the lookups answered from memory, from disk, or not answered.
+    - `_results` maps each key to its result, in least recently used order.
+    - `_disk_bytes` is the total size of the files of the on-disk layer.
+    """
+
+    def __init__(self, max_entries: int = 1024, directory: str | None = None,
+                 max_disk_bytes: int | None = None):
+        """Creates a DiffCache object, creating `directory` if needed.
+        The parameters correspond to the class' attributes.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._results: OrderedDict[str, object] = OrderedDict()
+        self._disk_bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            with os.scandir(directory) as entries:
+                self._disk_bytes = sum(e.stat().st_size for e in entries if e.name.endswith('.result'))
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counts and the sizes of both layers."""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'entries': len(self._results), 'disk_bytes': self._disk_bytes}
+
+    def clear(self):
+        """Removes every result from both layers. The statistics are kept."""
+        self._results.clear()
+        if self.directory is not None:
+            with os.scandir(self.directory) as entries:
+                for e in entries:
+                    if e.name.endswith('.result'):
+                        os.remove(e.path)
+            self._disk_bytes = 0
+
+    def _path(self, key: str) -> str:
+        """Returns the path of the file of the result of `key` in the on-disk layer."""
+        return os.path.join(self.directory, key + '.result')  # type: ignore
+
+    def get(self, key: str, default=None):
+        """Returns the result of `key`, or `default` if it is not cached."""
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    result = marshal.load(f)
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+            else:
+                self.disk_hits += 1
+                # Mark the file as recently used
+                os.utime(path)
+                self._remember(key, result)
+                return result
+        self.misses += 1
+        return default
+
+    def put(self, key: str, result):
+        """Stores the `result` of `key` in both layers.
+        `result` must be made of numbers, strings, bytes, lists, tuples and `None`.
+        """
+        self._remember(key, result)
+        if self.directory is None:
+            return
+        data = marshal.dumps(result)
+        path = self._path(key)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        # Write atomically, so that concurrent readers never see partial results
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._disk_bytes += len(data) - old_size
+        if self.max_disk_bytes is not None and self._disk_bytes > self.max_disk_bytes:
+            self._evict_files()
+
+    def _remember(self, key: str, result):
+        """Stores the `result` of `key` in the in-memory layer."""
+        self._results[key] = result
+        self._results.move_to_end(key)
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def _evict_files(self):
+        """Removes the least recently used files of the on-disk layer until it fits `max_disk_bytes`."""
+        with os.scandir(self.directory) as entries:
+            files = [(e.stat().st_mtime_ns, e.stat().st_size, e.path)
+                     for e in entries if e.name.endswith('.result')]
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:  # type: ignore
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._disk_bytes = total
+
+    def tree_diff2(self, a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS, **options) -> int | float:
+        '''Returns `tree_diff2(a, b, cost_model, **options)`, computing it only if it is not cached.'''
+        key = _key('tree_diff2', a.digest(), b.digest(), cost_model.fingerprint())
+        result = self.get(key)
+        if result is None:
+            result = tree_diff2(a, b, cost_model, **options)
+            self.put(key, result)
+        return result  # type: ignore
+
+    def diff2(self, a: Text, b: Text, max_distance: int | None = None, preprocess: bool = False):
+        '''Returns `diff2(a, b, max_distance, preprocess)`, computing it only if it is not cached.'''
+        key = _key('diff2', text_digest(a), text_digest(b), repr((max_distance, preprocess)))
+        result = self.get(key)
+        if result is None:
+            distance, diffa, diffb = diff2(a, b, max_distance, preprocess)
+            result = (distance, diffa, diffb)
+            self.put(key, result)
+        return result
+
+
+# FUNCTIONS
+
+def text_digest(s: Text) -> bytes:
+    '''Returns a stable digest of the contents and kind of the `diff2` input `s`.'''
+    if isinstance(s, str):
+        data = b's' + s.encode('utf-8', 'surrogatepass')
+    elif isinstance(s, BYTES_LIKE):
+        data = b'b' + bytes(s)
+    else:
+        data = b'r' + repr(list(s)).encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _key(engine: str, digest_a: bytes, digest_b: bytes, settings: str) -> str:
+    '''Returns the cache key of a diff of inputs with digests `digest_a` and `digest_b`.'''
+    h = hashlib.blake2b(engine.encode(), digest_size=16)
+    h.update(digest_a)
+    h.update(digest_b)
+    h.update(settings.encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
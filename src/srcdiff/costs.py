@@ -0,0 +1,139 @@
+'''Labels and edit costs used by the tree diffs.'''
+
+
+from src.srcdiff.tree import Tree
+
+
+# TYPES
+
+# A label identifies a node for the diff: its type and its value.
+Label = tuple[str, str | int | bool | float | None]
+
+
+# CLASSES
+
+class LabelTable:
+    """Interns the labels of a `Tree` to integer ids.
+
+    Attributes:
+    - `labels` is the list of interned labels. The id of a label is its index in this list.
+    - `_id_of` is a dictionary that maps each label to its id.
+    """
+
+    def __init__(self):
+        """Creates an empty LabelTable."""
+        self.labels: list[Label] = []
+        self._id_of: dict[Label, int] = {}
+
+    def __len__(self):
+        """Returns the number of interned labels."""
+        return len(self.labels)
+
+    def intern(self, label: Label) -> int:
+        """Returns the id of `label`, interning it if it is new."""
+        id_ = self._id_of.get(label)
+        if id_ is None:
+            id_ = len(self.labels)
+            self._id_of[label] = id_
+            self.labels.append(label)
+        return id_
+
+    def intern_tree(self, tree: Tree) -> list[int]:
+        """Interns the labels of all nodes of `tree`.
+        Returns the list of label ids indexed like the `Tree` (the position 0 is unused and holds -1).
+        """
+        ids = [-1]
+        for i in range(1, len(tree) + 1):
+            node = tree[i]
+            ids.append(self.intern((node.type, node.value)))
+        return ids
+
+
+class CostModel:
+    """Costs of the edit operations of the tree diff.
+
+    Attributes:
+    - `insert` maps node types to the cost of inserting a node of that type.
+    - `delete` maps node types to the cost of deleting a node of that type.
+    - `rename` maps pairs of node types `(type_a, type_b)` to the cost of replacing a node of `type_a` by a different node of `type_b`.
+    - `default_insert`, `default_delete` and `default_rename` are the costs of the types missing in the dictionaries above.
+
+    Replacing a node by another one with the same label always costs 0.
+    The default model costs 1 for every operation, e.g. `CostModel(rename={('Name', 'Name'): 0.5})` makes renaming identifiers cheaper than changing node types.
+    """
+
+    def __init__(self,
+                 insert: dict[str, int | float] | None = None,
+                 delete: dict[str, int | float] | None = None,
+                 rename: dict[tuple[str, str], int | float] | None = None,
+                 default_insert: int | float = 1,
+                 default_delete: int | float = 1,
+                 default_rename: int | float = 1):
+        """Creates a CostModel object.
+        The parameters correspond to the class' attributes.
+        """
+        self.insert: dict[str, int | float] = insert or {}
+        self.delete: dict[str, int | float] = delete or {}
+        self.rename: dict[tuple[str, str], int | float] = rename or {}
+        self.default_insert = default_insert
+        self.default_delete = default_delete
+        self.default_rename = default_rename
+
+    def fingerprint(self) -> str:
+        """Returns a string that is equal for cost models with the same costs."""
+        return repr((sorted(self.insert.items()), sorted(self.delete.items()), sorted(self.rename.items()),
+                     self.default_insert, self.default_delete, self.default_rename))
+
+    def is_symmetric(self) -> bool:
+        """Checks if the distance from a tree to another always equals the distance back, i.e. if inserting and deleting each type cost the same and renames cost the same both ways."""
+        if self.default_insert != self.default_delete:
+            return False
+        types = set(self.insert) | set(self.delete)
+        if any(self.insert_cost((t, None)) != self.delete_cost((t, None)) for t in types):
+            return False
+        return all(self.rename.get((type_b, type_a), self.default_rename) == cost
+                   for (type_a, type_b), cost in self.rename.items())
+
+    def is_integral(self) -> bool:
+        """Checks if every cost is an integer, so that distances fit integer arrays."""
+        costs = [self.default_insert, self.default_delete, self.default_rename,
+                 *self.insert.values(), *self.delete.values(), *self.rename.values()]
+        return all(type(c) is int for c in costs)
+
+    def insert_cost(self, label: Label) -> int | float:
+        """Returns the cost of inserting a node with `label`."""
+        return self.insert.get(label[0], self.default_insert)
+
+    def delete_cost(self, label: Label) -> int | float:
+        """Returns the cost of deleting a node with `label`."""
+        return self.delete.get(label[0], self.default_delete)
+
+    def rename_cost(self, label_a: Label, label_b: Label) -> int | float:
+        """Returns the cost of replacing a node with `label_a` by a node with `label_b`."""
+        type_a, value_a = label_a
+        type_b, value_b = label_b
+        # Same comparison as `Tree.equals`
+        if type_a == type_b and value_a == value_b:
+            return 0
+        return self.rename.get((type_a, type_b), self.default_rename)
+
+    def insert_costs(self, table: LabelTable) -> list[int | float]:
+        """Returns the insert costs of the labels of `table`, indexed by label id."""
+        return [self.insert_cost(label) for label in table.labels]
+
+    def delete_costs(self, table: LabelTable) -> list[int | float]:
+        """Returns the delete costs of the labels of `table`, indexed by label id."""
+        return [self.delete_cost(label) for label in table.labels]
+
+    def rename_matrix(self, table_a: LabelTable, table_b: LabelTable) -> list[list[int | float]]:
+        """Returns the rename costs between the labels of `table_a` and `table_b`.
+        The cost of replacing label id `i` of `table_a` by label id `j` of `table_b` is at `[i][j]`.
+        """
+        return [[self.rename_cost(label_a, label_b) for label_b in table_b.labels]
+                for label_a in table_a.labels]
+
+
+# CONSTANTS
+
+# Every operation costs 1
+UNIT_COSTS = CostModel()
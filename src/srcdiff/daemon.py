@@ -0,0 +1,328 @@
+'''Long-running diff daemon that keeps parsed trees and recent diff results in memory.
+
+Clients connect to a Unix socket (or a localhost TCP port) and send one JSON object per line:
+    {"id": 1, "op": "tree_diff2", "a": "path/to/a.py", "b": "path/to/b.py", "timeout": 5}
+The daemon answers each request with one JSON object per line, in any order:
+    {"id": 1, "ok": true, "result": 3}
+    {"id": 1, "ok": false, "error": "timeout"}
+Operations are `tree_diff2`, `diff2`, `stats` and `ping`.
+A request line longer than the stream limit (64 KiB) is discarded and answered with an error whose `id` is `null`.
+'''
+
+
+import argparse
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from src.srcdiff.diff2 import diff2
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+
+
+# TYPES
+
+# Identifies the contents of a file: its absolute path, modification time and size
+FileKey = tuple[str, int, int]
+
+
+# CONSTANTS
+
+# Operations that diff two files
+DIFF_OPS = ('tree_diff2', 'diff2')
+
+# Maximum number of parsed trees kept by each worker process
+TREES_CACHE_SIZE = 256
+
+
+# WORKER FUNCTIONS
+# These run in the worker processes, each with its own cache of parsed trees.
+
+_trees: OrderedDict[FileKey, Tree] = OrderedDict()
+
+
+def _load_tree(key: FileKey) -> Tree:
+    """Returns the `Tree` of the file identified by `key`, parsing it only if it is not cached."""
+    tree = _trees.get(key)
+    if tree is None:
+        tree = Tree.from_file(key[0])
+        _trees[key] = tree
+        if len(_trees) > TREES_CACHE_SIZE:
+            _trees.popitem(last=False)
+    else:
+        _trees.move_to_end(key)
+    return tree
+
+
+def _read_text(key: FileKey) -> str:
+    """Returns the contents of the file identified by `key`."""
+    with open(key[0]) as f:
+        return f.read()
+
+
+def _run_diff(op: str, key_a: FileKey, key_b: FileKey):
+    """Runs the diff `op` between the files identified by `key_a` and `key_b`.
+    Returns a JSON serializable result.
+    """
+    if op == 'tree_diff2':
+        return tree_diff2(_load_tree(key_a), _load_tree(key_b))
+    distance, diffa, diffb = diff2(_read_text(key_a), _read_text(key_b))
+    return [distance, diffa, diffb]
+
+
+# CLASSES
+
+class DiffDaemon:
+    """Serves diff requests concurrently, offloading the diffs to a process pool.
+    A request that times out or whose client disconnects stops waiting for its diff, and the diff is dropped if it did not start yet.
+    A diff that already runs cannot be interrupted: it keeps its worker busy until it finishes, and its result is still cached.
+
+    Attributes:
+    - `executor` runs the diffs.
+    - `timeout` is the default time limit of a request, in seconds.
+    - `cache_size` is the maximum number of results kept in memory.
+    - `hits` and `misses` count the requests answered from (or missing in) the results cache.
+    - `_results` maps each `(op, key_a, key_b)` to its result, in least recently used order.
+    - `_running` maps each `(op, key_a, key_b)` being computed to its future and its number of waiting requests.
+    """
+
+    def __init__(self,
+                 jobs: int | None = None,
+                 timeout: float = 30.0,
+                 cache_size: int = 1024,
+                 executor: Executor | None = None):
+        """Creates a DiffDaemon object.
+        `jobs` is the number of worker processes, used if no `executor` is given.
+        The other parameters correspond to the class' attributes.
+        """
+        self.executor: Executor = executor or ProcessPoolExecutor(max_workers=jobs)
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._results: OrderedDict[tuple, object] = OrderedDict()
+        self._running: dict[tuple, list] = {}
+
+    async def handle(self, request: dict) -> dict:
+        """Handles one request.
+        Returns the response. Every error, including unexpected ones such as a broken worker pool, is reported in it, so that each request gets an answer.
+        """
+        response: dict = {'id': request.get('id')}
+        op = request.get('op')
+        try:
+            if op == 'ping':
+                result = 'pong'
+            elif op == 'stats':
+                result = {'hits': self.hits, 'misses': self.misses,
+                          'cached': len(self._results), 'running': len(self._running)}
+            elif op in DIFF_OPS:
+                timeout = request.get('timeout', self.timeout)
+                if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+                    raise TypeError(f'Invalid timeout: {timeout!r}')
+                result = await asyncio.wait_for(
+                    self._diff(op, request['a'], request['b']), timeout)
+            else:
+                raise ValueError(f'Unknown operation: {op}')
+        except asyncio.TimeoutError:
+            response.update(ok=False, error='timeout')
+        except Exception as e:
+            response.update(ok=False, error=f'{type(e).__name__}: {e}')
+        else:
+            response.update(ok=True, result=result)
+        return response
+
+    async def _diff(self, op: str, path_a: str, path_b: str):
+        """Returns the result of the diff `op` between files `path_a` and `path_b`.
+        Results are cached until one of the files changes, and equal requests running at the same time share the computation.
+        """
+        key = (op, _file_key(path_a), _file_key(path_b))
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+        self.misses += 1
+        running = self._running.get(key)
+        if running is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, _run_diff, *key)
+            running = self._running[key] = [future, 0]
+            future.add_done_callback(lambda f: self._store(key, f))
+        future, _ = running
+        running[1] += 1
+        try:
+            # Shield the shared computation from the cancellation of this request
+            return await asyncio.shield(future)
+        finally:
+            running[1] -= 1
+            # Nobody waits for this result anymore, drop it if it did not start yet
+            if running[1] == 0 and not future.done():
+                future.cancel()
+
+    def _store(self, key: tuple, future: asyncio.Future):
+        """Stores the result of a finished computation in the results cache."""
+        self._running.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._results[key] = future.result()
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Reads the requests of a connection and writes the responses as soon as they are ready."""
+        tasks: set[asyncio.Task] = set()
+        lock = asyncio.Lock()
+
+        async def respond(request: dict):
+            response = await self.handle(request)
+            async with lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    # The last line may lack its newline
+                    line = e.partial
+                    if not line:
+                        break
+                except asyncio.LimitOverrunError:
+                    await _discard_line(reader)
+                    async with lock:
+                        writer.write(json.dumps({'id': None, 'ok': False, 'error': 'Request too long'}).encode() + b'\n')
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('Requests must be JSON objects')
+                except ValueError as e:
+                    # Also catches `json.JSONDecodeError`
+                    async with lock:
+                        writer.write(json.dumps({'id': None, 'ok': False, 'error': str(e)}).encode() + b'\n')
+                    continue
+                task = asyncio.create_task(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # The client finished sending, answer what is left
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            # The client went away, cancel its requests
+            for task in tasks:
+                task.cancel()
+        except asyncio.CancelledError:
+            # The server is closing
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            writer.close()
+
+    async def start_unix(self, path: str) -> asyncio.AbstractServer:
+        """Starts listening on the Unix socket at `path`."""
+        return await asyncio.start_unix_server(self._serve_connection, path)
+
+    async def start_tcp(self, host: str = '127.0.0.1', port: int = 0) -> asyncio.AbstractServer:
+        """Starts listening on `host`:`port`. Port 0 picks a free port."""
+        return await asyncio.start_server(self._serve_connection, host, port)
+
+    def close(self):
+        """Shuts the workers down."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DiffClient:
+    """Sends requests to a `DiffDaemon`, one at a time."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Creates a DiffClient object from an open connection. Use `connect_unix` or `connect_tcp` instead."""
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> 'DiffClient':
+        """Connects to a daemon listening on the Unix socket at `path`."""
+        return cls(*await asyncio.open_unix_connection(path))
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int) -> 'DiffClient':
+        """Connects to a daemon listening on `host`:`port`."""
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, op: str, a: str | None = None, b: str | None = None,
+                      timeout: float | None = None) -> dict:
+        """Sends a request and returns the response."""
+        async with self._lock:
+            self._next_id += 1
+            request: dict = {'id': self._next_id, 'op': op}
+            if a is not None:
+                request.update(a=a, b=b)
+            if timeout is not None:
+                request['timeout'] = timeout
+            self._writer.write(json.dumps(request).encode() + b'\n')
+            await self._writer.drain()
+            return json.loads(await self._reader.readline())
+
+    async def close(self):
+        """Closes the connection."""
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+# FUNCTIONS
+
+async def _discard_line(reader: asyncio.StreamReader):
+    """Reads and drops the rest of a line longer than the limit of `reader`."""
+    while True:
+        try:
+            await reader.readuntil(b'\n')
+            return
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+        except asyncio.IncompleteReadError:
+            return
+
+
+def _file_key(path: str) -> FileKey:
+    """Returns the key identifying the current contents of the file at `path`."""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+async def serve(socket_path: str | None = None, host: str = '127.0.0.1', port: int = 0,
+                jobs: int | None = None, timeout: float = 30.0):
+    '''Runs a `DiffDaemon` until it is cancelled.
+    It listens on `socket_path` if it is given, or on `host`:`port` otherwise.'''
+    daemon = DiffDaemon(jobs=jobs, timeout=timeout)
+    if socket_path is not None:
+        server = await daemon.start_unix(socket_path)
+    else:
+        server = await daemon.start_tcp(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        daemon.close()
+
+
+def main(argv: list[str] | None = None):
+    '''Command line entry point of the daemon.'''
+    parser = argparse.ArgumentParser(description='Serve diff requests with warm caches.')
+    parser.add_argument('--socket', help='path of the Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--timeout', type=float, default=30.0, help='default request timeout, in seconds')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.socket, args.host, args.port, args.jobs, args.timeout))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
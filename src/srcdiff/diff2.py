@@ -1,49 +1,186 @@
 '''Perform diffs of 2 source-code files.'''
 
 
+import mmap
+import re
+from collections import deque
+
 from src.srcdiff import EMPTY
+from src.srcdiff.limits import DiffTimeout, Limits
+
+
+# TYPES
+
+# Sequences that can be diffed. Bytes-like sequences are compared byte by byte, without copying or decoding them.
+Text = str | bytes | bytearray | memoryview | mmap.mmap
+
+# A diff being built
+Diff = list[str] | deque[str]
+
+# A segment of the diff: whether both sides are equal and the ranges `[start, end)` of `a` and `b` it covers
+Segment = tuple[bool, int, int, int, int]
+
+# A changed region of a file: its offset in `a`, the removed text, its offset in `b` and the inserted text
+Hunk = tuple[int, str, int, str]
+
+
+# CONSTANTS
+
+# Types compared byte by byte and split into lines of bytes
+BYTES_LIKE = (bytes, bytearray, memoryview, mmap.mmap)
+
+# Matches a line of bytes
+_BYTES_LINE = re.compile(rb'[^\n]*\n|[^\n]+')
 
 
 # CLASSES
 
 class Diff2:
-    def __init__(self, a: str, b: str):
+    def __init__(self, a: Text, b: Text, max_distance: int | None = None, limits: Limits | None = None):
+        """
+        `a` and `b` are strings or bytes-like objects (`bytes`, `memoryview`, `mmap`...). The elements of the diffs of bytes-like objects are `int`s.
+        `max_distance` limits the edit distance of interest. If it is given, only the diagonal band of width `2*max_distance + 1` of the matrix is computed.
+        `limits` bounds the work and time of the diff. When one is reached, `DiffTimeout` is raised with bounds of the distance.
+        """
         self._a = a
         self._b = b
+        self.max_distance = max_distance
+        self.limits = limits
+        # Last row of the matrix that is completely computed
+        self._last_row = -1
 
     def _initialize(self):
         """
         Initialize data structures to perform the diff.
         """
+        if self.max_distance is not None:
+            self._initialize_band()
+            return
         # Matrix for dynamic programming. The +1's are for the empty string.
         self.matrix = []
         for _ in range(self.n + 1):
             self.matrix.append([-1] * (self.m + 1))
 
-    def run(self) -> tuple[int, list[str], list[str]]:
+    def _initialize_band(self):
+        """
+        Initialize the band of the matrix, used when `max_distance` is given.
+        Row `i` of the band holds the cells `i-max_distance` to `i+max_distance` of the matrix.
+        The cells outside the band cost more than `max_distance`, so they are all stored as `max_distance + 1`.
+        """
+        k = self.max_distance
+        self.matrix = []
+        for _ in range(self.n + 1):
+            self.matrix.append([k + 1] * (2*k + 1))  # type: ignore
+
+    def run(self) -> tuple[int, list[str], list[str]] | tuple[None, None, None]:
         """
         Run the diff.
-        Returns the edit distance.
+        Returns the edit distance and the diffs, or `(None, None, None)` if the distance exceeds `max_distance`.
         """
+        k = self.max_distance
+        # The distance is at least the difference between the sizes
+        if k is not None and abs(self.n - self.m) > k:
+            return None, None, None
+
         self._initialize()
 
-        self._compute_distance_matrix()
+        try:
+            self._compute_distance_matrix()
+        except DiffTimeout as e:
+            e.lower, e.upper = self._bounds()
+            raise
+
+        distance = self._cell(self.n, self.m)
+        if k is not None and distance > k:
+            return None, None, None
 
         diffa, diffb = self._build_diffs()
 
-        return self.matrix[self.n][self.m], diffa, diffb
+        return distance, diffa, diffb
+
+    def distance(self) -> int | None:
+        """
+        Compute only the edit distance, without the matrix nor the diffs.
+        It uses a bit-parallel algorithm (Hyyrö, 2004) that processes a whole column of the matrix per operation on Python integers, in `O(n)` memory.
+        Returns `None` if the distance exceeds `max_distance`.
+        """
+        k = self.max_distance
+        if k is not None and abs(self.n - self.m) > k:
+            return None
+        # The bits are the longer sequence and the loop runs over the shorter one
+        longer, shorter = (self._a, self._b) if self.n >= self.m else (self._b, self._a)
+        size = len(longer)
+        matches = _match_masks(longer)
+        # Bits of `v` are cleared at the positions of `longer` matched in the longest common subsequence
+        all_ones = (1 << size) - 1
+        v = all_ones
+        limits = self.limits
+        for t, char in enumerate(shorter, 1):
+            u = v & matches.get(char, 0)
+            v = ((v + u) | (v - u)) & all_ones
+            if limits is not None and not t % 64:
+                try:
+                    limits.charge(64 * size)
+                except DiffTimeout as e:
+                    # The remaining elements of `shorter` match at most once each
+                    lcs = size - v.bit_count()
+                    e.lower = self.n + self.m - 2 * (lcs + len(shorter) - t)
+                    e.upper = self.n + self.m - 2 * lcs
+                    raise
+        lcs = size - v.bit_count()
+        # Only insertions and removals are allowed, so each unmatched element costs 1
+        distance = self.n + self.m - 2 * lcs
+        if k is not None and distance > k:
+            return None
+        return distance
+
+    def _bounds(self) -> tuple[int, int]:
+        """
+        Returns lower and upper bounds of the distance, from the last completely computed row of the matrix.
+        Every path to the last cell crosses that row, and the rest of the path costs at least the difference and at most the sum of the remaining sizes.
+        """
+        n, m, k = self.n, self.m, self.max_distance
+        i = self._last_row
+        if i < 0:
+            return abs(n - m), n + m
+        first, last = (0, m) if k is None else (max(0, i - k), min(m, i + k))
+        # Cells outside the band cost more than `max_distance`
+        lower = n + m if k is None else k + 1
+        upper = n + m
+        for j in range(first, last + 1):
+            d = self._cell(i, j)
+            rest = abs((n - i) - (m - j))
+            if d + rest < lower:
+                lower = d + rest
+            # Capped cells are not exact
+            if (k is None or d <= k) and d + (n - i) + (m - j) < upper:
+                upper = d + (n - i) + (m - j)
+        return max(lower, abs(n - m)), upper
+
+    def _cell(self, i: int, j: int) -> int:
+        """
+        Returns the distance at row `i` and column `j` of the matrix.
+        """
+        k = self.max_distance
+        if k is None:
+            return self.matrix[i][j]
+        d = j - i + k
+        if d < 0 or d > 2*k:
+            return k + 1
+        return self.matrix[i][d]
 
     def _build_diffs(self) -> tuple[list[str], list[str]]:
-        diffa: list[str] = []
-        diffb: list[str] = []
+        # The diffs are built backwards, deques make inserting at the beginning O(1)
+        diffa: deque[str] = deque()
+        diffb: deque[str] = deque()
         # Indices i and j. This allows us to pass these as arguments by reference.
         ij = [self.n, self.m]
         i, j = ij
         while i > 0 and j > 0:
             # Get the cost of all operations
-            cost_shift = self.matrix[i-1][j-1]
-            cost_push_a = self.matrix[i][j-1]
-            cost_push_b = self.matrix[i-1][j]
+            cost_shift = self._cell(i-1, j-1)
+            cost_push_a = self._cell(i, j-1)
+            cost_push_b = self._cell(i-1, j)
             # Select the cheapest one
             cheapest = min([cost_shift, cost_push_a, cost_push_b])
             if cost_push_b == cheapest:
@@ -66,9 +203,9 @@ class Diff2:
             self._push_a(ij, diffa, diffb)
             i, j = ij
 
-        return diffa, diffb
+        return list(diffa), list(diffb)
 
-    def _push_a(self, ij: list[int], diffa: list[str], diffb: list[str]):
+    def _push_a(self, ij: list[int], diffa: Diff, diffb: Diff):
         """
         Copy from b and push a.
         """
@@ -77,7 +214,7 @@ class Diff2:
         diffb.insert(0, char)  # Copy from b
         ij[1] -= 1  # Decrement j
 
-    def _push_b(self, ij: list[int], diffa: list[str], diffb: list[str]):
+    def _push_b(self, ij: list[int], diffa: Diff, diffb: Diff):
         """
         Copy from a and push b.
         """
@@ -86,7 +223,7 @@ class Diff2:
         diffb.insert(0, EMPTY)  # Push b
         ij[0] -= 1  # Decrement i
 
-    def _shift(self, ij: list[int], diffa: list[str], diffb: list[str]):
+    def _shift(self, ij: list[int], diffa: Diff, diffb: Diff):
         """
         Copy the next common character of the sequences and increment both indices.
         """
@@ -139,8 +276,13 @@ class Diff2:
         """
         Compute the distance matrix.
         """
+        if self.max_distance is not None:
+            self._compute_band()
+            return
         # First, compute the base distances
         self._compute_base_distances()
+        self._last_row = 0
+        limits = self.limits
         # Then, compute the remainder using them
         for i in range(1, self.n + 1):
             for j in range(1, self.m + 1):
@@ -154,11 +296,363 @@ class Diff2:
                         self.matrix[i][j] = self.matrix[i][j-1] + 1
                     else:
                         self.matrix[i][j] = self.matrix[i-1][j] + 1
+            self._last_row = i
+            if limits is not None:
+                limits.charge(self.m)
+
+    def _compute_band(self):
+        """
+        Compute the band of the distance matrix, in `O(max_distance * n)` time.
+        Distances above `max_distance` are capped at `max_distance + 1`.
+        It stops as soon as a whole row exceeds `max_distance`, since the distance can only grow from there.
+        """
+        k: int = self.max_distance  # type: ignore
+        cap = k + 1
+        a, b = self._a, self._b
+        # Base distances
+        row = self.matrix[0]
+        for j in range(min(self.m, k) + 1):
+            row[j + k] = j
+        self._last_row = 0
+        limits = self.limits
+        for i in range(1, self.n + 1):
+            previous_row = row
+            row = self.matrix[i]
+            # Column j is at position j - i + k of the row
+            first = max(1, i - k)
+            last = min(self.m, i + k)
+            if i <= k:
+                row[k - i] = i
+            char = a[i-1]
+            for j in range(first, last + 1):
+                d = j - i + k
+                if char == b[j-1]:
+                    # Copy the distance from the diagonal
+                    row[d] = previous_row[d]
+                else:
+                    # The cells to the left and above, the ones outside the band cost `cap`
+                    left = row[d-1] if d > 0 else cap
+                    above = previous_row[d+1] if d < 2*k else cap
+                    value = (left if left <= above else above) + 1
+                    row[d] = value if value < cap else cap
+            self._last_row = i
+            if limits is not None:
+                limits.charge(2*k + 1)
+            if min(row) > k:
+                # Every path to the last cell crosses this row
+                self.matrix[self.n][self.m - self.n + k] = cap
+                return
 
 
 # FUNCTIONS
 
-def diff2(a: str, b: str) -> tuple[int, list[str], list[str]]:
-    '''Performs a diff between strings `a`and `b`.'''
-    result = Diff2(a, b).run()
+def diff2(a: Text, b: Text, max_distance: int | None = None,
+          preprocess: bool = False,
+          limits: Limits | None = None) -> tuple[int, list[str], list[str]] | tuple[None, None, None]:
+    '''Performs a diff between strings `a`and `b`.
+    If `max_distance` is given, returns `(None, None, None)` when the distance exceeds it.
+    If `preprocess` is set, the common prefix, suffix and unique lines are matched first (see `segments`) and only the pieces between them are diffed.
+    This is much faster on similar inputs, but the distance is not guaranteed to be minimal when unique lines are matched.
+    If `limits` is given and one of them is reached, `DiffTimeout` is raised with bounds of the distance.'''
+    if not preprocess:
+        result = Diff2(a, b, max_distance, limits).run()
+        return result
+    distance = 0
+    diffa: list[str] = []
+    diffb: list[str] = []
+    pieces = segments(a, b)
+    for k, (equal, a0, a1, b0, b1) in enumerate(pieces):
+        if equal:
+            diffa.extend(a[a0:a1])
+            diffb.extend(b[b0:b1])
+            continue
+        budget = None if max_distance is None else max_distance - distance
+        try:
+            d, da, db = Diff2(a[a0:a1], b[b0:b1], budget, limits).run()
+        except DiffTimeout as e:
+            _add_bounds(e, distance, pieces[k+1:])
+            raise
+        if d is None:
+            return None, None, None
+        distance += d
+        diffa.extend(da)  # type: ignore
+        diffb.extend(db)  # type: ignore
+    return distance, diffa, diffb
+
+
+def diff2_distance(a: Text, b: Text, max_distance: int | None = None,
+                   preprocess: bool = False, limits: Limits | None = None) -> int | None:
+    '''Computes only the edit distance between `a` and `b`, the first element of `diff2`'s result. See `Diff2.distance`.
+    If `max_distance` is given, returns `None` when the distance exceeds it.
+    If `preprocess` is set, only the pieces between the segments matched by `segments` are compared.
+    `limits` works as in `diff2`.'''
+    if not preprocess:
+        return Diff2(a, b, max_distance, limits).distance()
+    distance = 0
+    pieces = segments(a, b)
+    for k, (equal, a0, a1, b0, b1) in enumerate(pieces):
+        if equal:
+            continue
+        budget = None if max_distance is None else max_distance - distance
+        try:
+            d = Diff2(a[a0:a1], b[b0:b1], budget, limits).distance()
+        except DiffTimeout as e:
+            _add_bounds(e, distance, pieces[k+1:])
+            raise
+        if d is None:
+            return None
+        distance += d
+    return distance
+
+
+def _add_bounds(e: DiffTimeout, distance: int, rest: list[Segment]):
+    '''Extends the bounds of `e`, raised by the diff of a piece, with the `distance` of the previous pieces and the bounds of the `rest`.'''
+    lower = distance + (e.lower or 0)
+    upper = distance + (e.upper or 0)
+    for equal, a0, a1, b0, b1 in rest:
+        if not equal:
+            lower += abs((a1 - a0) - (b1 - b0))
+            upper += (a1 - a0) + (b1 - b0)
+    e.lower, e.upper = lower, upper
+
+
+def _match_masks(s: Text) -> dict:
+    '''Returns a dictionary that maps each element of `s` to the bit mask of its positions in `s`.'''
+    positions: dict = {}
+    for i, char in enumerate(s):
+        positions.setdefault(char, []).append(i)
+    masks = {}
+    for char, indices in positions.items():
+        # Setting the bits in a byte array avoids building a big integer per position
+        bits = bytearray(indices[-1] // 8 + 1)
+        for i in indices:
+            bits[i >> 3] |= 1 << (i & 7)
+        masks[char] = int.from_bytes(bits, 'little')
+    return masks
+
+
+def diff2_files(path_a: str, path_b: str, encoding: str = 'utf-8', errors: str = 'replace',
+                max_distance: int | None = None, preprocess: bool = True,
+                limits: Limits | None = None) -> tuple[int, list[Hunk]] | tuple[None, None]:
+    '''Performs a diff between the files at `path_a`and `path_b`.
+    The files are memory-mapped and compared byte by byte. Only the changed regions are copied and decoded, with `encoding` and `errors`.
+    If `preprocess` is set, the common prefix, suffix and unique lines are matched first (see `segments`), as in `diff2`. The distance is then an upper bound, not guaranteed to be minimal when unique lines are matched. Unset it for the exact distance, at the cost of diffing the whole files.
+    If `max_distance` is given, returns `(None, None)` when the distance exceeds it.
+    `limits` works as in `diff2`.
+    Returns the distance and the list of hunks `(offset_a, removed, offset_b, inserted)`, where the offsets are in bytes.'''
+    with _map(path_a) as a, _map(path_b) as b:
+        view_a = memoryview(a)
+        view_b = memoryview(b)
+        try:
+            distance = 0
+            result: list[Hunk] = []
+            pieces = segments(view_a, view_b) if preprocess else [(False, 0, len(view_a), 0, len(view_b))]
+            for k, (equal, a0, a1, b0, b1) in enumerate(pieces):
+                if equal:
+                    continue
+                budget = None if max_distance is None else max_distance - distance
+                try:
+                    d, diffa, diffb = Diff2(view_a[a0:a1], view_b[b0:b1], budget, limits).run()
+                except DiffTimeout as e:
+                    _add_bounds(e, distance, pieces[k+1:])
+                    raise
+                if d is None:
+                    return None, None
+                distance += d
+                for x0, x1, y0, y1 in hunks(diffa, diffb, a0, b0):  # type: ignore
+                    result.append((x0, str(view_a[x0:x1], encoding, errors),
+                                   y0, str(view_b[y0:y1], encoding, errors)))
+            return distance, result
+        finally:
+            view_a.release()
+            view_b.release()
+
+
+def _map(path: str) -> mmap.mmap | memoryview:
+    '''Memory-maps the file at `path` for reading. Empty files, which cannot be mapped, become empty memoryviews.'''
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            return memoryview(b'')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def hunks(diffa: list, diffb: list, a_start: int = 0, b_start: int = 0) -> list[tuple[int, int, int, int]]:
+    '''Finds the changed regions of the diffs `diffa` and `diffb`, whose first elements are at positions `a_start` and `b_start`.
+    Returns a list of the ranges `(a_start, a_end, b_start, b_end)` of the changed regions.'''
+    result = []
+    i, j = a_start, b_start
+    k = 0
+    while k < len(diffa):
+        if diffa[k] is not EMPTY and diffb[k] is not EMPTY:
+            # Equal elements
+            i += 1
+            j += 1
+            k += 1
+            continue
+        i0, j0 = i, j
+        while k < len(diffa) and (diffa[k] is EMPTY or diffb[k] is EMPTY):
+            if diffa[k] is not EMPTY:
+                i += 1
+            if diffb[k] is not EMPTY:
+                j += 1
+            k += 1
+        result.append((i0, i, j0, j))
     return result
+
+
+def segments(a: Text, b: Text) -> list[Segment]:
+    '''Splits the diff between `a` and `b` into independent segments, in order.
+    The common prefix and suffix are equal segments. The rest is split at anchors: lines that occur exactly once in both sides, in the same order (as in patience diff).
+    Lines are the tokens of strings and bytes-like objects, the elements are the tokens of other sequences. Every piece between anchors is split the same way.
+    Returns a list of `(equal, a_start, a_end, b_start, b_end)`.'''
+    result: list[Segment] = []
+    # Ranges still to split, in reverse order
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+        # Strip the common prefix and suffix
+        prefix = _common_prefix_length(a, a0, a1, b, b0, b1)
+        if prefix:
+            result.append((True, a0, a0 + prefix, b0, b0 + prefix))
+            a0 += prefix
+            b0 += prefix
+        suffix = _common_suffix_length(a, a0, a1, b, b0, b1)
+        anchors = _anchors(a, a0, a1 - suffix, b, b0, b1 - suffix) \
+            if a0 < a1 - suffix and b0 < b1 - suffix else []
+        if suffix:
+            stack.append((a1 - suffix, a1, b1 - suffix, b1))
+            a1 -= suffix
+            b1 -= suffix
+        if not anchors:
+            if a0 < a1 or b0 < b1:
+                result.append((False, a0, a1, b0, b1))
+            continue
+        # Push the pieces between the anchors, and the anchors, in reverse order
+        pieces = []
+        for anchor_a0, anchor_a1, anchor_b0, anchor_b1 in anchors:
+            pieces.append((a0, anchor_a0, b0, anchor_b0))
+            pieces.append((anchor_a0, anchor_a1, anchor_b0, anchor_b1))
+            a0, b0 = anchor_a1, anchor_b1
+        pieces.append((a0, a1, b0, b1))
+        for piece in reversed(pieces):
+            if piece[0] < piece[1] or piece[2] < piece[3]:
+                stack.append(piece)
+    return _merge_segments(result)
+
+
+def _common_prefix_length(a, a0: int, a1: int, b, b0: int, b1: int) -> int:
+    '''Returns the length of the common prefix of `a[a0:a1]` and `b[b0:b1]`.'''
+    size = min(a1 - a0, b1 - b0)
+    # Compare big chunks first, then narrow down
+    length = 0
+    step = 1024
+    while step:
+        while length + step <= size and \
+                a[a0 + length:a0 + length + step] == b[b0 + length:b0 + length + step]:
+            length += step
+        step //= 4
+    return length
+
+
+def _common_suffix_length(a, a0: int, a1: int, b, b0: int, b1: int) -> int:
+    '''Returns the length of the common suffix of `a[a0:a1]` and `b[b0:b1]`.'''
+    size = min(a1 - a0, b1 - b0)
+    length = 0
+    step = 1024
+    while step:
+        while length + step <= size and \
+                a[a1 - length - step:a1 - length] == b[b1 - length - step:b1 - length]:
+            length += step
+        step //= 4
+    return length
+
+
+def _tokens(s, start: int, end: int) -> list[tuple[int, int]]:
+    '''Returns the ranges `(start, end)` of the tokens of `s[start:end]`: lines for strings and bytes-like objects, elements otherwise.'''
+    if isinstance(s, BYTES_LIKE):
+        return [match.span() for match in _BYTES_LINE.finditer(s, start, end)]
+    if not isinstance(s, str):
+        return [(i, i + 1) for i in range(start, end)]
+    tokens = []
+    while start < end:
+        newline = s.find('\n', start, end)
+        stop = end if newline == -1 else newline + 1
+        tokens.append((start, stop))
+        start = stop
+    return tokens
+
+
+def _token(s, start: int, end: int):
+    '''Returns the token of `s` at range `(start, end)`.'''
+    if isinstance(s, str):
+        return s[start:end]
+    if isinstance(s, BYTES_LIKE):
+        token = s[start:end]
+        # Only read-only memoryviews are hashable
+        if isinstance(token, memoryview) and not token.readonly:
+            return token.tobytes()
+        return token
+    return s[start]
+
+
+def _anchors(a, a0: int, a1: int, b, b0: int, b1: int) -> list[tuple[int, int, int, int]]:
+    '''Finds the anchors between `a[a0:a1]` and `b[b0:b1]`: tokens that occur exactly once in each, matched in the longest increasing order.
+    Returns a list of `(a_start, a_end, b_start, b_end)` of the anchors, in order.'''
+    # Occurrences of each token: count in a, count in b, range in a, range in b
+    occurrences: dict = {}
+    for start, end in _tokens(a, a0, a1):
+        entry = occurrences.setdefault(_token(a, start, end), [0, 0, None, None])
+        entry[0] += 1
+        entry[2] = (start, end)
+    for start, end in _tokens(b, b0, b1):
+        entry = occurrences.get(_token(b, start, end))
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = (start, end)
+    matches = sorted((ra + rb) for count_a, count_b, ra, rb in occurrences.values()
+                     if count_a == 1 and count_b == 1)
+    # Longest increasing subsequence of the positions in b (patience sorting)
+    tops: list[int] = []  # Position in b of the top of each pile
+    piles: list[int] = []  # Index of the match on top of each pile
+    previous = [-1] * len(matches)
+    for k, match in enumerate(matches):
+        pile = _bisect(tops, match[2])
+        if pile > 0:
+            previous[k] = piles[pile - 1]
+        if pile == len(tops):
+            tops.append(match[2])
+            piles.append(k)
+        else:
+            tops[pile] = match[2]
+            piles[pile] = k
+    anchors = []
+    k = piles[-1] if piles else -1
+    while k != -1:
+        anchors.append(matches[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+
+def _bisect(values: list[int], x: int) -> int:
+    '''Returns the index of the first element of the sorted list `values` that is not less than `x`.'''
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < x:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _merge_segments(segments: list[Segment]) -> list[Segment]:
+    '''Merges consecutive equal segments.'''
+    merged: list[Segment] = []
+    for segment in segments:
+        if merged and merged[-1][0] and segment[0]:
+            last = merged[-1]
+            merged[-1] = (True, last[1], segment[2], last[3], segment[4])
+        else:
+            merged.append(segment)
+    return merged
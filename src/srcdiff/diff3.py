@@ -0,0 +1,273 @@
+'''Perform three-way diffs and merges of source-code files and trees.'''
+
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Sequence, TextIO
+
+from src.srcdiff.diff2 import BYTES_LIKE, Text, _token, _tokens
+from src.srcdiff.render import alignment
+from src.srcdiff.tree import Tree
+
+
+# TYPES
+
+# A chunk of a three-way diff: its kind and the ranges `[start, end)` of the base, ours and theirs it covers
+Chunk = tuple[str, int, int, int, int, int, int]
+
+
+# CONSTANTS
+
+# Kinds of chunks: unchanged, changed only in ours, changed only in theirs, changed the same way in both, and changed differently
+EQUAL = 'equal'
+OURS = 'ours'
+THEIRS = 'theirs'
+BOTH = 'both'
+CONFLICT = 'conflict'
+
+
+# CLASSES
+
+class Diff3:
+    """Three-way diff of a base and two versions derived from it, ours and theirs.
+    The base is split into tokens and interned once: every distinct token gets an integer id, shared by the three inputs. Both alignments are computed on the ids.
+
+    Attributes:
+    - `base`, `ours` and `theirs` are the lists of tokens of the inputs: lines for strings and bytes-like objects, elements for other sequences.
+    - `jobs` is the number of processes used to compute the alignments. With 2 or more, base→ours and base→theirs are computed concurrently.
+    - `conflicts` is the number of conflicts yielded so far by `merged`.
+    - `_ids` maps each distinct token to its id.
+    - `_base_ids`, `_ours_ids` and `_theirs_ids` are the ids of the tokens of the inputs.
+    - `_runs` holds the equal runs of both alignments once computed (see `alignments`).
+    """
+
+    def __init__(self, base: Text | Sequence, ours: Text | Sequence, theirs: Text | Sequence, jobs: int = 1):
+        """Creates a Diff3 object.
+        The parameters correspond to the class' attributes.
+        """
+        self.jobs = jobs
+        self.conflicts = 0
+        self._ids: dict = {}
+        self.base, self._base_ids = self._intern(base)
+        self.ours, self._ours_ids = self._intern(ours)
+        self.theirs, self._theirs_ids = self._intern(theirs)
+        self._runs: tuple[array, array] | None = None
+
+    def _intern(self, s: Text | Sequence) -> tuple[list, array]:
+        """Splits `s` into tokens and returns them with their ids, adding the new tokens to `_ids`."""
+        ids = self._ids
+        tokens = [_token(s, start, end) for start, end in _tokens(s, 0, len(s))]
+        result = array('q')
+        for token in tokens:
+            k = ids.get(token)
+            if k is None:
+                k = ids[token] = len(ids)
+            result.append(k)
+        return tokens, result
+
+    def alignments(self) -> tuple[array, array]:
+        """Aligns the base with ours and with theirs, in `jobs` processes.
+        Returns the equal runs of both alignments as flat arrays of `(base_start, base_end, other_start)` triples, in order.
+        """
+        if self._runs is None:
+            if self.jobs > 1:
+                with ProcessPoolExecutor(max_workers=2) as pool:
+                    ours = pool.submit(_equal_runs, self._base_ids, self._ours_ids)
+                    theirs = pool.submit(_equal_runs, self._base_ids, self._theirs_ids)
+                    self._runs = (ours.result(), theirs.result())
+            else:
+                self._runs = (_equal_runs(self._base_ids, self._ours_ids),
+                              _equal_runs(self._base_ids, self._theirs_ids))
+        return self._runs
+
+    def chunks(self) -> Iterator[Chunk]:
+        """Merges both alignments in a single pass.
+        The base tokens aligned in both alignments form equal chunks. Each region between them is classified by comparing its three versions.
+        Yields `(kind, base_start, base_end, ours_start, ours_end, theirs_start, theirs_end)` chunks, in order. Consecutive equal chunks are coalesced.
+        """
+        runs_ours, runs_theirs = self.alignments()
+        pending: Chunk | None = None  # Equal chunk not yielded yet
+        # Ends of the last equal chunk in the base, ours and theirs
+        o = a = b = 0
+        i = j = 0
+        while i < len(runs_ours) and j < len(runs_theirs):
+            o0, o1, a0 = runs_ours[i:i+3]
+            p0, p1, b0 = runs_theirs[j:j+3]
+            # Intersection of both runs
+            start = max(o0, p0)
+            end = min(o1, p1)
+            if start < end:
+                x = a0 + start - o0
+                y = b0 + start - p0
+                if (o, a, b) != (start, x, y):
+                    if pending is not None:
+                        yield pending
+                        pending = None
+                    yield self._classify(o, start, a, x, b, y)
+                if pending is None:
+                    pending = (EQUAL, start, end, x, x + end - start, y, y + end - start)
+                else:
+                    pending = (EQUAL, pending[1], end, pending[3], x + end - start, pending[5], y + end - start)
+                o, a, b = end, x + end - start, y + end - start
+            # Advance the run that ends first
+            if o1 <= p1:
+                i += 3
+            else:
+                j += 3
+        if pending is not None:
+            yield pending
+        if (o, a, b) != (len(self.base), len(self.ours), len(self.theirs)):
+            yield self._classify(o, len(self.base), a, len(self.ours), b, len(self.theirs))
+
+    def _classify(self, o0: int, o1: int, a0: int, a1: int, b0: int, b1: int) -> Chunk:
+        """Returns the chunk of the region between equal chunks covering `[o0, o1)` of the base, `[a0, a1)` of ours and `[b0, b1)` of theirs."""
+        base = self._base_ids[o0:o1]
+        ours = self._ours_ids[a0:a1]
+        theirs = self._theirs_ids[b0:b1]
+        if ours == base:
+            kind = EQUAL if theirs == base else THEIRS
+        elif theirs == base:
+            kind = OURS
+        else:
+            kind = BOTH if ours == theirs else CONFLICT
+        return (kind, o0, o1, a0, a1, b0, b1)
+
+    def merged(self, name_ours: str = 'ours', name_theirs: str = 'theirs', name_base: str | None = None) -> Iterator:
+        """Yields the tokens of the merge of ours and theirs, chunk by chunk.
+        Conflicts are surrounded by `<<<<<<< name_ours`, `=======` and `>>>>>>> name_theirs` marker lines. If `name_base` is given, the base version follows a `||||||| name_base` line, as in `diff3 -m`.
+        The markers are bytes if the tokens are.
+        """
+        tokens = self.base or self.ours or self.theirs
+        binary = bool(tokens) and isinstance(tokens[0], BYTES_LIKE)
+        newline = b'\n' if binary else '\n'
+
+        def marker(text: str):
+            line = text + '\n'
+            return line.encode() if binary else line
+
+        last = None  # Last token yielded
+        for kind, o0, o1, a0, a1, b0, b1 in self.chunks():
+            if kind == EQUAL or kind == OURS or kind == BOTH:
+                part = self.ours[a0:a1]
+            elif kind == THEIRS:
+                part = self.theirs[b0:b1]
+            else:
+                self.conflicts += 1
+                parts = [(marker(f'<<<<<<< {name_ours}'), self.ours[a0:a1])]
+                if name_base is not None:
+                    parts.append((marker(f'||||||| {name_base}'), self.base[o0:o1]))
+                parts.append((marker('======='), self.theirs[b0:b1]))
+                for line, part in parts:
+                    if last is not None and not _ends_line(last):
+                        yield newline
+                    yield line
+                    yield from part
+                    last = part[-1] if part else line
+                if not _ends_line(last):
+                    yield newline
+                last = marker(f'>>>>>>> {name_theirs}')
+                yield last
+                continue
+            yield from part
+            if part:
+                last = part[-1]
+
+
+# FUNCTIONS
+
+def _equal_runs(base: array, other: array) -> array:
+    '''Aligns the ids `base` and `other`. Returns the equal runs as a flat array of `(base_start, base_end, other_start)` triples, in order.'''
+    result = array('q')
+    for equal, a0, a1, b0, _ in alignment(base, other):
+        if equal and a0 < a1:
+            result.extend((a0, a1, b0))
+    return result
+
+
+def _ends_line(token) -> bool:
+    '''Whether `token` ends with a line break.'''
+    return isinstance(token, (str, *BYTES_LIKE)) and len(token) > 0 and token[-1:] in ('\n', b'\n')
+
+
+def diff3(base: Text | Sequence, ours: Text | Sequence, theirs: Text | Sequence, jobs: int = 1) -> Iterator[Chunk]:
+    '''Performs a three-way diff of `base`, `ours` and `theirs`. See `Diff3.chunks`.
+    With `jobs` of 2 or more, both alignments are computed concurrently.'''
+    return Diff3(base, ours, theirs, jobs).chunks()
+
+
+def merge3(out: TextIO, base: Text | Sequence, ours: Text | Sequence, theirs: Text | Sequence,
+           name_ours: str = 'ours', name_theirs: str = 'theirs', name_base: str | None = None, jobs: int = 1) -> int:
+    '''Writes the merge of `ours` and `theirs`, both derived from `base`, to `out`, one chunk at a time.
+    Conflicts are written between markers, see `Diff3.merged`. `out` must be binary if the inputs are bytes-like.
+    Returns the number of conflicts.'''
+    d = Diff3(base, ours, theirs, jobs)
+    for token in d.merged(name_ours, name_theirs, name_base):
+        out.write(token)
+    return d.conflicts
+
+
+def tree_merge3(base: Tree, ours: Tree, theirs: Tree) -> tuple[Tree, int]:
+    '''Merges the trees `ours` and `theirs`, both derived from `base`, structurally.
+    The children of each node are aligned by subtree digests with `Diff3`. A child changed on one side only is taken from that side. When both sides changed the same child differently and kept its type, the child is merged recursively; otherwise the region is a conflict.
+    Unlike a line merge, changes to neighbouring children on different sides, e.g. to two consecutive functions, do not conflict.
+    A conflict becomes a `Conflict` node with `Base`, `Ours` and `Theirs` children holding the versions of the region.
+    The inputs are not modified. Returns the merged tree and the number of conflicts.'''
+    conflicts = 0
+    result: list[Tree] = []
+    label = _merge_label(base, ours, theirs)
+    if label is None:
+        return _conflict([base], [ours], [theirs]), 1
+    # Nodes being merged: the three versions, their merged label, their chunks and their merged children
+    stack = [(base, ours, theirs, label, _child_chunks(base, ours, theirs), [])]
+    while stack:
+        b, o, t, label, chunks, children = stack[-1]
+        chunk = next(chunks, None)
+        if chunk is None:
+            stack.pop()
+            node = Tree(label[0], label[1], children)
+            (stack[-1][5] if stack else result).append(node)
+            continue
+        kind, b0, b1, o0, o1, t0, t1 = chunk
+        if kind != CONFLICT:
+            side = t.children[t0:t1] if kind == THEIRS else o.children[o0:o1]
+            children.extend(c.copy() for c in side)
+            continue
+        if b1 - b0 == o1 - o0 == t1 - t0 == 1:
+            x, y, z = b.children[b0], o.children[o0], t.children[t0]
+            child_label = _merge_label(x, y, z)
+            if child_label is not None:
+                stack.append((x, y, z, child_label, _child_chunks(x, y, z), []))
+                continue
+        conflicts += 1
+        children.append(_conflict(b.children[b0:b1], o.children[o0:o1], t.children[t0:t1]))
+    return result[0], conflicts
+
+
+def _child_chunks(base: Tree, ours: Tree, theirs: Tree) -> Iterator[Chunk]:
+    '''Yields the chunks of the three-way diff of the children of `base`, `ours` and `theirs`, compared by digests.
+    Conflicts of the same length in the three versions, e.g. neighbouring children changed on different sides, are split into one chunk per position.'''
+    d = Diff3(*([c.digest() for c in node.children] for node in (base, ours, theirs)))
+    for chunk in d.chunks():
+        kind, b0, b1, o0, o1, t0, t1 = chunk
+        if kind != CONFLICT or not b1 - b0 == o1 - o0 == t1 - t0:
+            yield chunk
+            continue
+        for k in range(b1 - b0):
+            yield d._classify(b0 + k, b0 + k + 1, o0 + k, o0 + k + 1, t0 + k, t0 + k + 1)
+
+
+def _merge_label(base: Tree, ours: Tree, theirs: Tree) -> tuple | None:
+    '''Returns the merged `(type, value)` of three versions of a node, or `None` if they conflict or its type changed.'''
+    if not base.type == ours.type == theirs.type:
+        return None
+    if ours.value == base.value:
+        return (theirs.type, theirs.value)
+    if theirs.value == base.value or theirs.value == ours.value:
+        return (ours.type, ours.value)
+    return None
+
+
+def _conflict(base: list[Tree], ours: list[Tree], theirs: list[Tree]) -> Tree:
+    '''Returns a `Conflict` node holding copies of the three versions of a region.'''
+    return Tree('Conflict', None, [Tree(name, None, [c.copy() for c in nodes])
+                                   for name, nodes in (('Base', base), ('Ours', ours), ('Theirs', theirs))])
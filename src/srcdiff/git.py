@@ -0,0 +1,159 @@
+'''Diff revisions of a local git repository without checking them out.'''
+
+
+import ast
+import subprocess
+from collections import OrderedDict
+
+from src.srcdiff.diff2 import diff2
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+
+
+# CONSTANTS
+
+# SHA of a missing side of a change, as reported by `git diff-tree`
+NULL_SHA = '0' * 40
+
+
+# CLASSES
+
+class GitRepository:
+    """Reads the files of a local git repository.
+    Blobs are read through a single long-lived `git cat-file --batch` process and parsed trees are cached by blob SHA.
+    The cached trees are shared: `file_tree` attaches a copy of them, so a blob can appear at several paths.
+
+    Attributes:
+    - `path` is the path to the repository.
+    - `cache_size` is the maximum number of parsed blobs kept in memory.
+    - `_cat_file` is the `git cat-file --batch` process, started on the first read.
+    - `_trees` maps blob SHAs to their parsed `Module` trees, in least recently used order.
+    """
+
+    def __init__(self, path: str, cache_size: int = 1024):
+        """Creates a GitRepository object.
+        `path` and `cache_size` correspond to the class' attributes.
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self._cat_file: subprocess.Popen | None = None
+        self._trees: OrderedDict[str, Tree] = OrderedDict()
+
+    def __enter__(self) -> 'GitRepository':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Stops the `git cat-file` process."""
+        if self._cat_file is not None:
+            self._cat_file.stdin.close()  # type: ignore
+            self._cat_file.wait()
+            self._cat_file = None
+
+    def _git(self, *args: str) -> bytes:
+        """Runs a git command in the repository and returns its output."""
+        return subprocess.run(['git', '-C', self.path, *args],
+                              check=True, capture_output=True).stdout
+
+    def changes(self, rev_a: str, rev_b: str) -> list[tuple[str, str, str]]:
+        """Lists the files that differ between revisions `rev_a` and `rev_b`.
+        Files whose blob SHA did not change are not listed.
+        Returns a list of `(path, sha_a, sha_b)`, where the SHA of a missing side is `NULL_SHA`.
+        """
+        out = self._git('diff-tree', '-r', '-z', '--no-renames', rev_a, rev_b)
+        fields = out.split(b'\0')
+        changes = []
+        # Each change is a metadata field followed by a path field
+        for k in range(0, len(fields) - 1, 2):
+            meta = fields[k].decode().split()
+            path = fields[k+1].decode()
+            # Metadata is ":mode_a mode_b sha_a sha_b status". Skip submodules and symlinks.
+            if meta[0][1:] not in ('000000', '100644', '100755') or \
+                    meta[1] not in ('000000', '100644', '100755'):
+                continue
+            changes.append((path, meta[2], meta[3]))
+        return changes
+
+    def read_blob(self, sha: str) -> bytes:
+        """Returns the contents of the blob `sha`."""
+        if self._cat_file is None:
+            self._cat_file = subprocess.Popen(['git', '-C', self.path, 'cat-file', '--batch'],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        stdin, stdout = self._cat_file.stdin, self._cat_file.stdout
+        stdin.write(sha.encode() + b'\n')  # type: ignore
+        stdin.flush()  # type: ignore
+        # The header is "<sha> <type> <size>" or "<sha> missing"
+        header = stdout.readline().split()  # type: ignore
+        if len(header) != 3:
+            raise KeyError(f'Missing object {sha}')
+        contents = stdout.read(int(header[2]))  # type: ignore
+        stdout.read(1)  # type: ignore # Trailing newline
+        return contents
+
+    def parse(self, sha: str) -> Tree:
+        """Returns the `Module` tree of the Python blob `sha`."""
+        tree = self._trees.get(sha)
+        if tree is None:
+            tree = Tree.from_AST(ast.parse(self.read_blob(sha)))
+            self._trees[sha] = tree
+            if len(self._trees) > self.cache_size:
+                self._trees.popitem(last=False)
+        else:
+            self._trees.move_to_end(sha)
+        return tree
+
+    def file_tree(self, path: str, sha: str) -> Tree | None:
+        """Returns the `File` tree of blob `sha` at `path`, or `None` if `sha` is `NULL_SHA`.
+        The `Module` is a copy of the cached tree, which is left without a `parent`.
+        """
+        if sha == NULL_SHA:
+            return None
+        return Tree('File', path, [self.parse(sha).copy()])
+
+    def text(self, sha: str) -> str:
+        """Returns the contents of the blob `sha` as text, or an empty string if `sha` is `NULL_SHA`."""
+        if sha == NULL_SHA:
+            return ''
+        return self.read_blob(sha).decode()
+
+
+# FUNCTIONS
+
+def diff_revisions(repo: str | GitRepository, rev_a: str, rev_b: str,
+                   engine: str = 'tree',
+                   extensions: tuple[str, ...] = ('.py',)) -> list[tuple[str, int | None]]:
+    '''Performs a diff between revisions `rev_a` and `rev_b` of the git repository `repo`.
+    Only files whose blob changed and whose names end with one of `extensions` are compared.
+    `engine` is `'tree'` to compare the files with `tree_diff2` or `'text'` to compare them with `diff2`.
+    Added and removed files cost the size of their trees (or texts).
+    Files that cannot be parsed on either side are reported with a `None` distance instead of aborting the diff.
+    Returns a list of `(path, distance)`.'''
+    if engine not in ('tree', 'text'):
+        raise ValueError(f'Unknown engine: {engine}')
+    owned = not isinstance(repo, GitRepository)
+    repository = GitRepository(repo) if owned else repo  # type: ignore
+    try:
+        result = []
+        for path, sha_a, sha_b in repository.changes(rev_a, rev_b):
+            if not path.endswith(extensions):
+                continue
+            if engine == 'text':
+                distance = diff2(repository.text(sha_a), repository.text(sha_b))[0]
+            else:
+                try:
+                    a = repository.file_tree(path, sha_a)
+                    b = repository.file_tree(path, sha_b)
+                except (SyntaxError, ValueError):
+                    result.append((path, None))
+                    continue
+                if a is None or b is None:
+                    distance = len(a or b)  # type: ignore
+                else:
+                    distance = tree_diff2(a, b)
+            result.append((path, distance))
+        return result
+    finally:
+        if owned:
+            repository.close()
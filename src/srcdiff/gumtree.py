@@ -0,0 +1,293 @@
+'''Approximate tree diffs in near-linear time, following the GumTree matching algorithm.'''
+
+
+import heapq
+from bisect import bisect_left
+from collections import deque
+
+from src.srcdiff.costs import CostModel, UNIT_COSTS
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+
+
+# CLASSES
+
+class GumTreeMatcher:
+    """Matches the nodes of two Trees in two greedy phases:
+    - Top-down: the highest identical subtrees (by structural hash) are matched whole, if they are unique on both sides.
+    - Bottom-up: unmatched containers are matched to a node of the same type that holds most of the partners of their descendants, if the Dice similarity is high enough.
+      The unmatched children of matched containers are then matched, in order: first the identical subtrees, then by label.
+    The matches are then filtered into a valid edit mapping: it preserves the postorder and the ancestors of the nodes, so the cost of the mapping is an upper bound of the `TreeDiff2` distance.
+
+    Attributes:
+    - `a` and `b` are the Trees.
+    - `cost_model` gives the costs of the edit operations.
+    - `min_height` is the minimum height of the subtrees matched top-down.
+    - `min_dice` is the minimum Dice similarity of the containers matched bottom-up.
+    - `partner_a` maps each index of `a` to the index of its partner in `b`, or 0 if it is not matched.
+    - `partner_b` maps each index of `b` to the index of its partner in `a`, or 0 if it is not matched.
+    """
+
+    def __init__(self, a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS,
+                 min_height: int = 1, min_dice: float = 0.5):
+        """Creates a GumTreeMatcher object.
+        The parameters correspond to the class' attributes.
+        """
+        self.a = a
+        self.b = b
+        self.cost_model = cost_model
+        self.min_height = min_height
+        self.min_dice = min_dice
+        self.partner_a = [0] * (len(a) + 1)
+        self.partner_b = [0] * (len(b) + 1)
+
+    def match(self) -> list[tuple[int, int]]:
+        """Matches the nodes of `a` and `b`.
+        Returns the list of matched pairs of indices `(i, j)`, in increasing order.
+        """
+        self._match_top_down()
+        self._match_bottom_up()
+        self._match_roots()
+        return self._filter()
+
+    def _map(self, i: int, j: int):
+        """Matches the node `i` of `a` with the node `j` of `b`."""
+        self.partner_a[i] = j
+        self.partner_b[j] = i
+
+    def _match_top_down(self):
+        """Matches identical subtrees, from the highest to the lowest."""
+        a, b = self.a, self.b
+        # Heaps of the open nodes, by decreasing height
+        heap_a = [(-a.height, len(a))]
+        heap_b = [(-b.height, len(b))]
+        while heap_a and heap_b:
+            height = max(-heap_a[0][0], -heap_b[0][0])
+            if height < self.min_height:
+                break
+            nodes_a = _pop_height(heap_a, height)
+            nodes_b = _pop_height(heap_b, height)
+            if not nodes_a or not nodes_b:
+                # Only one side has subtrees this high, they cannot be matched
+                _open(heap_a, a, nodes_a)
+                _open(heap_b, b, nodes_b)
+                continue
+            # Group the subtrees of both sides by hash
+            groups: dict[int, tuple[list[int], list[int]]] = {}
+            for i in nodes_a:
+                groups.setdefault(a[i].structural_hash, ([], []))[0].append(i)
+            for j in nodes_b:
+                groups.setdefault(b[j].structural_hash, ([], []))[1].append(j)
+            unmatched_a = []
+            unmatched_b = []
+            for group_a, group_b in groups.values():
+                if len(group_a) == 1 and len(group_b) == 1 and a[group_a[0]]._same_as(b[group_b[0]]):
+                    self._map_subtrees(group_a[0], group_b[0])
+                elif not group_a or not group_b:
+                    unmatched_a.extend(group_a)
+                    unmatched_b.extend(group_b)
+                # Ambiguous subtrees are left for the containers that hold them (see `_match_children`)
+            _open(heap_a, a, unmatched_a)
+            _open(heap_b, b, unmatched_b)
+
+    def _map_subtrees(self, i: int, j: int):
+        """Matches the nodes of the identical subtrees of the node `i` of `a` and the node `j` of `b`."""
+        # The subtrees have the same shape, so their nodes are at the same offsets
+        offset = j - i
+        for x in range(i - len(self.a[i]) + 1, i + 1):
+            self._map(x, x + offset)
+
+    def _match_bottom_up(self):
+        """Matches the unmatched containers of `a`, in postorder, with the most similar candidate of `b`.
+        The candidates are the closest unmatched ancestors, of the same type, of the partners of their children.
+        """
+        a, b = self.a, self.b
+        partner_a, partner_b = self.partner_a, self.partner_b
+        lmlds_a, lmlds_b = a.lmlds, b.lmlds
+        index_of_b = b.index_of
+        for c in range(1, len(a) + 1):
+            node = a[c]
+            if partner_a[c] or not node.children:
+                continue
+            candidates = set()
+            for child in node.children:
+                p = partner_a[a.index_of[child]]
+                if not p:
+                    continue
+                q = b[p].parent
+                while q is not None:
+                    d = index_of_b.get(q)
+                    if d is None:
+                        break
+                    if not partner_b[d] and q.type == node.type:
+                        candidates.add(d)
+                        break
+                    q = q.parent
+            best, best_dice = 0, self.min_dice
+            descendants = partner_a[lmlds_a[c]:c]
+            for d in sorted(candidates):
+                low = lmlds_b[d]
+                common = sum(1 for p in descendants if low <= p < d)
+                dice = 2 * common / (len(descendants) + d - low)
+                if dice > best_dice or (dice == best_dice and not best):
+                    best, best_dice = d, dice
+            if best:
+                self._map(c, best)
+                self._match_children(c, best)
+
+    def _match_roots(self):
+        """Matches the roots if they are unmatched and replacing one by the other is not more expensive than deleting and inserting them."""
+        n, m = len(self.a), len(self.b)
+        if self.partner_a[n] or self.partner_b[m]:
+            return
+        la, lb = _label(self.a), _label(self.b)
+        cost = self.cost_model
+        if cost.rename_cost(la, lb) <= cost.delete_cost(la) + cost.insert_cost(lb):
+            self._map(n, m)
+            self._match_children(n, m)
+
+    def _match_children(self, i: int, j: int):
+        """Matches the unmatched children of the matched nodes `i` of `a` and `j` of `b`, in order:
+        first the identical subtrees, then the remaining nodes with the same label, whose children are matched the same way.
+        """
+        a, b = self.a, self.b
+        stack = [(i, j)]
+        while stack:
+            i, j = stack.pop()
+            for identical in (True, False):
+                # Unmatched children of `j`, in order, by key
+                children_b: dict[object, deque[int]] = {}
+                for child in b[j].children:
+                    y = b.index_of[child]
+                    if not self.partner_b[y]:
+                        key = child.structural_hash if identical else _label(child)
+                        children_b.setdefault(key, deque()).append(y)
+                for child in a[i].children:
+                    x = a.index_of[child]
+                    if self.partner_a[x]:
+                        continue
+                    candidates = children_b.get(child.structural_hash if identical else _label(child))
+                    if not candidates:
+                        continue
+                    y = candidates.popleft()
+                    if not identical:
+                        self._map(x, y)
+                        stack.append((x, y))
+                    elif child._same_as(b[y]) and not any(self.partner_a[x - len(child) + 1:x]) \
+                            and not any(self.partner_b[y - len(child) + 1:y]):
+                        self._map_subtrees(x, y)
+
+    def _filter(self) -> list[tuple[int, int]]:
+        """Drops matches until they form a valid edit mapping.
+        First, the longest subsequence of matches increasing in both postorders is kept. Then, in postorder, a match is kept only if the kept matches below it on both sides are the same.
+        Returns the kept pairs, in increasing order.
+        """
+        pairs = [(i, j) for i, j in enumerate(self.partner_a) if j]
+        lmlds_a, lmlds_b = self.a.lmlds, self.b.lmlds
+        kept_a: list[int] = []
+        kept_b: list[int] = []
+        for i, j in _increasing(pairs):
+            below_a = len(kept_a) - bisect_left(kept_a, lmlds_a[i])
+            below_b = len(kept_b) - bisect_left(kept_b, lmlds_b[j])
+            if below_a == below_b:
+                kept_a.append(i)
+                kept_b.append(j)
+        self.partner_a = [0] * len(self.partner_a)
+        self.partner_b = [0] * len(self.partner_b)
+        for i, j in zip(kept_a, kept_b):
+            self._map(i, j)
+        return list(zip(kept_a, kept_b))
+
+    def costs(self) -> tuple[list[int | float], list[int | float]]:
+        """Returns the prefix sums, in postorder, of the costs of the mapping on each side:
+        the cost of deleting or renaming each node of `a` and of inserting each node of `b`.
+        The cost of the mapping restricted to the subtrees of a matched pair `(i, j)` is
+        `prefix_a[i] - prefix_a[lmld_a(i) - 1] + prefix_b[j] - prefix_b[lmld_b(j) - 1]`.
+        """
+        cost = self.cost_model
+        prefix_a: list[int | float] = [0]
+        for i in range(1, len(self.a) + 1):
+            j = self.partner_a[i]
+            label = _label(self.a[i])
+            prefix_a.append(prefix_a[-1] + (cost.rename_cost(label, _label(self.b[j])) if j
+                                            else cost.delete_cost(label)))
+        prefix_b: list[int | float] = [0]
+        for j in range(1, len(self.b) + 1):
+            prefix_b.append(prefix_b[-1] + (0 if self.partner_b[j] else cost.insert_cost(_label(self.b[j]))))
+        return prefix_a, prefix_b
+
+
+# FUNCTIONS
+
+def approximate_tree_diff2(a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS,
+                           recovery_size: int = 100, **options) -> tuple[int | float, bool]:
+    '''Approximates the diff between Trees `a` and `b` with a `GumTreeMatcher`, in near-linear time.
+    The result is the cost of the matching, which is never lower than `tree_diff2`.
+    Then, the highest matched pairs of subtrees with at most `recovery_size` nodes each and a nonzero cost are recovered: the cost of their part of the matching is replaced by their exact `tree_diff2`.
+    `options` are passed to the `GumTreeMatcher`.
+    Returns the distance and whether it is exact, which happens when the roots are matched to each other and recovered, or the Trees are equal.'''
+    matcher = GumTreeMatcher(a, b, cost_model, **options)
+    matcher.match()
+    prefix_a, prefix_b = matcher.costs()
+    distance = prefix_a[-1] + prefix_b[-1]
+    exact = distance == 0
+    lmlds_a, lmlds_b = a.lmlds, b.lmlds
+    # Look for the pairs to recover from the root down, without entering recovered subtrees
+    stack = [len(a)]
+    while stack and recovery_size > 0:
+        i = stack.pop()
+        j = matcher.partner_a[i]
+        if j:
+            inner = prefix_a[i] - prefix_a[lmlds_a[i] - 1] + prefix_b[j] - prefix_b[lmlds_b[j] - 1]
+            if inner == 0:
+                continue
+            if len(a[i]) <= recovery_size and len(b[j]) <= recovery_size:
+                distance -= inner - min(inner, tree_diff2(a[i], b[j], cost_model))
+                exact = exact or (i == len(a) and j == len(b))
+                continue
+        stack.extend(a.index_of[c] for c in a[i].children)
+    return distance, exact
+
+
+def _label(node: Tree) -> tuple:
+    '''Returns the label of `node`.'''
+    return node.type, node.value
+
+
+def _pop_height(heap: list[tuple[int, int]], height: int) -> list[int]:
+    '''Pops the indices of the nodes of `height` from the top of `heap`.'''
+    nodes = []
+    while heap and -heap[0][0] == height:
+        nodes.append(heapq.heappop(heap)[1])
+    return nodes
+
+
+def _open(heap: list[tuple[int, int]], tree: Tree, nodes: list[int]):
+    '''Pushes the children of `nodes` of `tree` to `heap`.'''
+    index_of = tree.index_of
+    for i in nodes:
+        for c in tree[i].children:
+            heapq.heappush(heap, (-c.height, index_of[c]))
+
+
+def _increasing(pairs: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    '''Returns the longest subsequence of `pairs`, sorted by their first element, whose second elements increase.'''
+    tails: list[int] = []  # Second element of the last pair of the best subsequence of each length
+    tail_at: list[int] = []  # Position in `pairs` of that pair
+    previous = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        length = bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            tail_at.append(k)
+        else:
+            tails[length] = j
+            tail_at[length] = k
+        previous[k] = tail_at[length - 1] if length else -1
+    result = []
+    k = tail_at[-1] if tail_at else -1
+    while k != -1:
+        result.append(pairs[k])
+        k = previous[k]
+    result.reverse()
+    return result
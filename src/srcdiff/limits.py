@@ -0,0 +1,88 @@
+'''Work budgets, deadlines and cancellation of long diffs.'''
+
+
+import asyncio
+import threading
+import time
+
+
+# CLASSES
+
+class DiffTimeout(TimeoutError):
+    """Raised when a diff runs out of budget or time, or is cancelled.
+
+    Attributes:
+    - `reason` is `'budget'`, `'deadline'` or `'cancelled'`.
+    - `lower` and `upper` bound the distance that was being computed, or are `None` if they are unknown.
+    """
+
+    def __init__(self, reason: str, lower: int | float | None = None, upper: int | float | None = None):
+        super().__init__(f'Diff stopped: {reason}')
+        self.reason = reason
+        self.lower = lower
+        self.upper = upper
+
+
+class CancellationToken:
+    """Flag that stops the diffs that check it. It can be set from any thread, e.g. from an asyncio event loop while the diff runs in a worker thread."""
+
+    def __init__(self):
+        """Creates a CancellationToken that is not cancelled."""
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Asks the diffs checking this token to stop."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether `cancel` was called."""
+        return self._event.is_set()
+
+
+class Limits:
+    """Limits of the work of one or more diffs, checked periodically by their dynamic programming loops.
+    The work is measured in cells of the dynamic programming tables. Work and time are shared by every diff the object is passed to.
+
+    Attributes:
+    - `budget` is the maximum number of cells to compute, or `None` for no limit.
+    - `deadline` is the `time.monotonic()` time to stop at, or `None` for no limit.
+    - `token` is a `CancellationToken` to stop at, or `None`.
+    - `used` is the number of cells computed so far.
+    """
+
+    def __init__(self, budget: int | None = None, timeout: float | None = None,
+                 deadline: float | None = None, token: CancellationToken | None = None):
+        """Creates a Limits object.
+        `timeout` is a number of seconds from now, an alternative to `deadline`. If both are given, the earliest is used.
+        The other parameters correspond to the class' attributes.
+        """
+        if timeout is not None:
+            timeout_deadline = time.monotonic() + timeout
+            deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+        self.budget = budget
+        self.deadline = deadline
+        self.token = token
+        self.used = 0
+
+    def charge(self, cells: int):
+        """Accounts for `cells` computed cells, then raises `DiffTimeout` if a limit is reached."""
+        self.used += cells
+        if self.token is not None and self.token.cancelled:
+            raise DiffTimeout('cancelled')
+        if self.budget is not None and self.used > self.budget:
+            raise DiffTimeout('budget')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DiffTimeout('deadline')
+
+
+# FUNCTIONS
+
+async def run_in_thread(func, *args, token: CancellationToken, **kwargs):
+    '''Runs `func(*args, **kwargs)` in a worker thread and returns its result.
+    If the awaiting task is cancelled (e.g. by `asyncio.wait_for`), `token` is cancelled, so that a diff limited by it stops too.'''
+    try:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
@@ -0,0 +1,190 @@
+'''Compute the tree distances between every pair of many trees, e.g. to detect clones among the files of a project.'''
+
+
+import copy
+from array import array
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator
+
+from src.srcdiff.costs import CostModel, LabelTable, UNIT_COSTS
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import PreparedTree
+
+
+# CONSTANTS
+
+# Maximum number of local table cells computed by each task sent to a worker
+TASK_CELLS = 1 << 26
+
+# Value of the label that stands for the labels of a type found in a single tree, see `_share_labels`. It equals no other value.
+_UNSHARED = object()
+
+
+# CLASSES
+
+class DistanceMatrix:
+    """Square matrix of the distances between `n` trees, indexed as `matrix[i, j]`.
+
+    Attributes:
+    - `n` is the number of trees.
+    - `values` is a flat `array` of the `n*n` distances, row by row: integers (`'q'`) for integer costs and floats (`'d'`) otherwise.
+      It supports the buffer protocol, e.g. `numpy.frombuffer(matrix.values, dtype=matrix.values.typecode).reshape(n, n)` views it without copying.
+    """
+
+    def __init__(self, n: int, typecode: str = 'q'):
+        """Creates a matrix of `n*n` zeros."""
+        self.n = n
+        self.values = array(typecode, bytes(n * n * array(typecode).itemsize))
+
+    def __getitem__(self, ij: tuple[int, int]) -> int | float:
+        i, j = ij
+        return self.values[i * self.n + j]
+
+    def __setitem__(self, ij: tuple[int, int], distance: int | float):
+        i, j = ij
+        self.values[i * self.n + j] = distance
+
+    def __len__(self):
+        return self.n
+
+    def row(self, i: int) -> array:
+        """Returns the distances from tree `i` to every tree."""
+        return self.values[i * self.n:(i + 1) * self.n]
+
+    def tolist(self) -> list[list[int | float]]:
+        """Returns the matrix as a list of lists."""
+        return [self.row(i).tolist() for i in range(self.n)]
+
+
+# FUNCTIONS
+
+def distance_matrix(trees: list[Tree | PreparedTree], cost_model: CostModel = UNIT_COSTS,
+                    jobs: int = 1) -> DistanceMatrix:
+    '''Computes the `tree_diff2` distance between every pair of `trees`.
+    Each tree is preprocessed once (see `PreparedTree`); `trees` may already hold prepared trees, computed with `cost_model`.
+    Trees with equal digests are diffed once, as one tree. With a symmetric cost model (see `CostModel.is_symmetric`), only one distance of each pair is computed.
+    The labels of all trees are numbered in a shared table, so that the rename costs are computed once rather than for each pair (see `_share_labels`).
+    The pairs are split in tasks of similar work, computed by `jobs` processes. Each worker receives the prepared trees and the rename costs once and reuses one table for all its pairs.
+    Returns the distances as a `DistanceMatrix`.'''
+    prepared = [t if isinstance(t, PreparedTree) else PreparedTree(t, cost_model) for t in trees]
+    if any(p.cost_model.fingerprint() != cost_model.fingerprint() for p in prepared):
+        raise ValueError('Trees must be prepared with the given cost model')
+    # Group the trees by digest, the first one of each group represents it
+    groups: dict[bytes, list[int]] = {}
+    for i, p in enumerate(prepared):
+        groups.setdefault(p.digest, []).append(i)
+    members = list(groups.values())
+    unique, rename = _share_labels([prepared[g[0]] for g in members], cost_model)
+    symmetric = cost_model.is_symmetric()
+    matrix = DistanceMatrix(len(prepared), 'q' if cost_model.is_integral() else 'd')
+
+    def store(pairs: array, distances: list):
+        for k, distance in enumerate(distances):
+            u, v = pairs[2*k], pairs[2*k + 1]
+            for i in members[u]:
+                for j in members[v]:
+                    matrix[i, j] = distance
+                    if symmetric:
+                        matrix[j, i] = distance
+
+    if jobs <= 1:
+        _init_worker(unique, rename)
+        try:
+            for pairs in _tasks(unique, symmetric, 1):
+                store(pairs, _distances_in_worker(pairs))
+        finally:
+            _init_worker([], [])
+        return matrix
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(unique, rename)) as pool:
+        # Keep a few tasks per worker in flight, the pairs are generated as the results arrive
+        pending = {}
+        for pairs in _tasks(unique, symmetric, jobs):
+            if len(pending) >= 4 * jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(pending.pop(future), future.result())
+            pending[pool.submit(_distances_in_worker, pairs)] = pairs
+        for future, pairs in pending.items():
+            store(pairs, future.result())
+    return matrix
+
+
+def _share_labels(trees: list[PreparedTree], cost_model: CostModel) -> tuple[list[PreparedTree], list[list]]:
+    '''Numbers the labels of `trees` in a single table, to compute their rename costs once for every pair of them.
+    A label found in a single tree is never equal to a label of another tree, so it costs the same to rename as any other label of its type. The labels of each type found in a single tree thus share one id, and the table grows with the labels the trees have in common rather than with all of them.
+    Returns copies of `trees` numbered in the shared table, and the rename costs by pair of its label ids.'''
+    counts = Counter(label for t in trees for label in t.labels.labels)
+    table = LabelTable()
+    shared = []
+    for t in trees:
+        # Ids in the shared table, by id in the table of the tree
+        ids = [table.intern(label if counts[label] > 1 else (label[0], _UNSHARED)) for label in t.labels.labels]
+        s = copy.copy(t)
+        s.labels = table
+        s.ids = array('q', [-1] + [ids[id_] for id_ in t.ids[1:]])
+        shared.append(s)
+    rename = cost_model.rename_matrix(table, table)
+    for id_, (type_, value) in enumerate(table.labels):
+        if value is _UNSHARED:
+            # Both labels stand for different labels, found in different trees
+            rename[id_][id_] = cost_model.rename_cost((type_, None), (type_, _UNSHARED))
+    return shared, rename
+
+
+def _tasks(trees: list[PreparedTree], symmetric: bool, jobs: int) -> Iterator[array]:
+    '''Yields the pairs of distinct `trees` to diff, as flat arrays of `(u, v)` indices.
+    If `symmetric` is set, only the pairs with `u < v` are yielded.
+    The work of a pair is the number of cells of its local tables, the product of the keyroot subtree sizes of both trees. Tasks hold up to `TASK_CELLS` cells, and less if needed to give each of the `jobs` workers several tasks.'''
+    work = [sum(k - t.lmlds[k] + 1 for k in t.keyroots) for t in trees]
+    total = sum(work) ** 2 - sum(w * w for w in work)
+    if symmetric:
+        total //= 2
+    limit = max(1, min(TASK_CELLS, total // (4 * jobs)))
+    pairs = array('q')
+    cells = 0
+    for u in range(len(trees)):
+        for v in range(u + 1 if symmetric else 0, len(trees)):
+            if u == v:
+                continue
+            pairs.extend((u, v))
+            cells += work[u] * work[v]
+            if cells >= limit:
+                yield pairs
+                pairs = array('q')
+                cells = 0
+    if pairs:
+        yield pairs
+
+
+# WORKER FUNCTIONS
+# These run in the worker processes of `distance_matrix`, or in this process with `jobs=1`.
+
+_worker_trees: list[PreparedTree] = []
+# Rename costs by pair of label ids of the trees
+_worker_rename: list[list] = []
+# Permanent table reused by every pair, grown as needed
+_worker_table: list[list] = []
+
+
+def _init_worker(trees: list[PreparedTree], rename: list[list]):
+    '''Receives the prepared trees and their rename costs.'''
+    global _worker_trees, _worker_rename, _worker_table
+    _worker_trees = trees
+    _worker_rename = rename
+    _worker_table = []
+
+
+def _distances_in_worker(pairs: array) -> list[int | float]:
+    '''Computes the distances of the flat `(u, v)` pairs `pairs` of the prepared trees.'''
+    result = []
+    for k in range(0, len(pairs), 2):
+        a, b = _worker_trees[pairs[k]], _worker_trees[pairs[k + 1]]
+        # Stale cells are never read: a keyroot pair only reads the cells of smaller pairs, computed before it
+        for row in _worker_table:
+            if len(row) < b.size:
+                row.extend([-1] * (b.size - len(row)))
+        while len(_worker_table) < a.size:
+            _worker_table.append([-1] * b.size)
+        result.append(a.distance(b, _worker_table, _worker_rename))
+    return result
@@ -0,0 +1,176 @@
+'''Render diffs as unified diffs or side-by-side columns, writing each hunk as soon as it is complete.'''
+
+
+from typing import Iterable, Iterator, Sequence, TextIO
+
+from src.srcdiff import EMPTY
+from src.srcdiff.diff2 import Diff2, Segment, segments
+
+
+# FUNCTIONS
+
+def runs(diffa: Iterable, diffb: Iterable, a_start: int = 0, b_start: int = 0) -> Iterator[Segment]:
+    '''Coalesces the alignment `diffa`/`diffb` of `diff2`, whose first elements are at positions `a_start` and `b_start`, into runs of equal and changed elements.
+    The alignment is consumed lazily, so it can be any iterable.
+    Yields `(equal, a_start, a_end, b_start, b_end)` segments.'''
+    i, j = a_start, b_start
+    run = None
+    for x, y in zip(diffa, diffb):
+        equal = x is not EMPTY and y is not EMPTY
+        if run is not None and run != equal:
+            yield (run, a_start, i, b_start, j)
+            a_start, b_start = i, j
+        run = equal
+        if x is not EMPTY:
+            i += 1
+        if y is not EMPTY:
+            j += 1
+    if run is not None:
+        yield (run, a_start, i, b_start, j)
+
+
+def alignment(a: Sequence, b: Sequence) -> Iterator[Segment]:
+    '''Aligns `a` and `b`, e.g. lists of lines, piece by piece.
+    The common prefix, suffix and unique lines are matched first (see `segments`) and yielded as whole ranges. Only the pieces between them are diffed with `Diff2`, one at a time.
+    Yields `(equal, a_start, a_end, b_start, b_end)` segments, in order.'''
+    for equal, a0, a1, b0, b1 in segments(a, b):  # type: ignore
+        if equal or a0 == a1 or b0 == b1:
+            yield (equal, a0, a1, b0, b1)
+            continue
+        _, diffa, diffb = Diff2(a[a0:a1], b[b0:b1]).run()  # type: ignore
+        yield from runs(diffa, diffb, a0, b0)  # type: ignore
+
+
+def hunks_of(segs: Iterable[Segment], context: int = 3) -> Iterator[list[Segment]]:
+    '''Groups the changed segments of `segs` into hunks, with up to `context` equal elements around each change.
+    Changes separated by at most `2 * context` equal elements share a hunk. Longer equal stretches are cut by their ranges, without walking them.
+    Only the current hunk is kept in memory.
+    Yields each hunk as a list of segments.'''
+    hunk: list[Segment] = []
+    pending: Segment | None = None  # Equal segment since the last change
+    for seg in segs:
+        equal, a0, a1, b0, b1 = seg
+        if a0 == a1 and b0 == b1:
+            continue
+        if equal:
+            # Coalesce consecutive equal segments
+            pending = seg if pending is None else (True, pending[1], a1, pending[3], b1)
+            continue
+        if pending is not None:
+            length = pending[2] - pending[1]
+            if hunk and length <= 2 * context:
+                hunk.append(pending)
+            else:
+                if hunk:
+                    _append(hunk, _head(pending, context))
+                    yield hunk
+                    hunk = []
+                _append(hunk, _tail(pending, context))
+            pending = None
+        last = hunk[-1] if hunk else None
+        if last is not None and not last[0]:
+            # Coalesce consecutive changes
+            hunk[-1] = (False, last[1], a1, last[3], b1)
+        else:
+            hunk.append(seg)
+    if hunk:
+        if pending is not None:
+            _append(hunk, _head(pending, context))
+        yield hunk
+
+
+def _head(seg: Segment, length: int) -> Segment:
+    '''Returns the first `length` elements of the equal segment `seg`.'''
+    _, a0, a1, b0, b1 = seg
+    length = min(length, a1 - a0)
+    return (True, a0, a0 + length, b0, b0 + length)
+
+
+def _tail(seg: Segment, length: int) -> Segment:
+    '''Returns the last `length` elements of the equal segment `seg`.'''
+    _, a0, a1, b0, b1 = seg
+    length = min(length, a1 - a0)
+    return (True, a1 - length, a1, b1 - length, b1)
+
+
+def _append(hunk: list[Segment], seg: Segment):
+    '''Appends `seg` to `hunk` if it is not empty.'''
+    if seg[1] < seg[2] or seg[3] < seg[4]:
+        hunk.append(seg)
+
+
+def _line(element) -> str:
+    '''Returns `element` as a line of text, without its line break.'''
+    if isinstance(element, (bytes, bytearray, memoryview)):
+        element = bytes(element).decode('utf-8', 'replace')
+    return str(element).rstrip('\r\n')
+
+
+def _header(hunk: list[Segment]) -> str:
+    '''Returns the `@@ -a,n +b,m @@` header of `hunk`.'''
+    return f'@@ -{_range(hunk[0][1], hunk[-1][2])} +{_range(hunk[0][3], hunk[-1][4])} @@\n'
+
+
+def _range(start: int, end: int) -> str:
+    '''Formats the range `[start, end)` for a hunk header, as GNU diff does.'''
+    length = end - start
+    if length == 1:
+        return f'{start + 1}'
+    # Empty ranges start at the line before them
+    return f'{start + 1 if length else start},{length}'
+
+
+def write_unified(out: TextIO, a: Sequence, b: Sequence, segs: Iterable[Segment] | None = None,
+                  context: int = 3, name_a: str = 'a', name_b: str = 'b') -> int:
+    '''Writes the unified diff between the lists of lines `a` and `b` to `out`, one hunk at a time.
+    `segs` is the alignment of `a` and `b` (see `runs` and `alignment`). By default, it is `alignment(a, b)`.
+    `context` is the number of unchanged lines around each change.
+    `name_a` and `name_b` are the file names in the header, which is written only if `a` and `b` differ.
+    Returns the number of hunks.'''
+    count = 0
+    for hunk in hunks_of(alignment(a, b) if segs is None else segs, context):
+        if count == 0:
+            out.write(f'--- {name_a}\n+++ {name_b}\n')
+        count += 1
+        out.write(_header(hunk))
+        for equal, a0, a1, b0, b1 in hunk:
+            if equal:
+                for i in range(a0, a1):
+                    out.write(f' {_line(a[i])}\n')
+                continue
+            for i in range(a0, a1):
+                out.write(f'-{_line(a[i])}\n')
+            for j in range(b0, b1):
+                out.write(f'+{_line(b[j])}\n')
+    return count
+
+
+def write_side_by_side(out: TextIO, a: Sequence, b: Sequence, segs: Iterable[Segment] | None = None,
+                       context: int = 3, width: int = 80) -> int:
+    '''Writes the diff between the lists of lines `a` and `b` to `out` in two columns of `width` characters in total, one hunk at a time.
+    The marker between the columns is `|` for changed lines, `<` for removed lines, `>` for inserted lines and a space for unchanged lines.
+    Each hunk starts with its unified diff header. `segs` and `context` work as in `write_unified`.
+    Returns the number of hunks.'''
+    column = max((width - 3) // 2, 1)
+
+    def row(left: str, mark: str, right: str):
+        left = left.expandtabs()[:column].ljust(column)
+        out.write(f'{left} {mark} {right.expandtabs()[:column]}'.rstrip() + '\n')
+
+    count = 0
+    for hunk in hunks_of(alignment(a, b) if segs is None else segs, context):
+        count += 1
+        out.write(_header(hunk))
+        for equal, a0, a1, b0, b1 in hunk:
+            if equal:
+                for k in range(a1 - a0):
+                    row(_line(a[a0 + k]), ' ', _line(b[b0 + k]))
+                continue
+            for k in range(max(a1 - a0, b1 - b0)):
+                if a0 + k < a1 and b0 + k < b1:
+                    row(_line(a[a0 + k]), '|', _line(b[b0 + k]))
+                elif a0 + k < a1:
+                    row(_line(a[a0 + k]), '<', '')
+                else:
+                    row('', '>', _line(b[b0 + k]))
+    return count
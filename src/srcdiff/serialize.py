@@ -0,0 +1,282 @@
+'''Write Trees to JSON or S-expressions and read them back, streaming and without recursion.
+
+JSON nodes are objects with the members `type`, `value` and `children`:
+    {"type":"Module","value":null,"children":[{"type":"Pass","value":null,"children":[]}]}
+S-expressions are more compact. Each node is a list of its type, its value unless it is `None`, and its children:
+    (Module (FunctionDef "f" (arguments (arg "x")) (Return (Constant 1))))
+Types are bare symbols unless they contain spaces, parentheses or quotes. Strings are quoted and escaped as in JSON, booleans are `#t` and `#f`.
+
+The writers and readers keep an explicit stack, so they work on trees deeper than the recursion limit, in time linear in the size of the output.
+'''
+
+
+import json
+import re
+from typing import Iterator, TextIO
+
+from src.srcdiff.tree import Tree
+
+
+# CONSTANTS
+
+# Number of characters read at a time by the readers
+CHUNK_SIZE = 1 << 16
+
+# Number of pieces buffered by the writers before each write
+_WRITE_BATCH = 1024
+
+# Tokens of JSON: the start of a node as written by `write_json` up to its children, with its type and value, punctuation, strings and other literals
+_JSON_TOKEN = re.compile(r'\s*(?:(\{"type":("(?:[^"\\]|\\.)*"),"value":("(?:[^"\\]|\\.)*"|[^\s{}\[\]:,"]+),"children":\[)'
+                         r'|([{}\[\]:,])|("(?:[^"\\]|\\.)*")|([^\s{}\[\]:,"]+))')
+
+# Tokens of S-expressions: the start of a node with a bare type and its value if any, parentheses, strings and atoms
+_SEXP_TOKEN = re.compile(r'\s*(?:(\(([^\s()"]+)(?: ("(?:[^"\\]|\\.)*"|[^\s()"]+))?)'
+                         r'|([()])|("(?:[^"\\]|\\.)*")|([^\s()"]+))')
+
+# Kinds of tokens, the outer groups of the patterns above. The start of a node holds the groups of its type and value.
+# Most nodes are read as a single token of this kind, the others as separate tokens.
+_START = 1
+_PUNCTUATION = 4
+_STRING = 5
+_ATOM = 6
+
+# Values of the most common JSON literals
+_LITERALS = {'null': None, 'true': True, 'false': False}
+
+# Types written as bare symbols in S-expressions
+_SYMBOL = re.compile(r'[^\s()"]+')
+
+# States of the JSON reader, see `read_json`
+_NODE, _FIRST_MEMBER, _MEMBER, _COLON, _MEMBER_VALUE, _AFTER_MEMBER, _FIRST_CHILD, _CHILD, _AFTER_CHILD = range(9)
+
+
+# FUNCTIONS
+
+def write_json(out: TextIO, tree: Tree):
+    '''Writes `tree` to `out` as JSON.'''
+    pieces: list[str] = []
+    # Iterators over the children left to write of the nodes being written
+    stack: list[Iterator[Tree]] = [iter([tree])]
+    first = True  # Whether the next node is the first child of its parent
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            if stack:
+                pieces.append(']}')
+            first = False
+        else:
+            if not first:
+                pieces.append(',')
+            pieces.append(f'{{"type":{json.dumps(node.type)},"value":{json.dumps(node.value)},"children":[')
+            stack.append(iter(node.children))
+            first = True
+        if len(pieces) >= _WRITE_BATCH:
+            out.write(''.join(pieces))
+            pieces.clear()
+    out.write(''.join(pieces))
+
+
+def write_sexp(out: TextIO, tree: Tree):
+    '''Writes `tree` to `out` as an S-expression.'''
+    pieces: list[str] = []
+    stack: list[Iterator[Tree]] = [iter([tree])]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            if stack:
+                pieces.append(')')
+        else:
+            if len(stack) > 1:
+                pieces.append(' ')
+            type_ = node.type if _SYMBOL.fullmatch(node.type) else json.dumps(node.type)
+            if node.value is None:
+                pieces.append(f'({type_}')
+            else:
+                pieces.append(f'({type_} {_atom(node.value)}')
+            stack.append(iter(node.children))
+        if len(pieces) >= _WRITE_BATCH:
+            out.write(''.join(pieces))
+            pieces.clear()
+    out.write(''.join(pieces))
+
+
+def _atom(value: str | int | bool | float) -> str:
+    '''Returns the S-expression of the value of a node.'''
+    if value is True:
+        return '#t'
+    if value is False:
+        return '#f'
+    if isinstance(value, str):
+        return json.dumps(value)
+    # Floats always have a dot, an exponent or are `inf` or `nan`, so they are read back as floats
+    return repr(value)
+
+
+def _parse_atom(token: str) -> int | bool | float:
+    '''Returns the value of the S-expression atom `token`.'''
+    if token == '#t':
+        return True
+    if token == '#f':
+        return False
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+def _scan(f: TextIO, pattern: re.Pattern, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple[int, re.Match, int]]:
+    '''Reads the tokens of `f` matching `pattern` a chunk at a time.
+    A token cut at the end of the chunk is completed with the next chunks, which grow so that long tokens are scanned in linear time.
+    Yields the kind, the match and the offset of each token.'''
+    buffer = ''
+    offset = 0  # Offset of the buffer in the file
+    eof = False
+    while True:
+        pos = 0
+        for match in pattern.finditer(buffer):
+            if match.start() != pos:
+                break
+            if match.end() == len(buffer) and not eof:
+                # The token may continue in the next chunk
+                break
+            kind = match.lastindex
+            yield kind, match, offset + match.start(kind)  # type: ignore
+            pos = match.end()
+        if eof:
+            if buffer[pos:].strip():
+                raise ValueError(f'Invalid token at offset {offset + pos}')
+            return
+        chunk = f.read(max(chunk_size, len(buffer) - pos))
+        eof = not chunk
+        offset += pos
+        buffer = buffer[pos:] + chunk
+
+
+def _parse_json(token: str):
+    '''Returns the value of the JSON string or literal `token`.'''
+    if token[0] == '"':
+        if '\\' not in token:
+            return token[1:-1]
+    elif token in _LITERALS:
+        return _LITERALS[token]
+    elif token.isdigit():
+        return int(token)
+    return json.loads(token)
+
+
+def read_json(f: TextIO, chunk_size: int = CHUNK_SIZE) -> Tree:
+    '''Reads a Tree written by `write_json` from `f`, `chunk_size` characters at a time.
+    Raises `ValueError` if the input is not a valid Tree.'''
+    # Nodes being read: their type, value and children
+    stack: list[list] = []
+    result = None
+    state = _NODE
+    key = None
+    for kind, match, offset in _scan(f, _JSON_TOKEN, chunk_size):
+        if result is not None:
+            raise ValueError(f'Unexpected data after the tree at offset {offset}')
+        token = match.group(kind)
+        if kind == _START:
+            if state != _NODE and state != _CHILD and state != _FIRST_CHILD:
+                raise ValueError(f'Unexpected node at offset {offset}')
+            stack.append([_parse_json(match.group(2)), _parse_json(match.group(3)), []])
+            state = _FIRST_CHILD
+        elif state == _MEMBER_VALUE:
+            if key == 'children':
+                if token != '[':
+                    raise ValueError(f'Expected the list of children at offset {offset}')
+                state = _FIRST_CHILD
+                continue
+            if kind == _PUNCTUATION:
+                raise ValueError(f'Expected the {key} at offset {offset}')
+            value = _parse_json(token)
+            if key == 'type' and not isinstance(value, str):
+                raise ValueError(f'Expected a string type at offset {offset}')
+            stack[-1][0 if key == 'type' else 1] = value
+            state = _AFTER_MEMBER
+        elif state == _NODE or state == _CHILD or (state == _FIRST_CHILD and token != ']'):
+            if token != '{':
+                raise ValueError(f'Expected a node at offset {offset}')
+            stack.append([None, None, []])
+            state = _FIRST_MEMBER
+        elif state == _MEMBER or (state == _FIRST_MEMBER and token != '}'):
+            if kind != _STRING:
+                raise ValueError(f'Expected a member name at offset {offset}')
+            key = _parse_json(token)
+            if key not in ('type', 'value', 'children'):
+                raise ValueError(f'Unknown member {key!r} at offset {offset}')
+            state = _COLON
+        elif state == _COLON:
+            if token != ':':
+                raise ValueError(f'Expected a colon at offset {offset}')
+            state = _MEMBER_VALUE
+        elif state == _AFTER_MEMBER or state == _FIRST_MEMBER:
+            if token == ',' and state == _AFTER_MEMBER:
+                state = _MEMBER
+                continue
+            if token != '}':
+                raise ValueError(f'Expected the end of a node at offset {offset}')
+            type_, value, children = stack.pop()
+            if type_ is None:
+                raise ValueError(f'Node without type at offset {offset}')
+            node = Tree(type_, value, children)
+            if stack:
+                stack[-1][2].append(node)
+                state = _AFTER_CHILD
+            else:
+                result = node
+        elif state == _AFTER_CHILD or state == _FIRST_CHILD:
+            if token == ',' and state == _AFTER_CHILD:
+                state = _CHILD
+            elif token == ']':
+                state = _AFTER_MEMBER
+            else:
+                raise ValueError(f'Expected a comma or the end of the children at offset {offset}')
+    if result is None:
+        raise ValueError('Unexpected end of the tree')
+    return result
+
+
+def read_sexp(f: TextIO, chunk_size: int = CHUNK_SIZE) -> Tree:
+    '''Reads a Tree written by `write_sexp` from `f`, `chunk_size` characters at a time.
+    Raises `ValueError` if the input is not a valid Tree.'''
+    # Nodes being read: their type, value and children
+    stack: list[list] = []
+    result = None
+    for kind, match, offset in _scan(f, _SEXP_TOKEN, chunk_size):
+        if result is not None:
+            raise ValueError(f'Unexpected data after the tree at offset {offset}')
+        token = match.group(kind)
+        if kind == _START:
+            if stack and stack[-1][0] is None:
+                raise ValueError(f'Expected a type at offset {offset}')
+            value = match.group(3)
+            if value is not None:
+                value = _parse_json(value) if value[0] == '"' else _parse_atom(value)
+            stack.append([match.group(2), value, []])
+        elif token == '(' and kind == _PUNCTUATION:
+            if stack and stack[-1][0] is None:
+                raise ValueError(f'Expected a type at offset {offset}')
+            stack.append([None, None, []])
+        elif not stack:
+            raise ValueError(f'Expected a node at offset {offset}')
+        elif kind == _PUNCTUATION:
+            type_, value, children = stack.pop()
+            if type_ is None:
+                raise ValueError(f'Node without type at offset {offset}')
+            node = Tree(type_, value, children)
+            if stack:
+                stack[-1][2].append(node)
+            else:
+                result = node
+        elif stack[-1][0] is None:
+            stack[-1][0] = _parse_json(token) if kind == _STRING else token
+        elif stack[-1][1] is None and not stack[-1][2]:
+            stack[-1][1] = _parse_json(token) if kind == _STRING else _parse_atom(token)
+        else:
+            raise ValueError(f'Unexpected value at offset {offset}')
+    if result is None:
+        raise ValueError('Unexpected end of the tree')
+    return result
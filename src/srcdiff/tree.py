@@ -1,5 +1,14 @@
 import ast
-import os
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Sequence
+
+from src.srcdiff.walk import DEFAULT_EXTENSIONS, DEFAULT_IGNORE, IgnoreRules, scan_dir
+
+
+# Default of the `value` of node queries, matching any value
+_ANY_VALUE = object()
 
 
 class Tree:
@@ -10,48 +19,230 @@ class Tree:
     - `value` provides additional useful information about a node. Ex.: for a node of type `Constant`, the `value` could be `3.14`.
     - `children` is a list of child `Tree` nodes.
     - `parent` is the parent `Tree` node. It is `None` if the node is the root of the `Tree`.
+    - `lineno` and `end_lineno` are the first and last source lines of the node, for nodes built from an abstract syntax tree node that has them. They are `None` otherwise. They are not compared by the diffs.
     - `index_of` is a dictionary that maps each node to its index.
     - `_node_at` is a dictionary that maps each index to its node. It is used to make the `Tree` indexable.
+
+    Indices follow the postorder of the nodes, starting at 1.
+    The size, height and leftmost leaf of each node are computed from its children when it is created.
+    The indices, the leftmost leaf descendants (lmlds), the keyroots and the depths are computed lazily, in a single postorder pass, the first time one of them is needed.
+    The nodes of each type and label are indexed the first time `indices`, `find` or `count` is called.
+    After changing the `children` of a node, call `invalidate` on it to update this metadata.
     """
 
     def __init__(self,
                  type_: str,
                  value: str | int | bool | float | None = None,
-                 children: list['Tree'] = []):
+                 children: list['Tree'] | None = None,
+                 lineno: int | None = None,
+                 end_lineno: int | None = None):
         """Creates a Tree object.
-        `type_`, `value`, and `children` correspond to the class' attributes.
+        `type_`, `value`, `children`, `lineno` and `end_lineno` correspond to the class' attributes. `children` is copied, and defaults to no children.
         """
         self.type: str = type_
         self.value: str | int | bool | float | None = value
+        self.lineno = lineno
+        self.end_lineno = end_lineno
         # Set this node's `parent` to `None`. It will be reassigned by the `parent` if there is one.
         self.parent: 'Tree | None' = None
         # Set `children`
-        self.children: list['Tree'] = children
-        # Set the `children`'s `parent` to this node.
+        self.children: list['Tree'] = list(children) if children is not None else []
+        # Depth of this node, computed lazily
+        self._depth: int | None = None
+        # Set the `children`'s `parent` to this node and compute the metadata that depends only on them.
+        self._adopt_children()
+
+    def _adopt_children(self):
+        """Sets the `parent` of the children and computes the size, height and leftmost leaf of this node from theirs.
+        It also drops the lazily computed metadata of this node.
+        """
+        size = 1
+        height = 0
         for c in self.children:
-            c.parent = self
-        # Compute the `_node_at` attribute
-        temp = self._as_list()
-        self._node_at: dict[int, 'Tree'] = {}
-        for i, v in enumerate(temp):
-            self._node_at[i+1] = v
-        # Compute the `index_of` attribute
-        self.index_of: dict['Tree', int] = {}
-        for i, c in self._node_at.items():
-            self.index_of[c] = i
+            if c.parent is not self:
+                c.parent = self
+                # Depths are relative to the root, which just changed
+                if c._depth is not None:
+                    c._clear_depths()
+            size += c._size
+            if c._height >= height:
+                height = c._height + 1
+        self._size: int = size
+        self._height: int = height
+        self._leftmost: 'Tree' = self.children[0]._leftmost if self.children else self
+        # Lazily computed by `structural_hash`
+        self._hash: int | None = None
+        # Lazily computed by `digest`
+        self._digest: bytes | None = None
+        # Lazily computed by `_index`
+        self._postorder: list['Tree'] | None = None
+        self._index_of: dict['Tree', int] | None = None
+        self._node_at_dict: dict[int, 'Tree'] | None = None
+        self._lmlds: list[int] | None = None
+        self._keyroot_indices: list[int] | None = None
+        # Lazily computed by `_index_labels`
+        self._type_index: dict[str, array] | None = None
+        self._label_index: dict[tuple, array] | None = None
+
+    def _clear_depths(self):
+        """Clears the cached depths of this subtree."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._depth = None
+            stack.extend(node.children)
+
+    def invalidate(self):
+        """Updates the metadata of this node and its ancestors after its `children` changed."""
+        node: Tree | None = self
+        while node is not None:
+            node._adopt_children()
+            node = node.parent
+
+    def _index(self):
+        """Computes the indices, lmlds, keyroots and depths of this subtree in a single postorder pass."""
+        postorder: list[Tree] = [self]  # Position 0 is a placeholder, indices start at 1
+        lmlds = [0]
+        keyroots = []
+        base_depth = self.depth
+        # Each entry is a node, its depth relative to this node and whether its children were visited
+        stack: list[tuple[Tree, int, bool]] = [(self, 0, False)]
+        while stack:
+            node, depth, visited = stack.pop()
+            if not visited:
+                node._depth = base_depth + depth
+                stack.append((node, depth, True))
+                for c in reversed(node.children):
+                    stack.append((c, depth + 1, False))
+                continue
+            i = len(postorder)
+            postorder.append(node)
+            # The leftmost leaf is the first node of the subtree in postorder
+            lmlds.append(i - node._size + 1)
+            # A node is a keyroot if it is not the first child of its parent
+            if node is self or node.parent is None or node.parent.children[0] is not node:
+                keyroots.append(i)
+        self._postorder = postorder
+        self._lmlds = lmlds
+        self._keyroot_indices = keyroots
+
+    @property
+    def index_of(self) -> dict['Tree', int]:
+        """Dictionary that maps each node to its index."""
+        if self._index_of is None:
+            nodes = self.postorder
+            self._index_of = {nodes[i]: i for i in range(1, len(nodes))}
+        return self._index_of
+
+    @property
+    def _node_at(self) -> dict[int, 'Tree']:
+        """Dictionary that maps each index to its node."""
+        if self._node_at_dict is None:
+            nodes = self.postorder
+            self._node_at_dict = {i: nodes[i] for i in range(1, len(nodes))}
+        return self._node_at_dict
+
+    @property
+    def postorder(self) -> list['Tree']:
+        """List of the nodes of this subtree in postorder.
+        The position 0 holds this node too, so that the list can be indexed like the `Tree`."""
+        if self._postorder is None:
+            self._index()
+        return self._postorder  # type: ignore
+
+    @property
+    def lmlds(self) -> list[int]:
+        """List with the index of the leftmost leaf descendant of each node, indexed like the `Tree`."""
+        if self._lmlds is None:
+            self._index()
+        return self._lmlds  # type: ignore
+
+    @property
+    def keyroot_indices(self) -> list[int]:
+        """List with the indices of the keyroots, in increasing order."""
+        if self._keyroot_indices is None:
+            self._index()
+        return self._keyroot_indices  # type: ignore
+
+    def _index_labels(self):
+        """Maps each node type and each `(type, value)` label of this subtree to the sorted array of indices of its nodes."""
+        by_type: dict[str, list[int]] = {}
+        by_label: dict[tuple, list[int]] = {}
+        nodes = self.postorder
+        for i in range(1, len(nodes)):
+            node = nodes[i]
+            by_type.setdefault(node.type, []).append(i)
+            by_label.setdefault((node.type, node.value), []).append(i)
+        self._type_index = {k: array('q', v) for k, v in by_type.items()}
+        self._label_index = {k: array('q', v) for k, v in by_label.items()}
+
+    def indices(self, type_: str, value=_ANY_VALUE, within: 'Tree | None' = None) -> array:
+        """Returns the sorted array of indices of the nodes of type `type_` (and `value`, if given).
+        If `within` is a node of this `Tree`, only the nodes of its subtree are returned.
+        The index is built once and dropped by `invalidate`, so queries take time proportional to the size of their result.
+        """
+        if self._type_index is None:
+            self._index_labels()
+        if value is _ANY_VALUE:
+            found = self._type_index.get(type_)  # type: ignore
+        else:
+            found = self._label_index.get((type_, value))  # type: ignore
+        if found is None:
+            return array('q')
+        if within is None or within is self:
+            return found[:]
+        # The subtree of a node spans the indices from its leftmost leaf to itself
+        last = self.index_of[within]
+        first = self.lmlds[last]
+        return found[bisect_left(found, first):bisect_right(found, last)]
+
+    def find(self, type_: str, value=_ANY_VALUE, within: 'Tree | None' = None) -> list['Tree']:
+        """Returns the nodes of type `type_` (and `value`, if given), in postorder.
+        `within` works as in `indices`.
+        """
+        nodes = self.postorder
+        return [nodes[i] for i in self.indices(type_, value, within)]
+
+    def count(self, type_: str, value=_ANY_VALUE) -> int:
+        """Returns the number of nodes of type `type_` (and `value`, if given)."""
+        return len(self.indices(type_, value))
+
+    @property
+    def depth(self) -> int:
+        """Number of edges from the root of the `Tree` to this node."""
+        if self._depth is None:
+            # Find the closest ancestor with a known depth and fill the depths down from it
+            chain: list[Tree] = []
+            node: Tree | None = self
+            while node is not None and node._depth is None:
+                chain.append(node)
+                node = node.parent
+            depth = -1 if node is None else node._depth
+            for n in reversed(chain):
+                depth += 1  # type: ignore
+                n._depth = depth
+        return self._depth  # type: ignore
+
+    @property
+    def height(self) -> int:
+        """Number of edges from this node to its deepest descendant."""
+        return self._height
 
     def __len__(self):
         """Returns the size of the Tree."""
-        return self.size()
+        return self._size
 
     def __getitem__(self, i: int) -> 'Tree':
         """Returns the node of index `i`."""
-        return self._node_at[i]
+        if i < 1:
+            raise KeyError(i)
+        return self.postorder[i]
 
     @classmethod
     def from_AST(cls, astree: ast.AST) -> 'Tree':
         """Recursively builds a `Tree` node from an abstract syntax tree.
         `astree` is the abstract syntax tree for a given Python script.
+        The source lines of its nodes, if any, are kept in `lineno` and `end_lineno`.
         Returns the `Tree` object.
         """
         # The astree node class name is the type of the new node
@@ -68,7 +259,8 @@ class Tree:
         for subastree in ast.iter_child_nodes(astree):
             child = cls.from_AST(subastree)
             children += [child]
-        node = cls(type_, value, children)
+        node = cls(type_, value, children,
+                   getattr(astree, 'lineno', None), getattr(astree, 'end_lineno', None))
         return node
 
     @classmethod
@@ -87,36 +279,39 @@ class Tree:
         return root
 
     @classmethod
-    def from_dir(cls, path: str, ignore: list[str] = ['__pycache__'], recursive=True) -> 'Tree':
+    def from_dir(cls, path: str, ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE, recursive=True,
+                 extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS) -> 'Tree':
         """Build a `Tree` node from a directory.
 
         `path` is the path to the directory.
-        `ignore` is a list of files and directories to ignore.
+        `ignore` is a sequence of gitignore-style patterns (or an `IgnoreRules` object) of files and directories to ignore, relative to `path`.
+        Ignored directories are not explored.
         `recursive` indicates if it must explore subdirectories recursively.
+        `extensions` are the extensions of the files to parse. `None` parses every file.
         Returns the `Tree` object.
         """
+        rules = ignore if isinstance(ignore, IgnoreRules) else IgnoreRules(ignore)
+        return cls._from_dir(path, rules, '', recursive, extensions)
+
+    @classmethod
+    def _from_dir(cls, path: str, rules: IgnoreRules, relpath: str, recursive: bool,
+                  extensions: tuple[str, ...] | None) -> 'Tree':
+        """Build a `Tree` node from the directory at `path`, whose path relative to the root of the walk is `relpath`."""
         children = []
-        # List of files and directories
-        files_dirs = [path + '/' + fd for fd in os.listdir(path)]
-        files = [f for f in files_dirs if os.path.isfile(f)]
+        files, dirs = scan_dir(path, rules, relpath, extensions)
         # Parse files first
         for f in files:
-            if f not in ignore:
-                node = cls.from_file(f)
-                children += [node]
-        dirs = [d for d in files_dirs if os.path.isdir(d)]
+            children.append(cls.from_file(path + '/' + f.name))
         # Parse directories
         for d in dirs:
-            if d not in ignore:
-                # By default, create a node non-recursively.
-                # This avoids node from being None.
-                node: Tree = Tree('Directory', path)
-                if recursive:
-                    # If recursive is True, recreate it.
-                    node = cls.from_dir(d)
-                children += [node]
-        root = Tree('Directory', path, children)
-        return root
+            subpath = path + '/' + d.name
+            if recursive:
+                node = cls._from_dir(subpath, rules, relpath + d.name + '/', recursive, extensions)
+            else:
+                # Without recursion, create a leaf node for the subdirectory
+                node = cls('Directory', subpath)
+            children.append(node)
+        return cls('Directory', path, children)
 
     def __repr__(self, recursive=True, current_indent=0, indent_size=4) -> str:
         """Pretty-prints a `Tree` to `str`.
@@ -155,77 +350,154 @@ class Tree:
         out = left_padding + f'Tree({type_}{value}{children})'
         return out
 
-    def equals(self, another: 'Tree', compare_children=True) -> tuple[bool, str | None, str | None]:
+    @property
+    def structural_hash(self) -> int:
+        """Hash of the types, values and shape of this subtree.
+        Equal subtrees have equal hashes. It is computed iteratively and cached on every node.
+        """
+        if self._hash is None:
+            stack: list[tuple[Tree, bool]] = [(self, False)]
+            while stack:
+                node, visited = stack.pop()
+                if visited:
+                    node._hash = hash((node.type, node.value,
+                                       tuple(c._hash for c in node.children)))
+                    continue
+                stack.append((node, True))
+                for c in node.children:
+                    if c._hash is None:
+                        stack.append((c, False))
+        return self._hash  # type: ignore
+
+    def digest(self) -> bytes:
+        """Stable digest of the types, values and shape of this subtree.
+        Unlike `structural_hash`, it is the same across processes and runs, so it can key persistent caches.
+        Values that compare equal, such as `1`, `1.0` and `True`, have the same digest.
+        It is computed iteratively and cached on every node.
+        """
+        if self._digest is None:
+            stack: list[tuple[Tree, bool]] = [(self, False)]
+            while stack:
+                node, visited = stack.pop()
+                if visited:
+                    value = node.value
+                    # Hash integral numbers as `int`s, whose `repr` is the same for equal values
+                    if isinstance(value, bool) or isinstance(value, float) and value.is_integer():
+                        value = int(value)
+                    h = hashlib.blake2b(repr((node.type, value, len(node.children))).encode(),
+                                        digest_size=16)
+                    for c in node.children:
+                        h.update(c._digest)  # type: ignore
+                    node._digest = h.digest()
+                    continue
+                stack.append((node, True))
+                for c in node.children:
+                    if c._digest is None:
+                        stack.append((c, False))
+        return self._digest  # type: ignore
+
+    def _label_path(self) -> str:
+        """Returns the label of this node used in the paths reported by `equals`."""
+        return f'{self.type}' + (f':{self.value}' if self.value else '')
+
+    def _same_as(self, another: 'Tree') -> bool:
+        """Compares this Tree to another, first by their structural hashes and then iteratively, node by node."""
+        if self.structural_hash != another.structural_hash:
+            return False
+        # Equal hashes, confirm it was not a collision
+        stack: list[tuple[Tree, Tree]] = [(self, another)]
+        while stack:
+            x, y = stack.pop()
+            if x is y:
+                continue
+            if x.type != y.type or x.value != y.value or \
+                    len(x.children) != len(y.children):
+                return False
+            stack.extend(zip(x.children, y.children))
+        return True
+
+    def equals(self, another: 'Tree', compare_children=True, report=True) -> tuple[bool, str | None, str | None]:
         """Compares this Tree to another.
 
         `another` is the other Tree object to compare to.
         `compare_children` is a flag indicating whether it should also compare the children, recursively.
-        Returns a boolean indicating if the trees are equal and the paths to the pair of differing nodes if the trees are different.
+        `report` is a flag indicating whether it should compute the paths to the differing nodes.
+        Returns a boolean indicating if the trees are equal and the paths to the pair of differing nodes if the trees are different and `report` is set.
         """
-        # These variables indicate the path to the first differing elements.
-        # They are useful for debugging purposes.
-        diff_self = f'{self.type}' + (f':{self.value}' if self.value else '')
-        diff_another = f'{another.type}' + \
-            (f':{another.value}' if another.value else '')
-        # First, compare the type, value and number of children
+        # First, compare the type and value
         if self.type != another.type or \
                 self.value != another.value:
-            return False, diff_self, diff_another
-        if compare_children:
+            if not report:
+                return False, None, None
+            return False, self._label_path(), another._label_path()
+        if not compare_children or self._same_as(another):
+            # If all checks passed, they are equal
+            return True, None, None
+        if not report:
+            return False, None, None
+        # The trees differ. Go down to the first pair of differing nodes to build the paths to them.
+        # These variables indicate the path to the first differing elements.
+        # They are useful for debugging purposes.
+        diff_self = self._label_path()
+        diff_another = another._label_path()
+        x, y = self, another
+        while True:
+            if x.type != y.type or x.value != y.value:
+                break
             # Compare the number of children
-            if len(self.children) != len(another.children):
-                diff_self += f'#children={len(self.children)}'
-                diff_another += f'#children={len(another.children)}'
-                return False, diff_self, diff_another
-            # Then, compare each children, in the same order
-            for i in range(len(self.children)):
-                res, diff_child_self, diff_child_another = self.children[i].equals(
-                    another.children[i])
-                if not res:
-                    diff_self_complete = f'{diff_self}/{i}/{diff_child_self}'
-                    diff_another_complete = f'{diff_another}/{i}/{diff_child_another}'
-                    return False, diff_self_complete, diff_another_complete
-        # If all checks passed, they are equal
-        return True, None, None
+            if len(x.children) != len(y.children):
+                diff_self += f'#children={len(x.children)}'
+                diff_another += f'#children={len(y.children)}'
+                break
+            # Then, find the first differing child, in the same order
+            for i in range(len(x.children)):
+                if not x.children[i]._same_as(y.children[i]):
+                    x, y = x.children[i], y.children[i]
+                    diff_self += f'/{i}/{x._label_path()}'
+                    diff_another += f'/{i}/{y._label_path()}'
+                    break
+            else:
+                # Stale hashes, i.e. `invalidate` was not called after changing the children
+                break
+        return False, diff_self, diff_another
 
     def keyroots(self) -> list['Tree']:
-        """Returns the Tree's keyroots, used by the diff algorithm."""
-        return self._keyroots(is_keyroot=True)
-
-    def _keyroots(self, is_keyroot: bool) -> list['Tree']:
-        """Recursively finds the keyroots of the Tree.
+        """Returns the Tree's keyroots, used by the diff algorithm.
         Basically, we know a node is a keyroot if it is not the first child of a node.
         For the formal definition, consult:
         Zhang, K., & Shasha, D. (1989). Simple Fast Algorithms for the Editing Distance Between Trees and Related Problems. SIAM J. Comput., 18, 1245-1262.
-
-        `is_keyroot` indicates whether this node is a keyroot.
         """
-        keyroots: list['Tree'] = []
-        if len(self.children) > 0:
-            keyroots += self.children[0]._keyroots(is_keyroot=False)
-            for c in self.children[1:]:
-                keyroots += c._keyroots(is_keyroot=True)
-        if is_keyroot:
-            keyroots += [self]
-        return keyroots
+        nodes = self.postorder
+        return [nodes[i] for i in self.keyroot_indices]
 
     def leftmost_leaf(self) -> 'Tree':
         """Returns the leftmost leaf of this node."""
-        if len(self.children) == 0:
-            return self
-        return self.children[0].leftmost_leaf()
+        return self._leftmost
 
     def size(self) -> int:
         """Returns the size of the Tree."""
-        return 1 + sum([c.size() for c in self.children])
+        return self._size
+
+    def copy(self) -> 'Tree':
+        """Returns a copy of the Tree, built iteratively. The copy's root has no `parent`."""
+        # Copies of the children of the nodes being copied
+        copies: list[list[Tree]] = [[]]
+        stack: list[tuple[Tree, bool]] = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                children = copies.pop()
+                copies[-1].append(Tree(node.type, node.value, children, node.lineno, node.end_lineno))
+                continue
+            stack.append((node, True))
+            copies.append([])
+            for c in reversed(node.children):
+                stack.append((c, False))
+        return copies[0][0]
 
     def _as_list(self) -> list['Tree']:
         """Returns the `Tree` as a list."""
-        l = []
-        for c in self.children:
-            l += c._as_list()
-        l += [self]
-        return l
+        return self.postorder[1:]
 
     def forest(self, first: int, last: int) -> list['Tree']:
         """Returns the forest (subtrees of this one) containing vertices from index `first` to `last`."""
@@ -234,7 +506,8 @@ class Tree:
         while leftmost <= last:
             current: Tree = self[leftmost]
             parent: Tree | None = current.parent
-            while parent is not None and self.index_of[parent] <= last:
+            # Stop at this node, its parent is outside of the Tree
+            while current is not self and self.index_of[parent] <= last:  # type: ignore
                 current = parent
                 parent = parent.parent
             forest += [current]
@@ -1,102 +1,706 @@
 '''Perform diffs on Trees.'''
 
 
+import ast
+import mmap
+import os
+import re
+import tempfile
+import traceback
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 from src.srcdiff import EMPTY
+from src.srcdiff.costs import CostModel, LabelTable, UNIT_COSTS
+from src.srcdiff.limits import DiffTimeout, Limits
+from src.srcdiff.render import alignment
 from src.srcdiff.tree import Tree
 
 
+# CONSTANTS
+
+# Approximate number of bytes taken by each cell of an in-memory table: a pointer in its row
+TABLE_CELL_BYTES = 8
+
+# Number of cells computed by a keyroot pair between checks of its `Limits`
+CHECK_CELLS = 4096
+
+# Types of the top-level statements matched by name by `decomposed_tree_diff2`
+DEFINITIONS = ('FunctionDef', 'AsyncFunctionDef', 'ClassDef')
+
+# Line breaks of Python source code, as counted by `lineno`
+_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
 # CLASSES
 
 class TreeDiff2:
-    def __init__(self, a: Tree, b: Tree):
+    def __init__(self, a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS, jobs: int = 1,
+                 ram_budget: int | None = None, limits: Limits | None = None):
+        """`cost_model` gives the costs of the edit operations.
+        `jobs` is the number of processes used by `run`.
+        `ram_budget` is the maximum size, in bytes, of the permanent table in memory. Bigger tables are spilled to a memory-mapped temporary file.
+        `limits` bounds the work and time of `run`, which is checked every `CHECK_CELLS` cells or so. When one is reached, `DiffTimeout` is raised with the bounds of `bounds`.
+        """
         self.a = a
         self.b = b
-        self.table: list[list[int]] = self._create_edit_distance_table(
-            len(self.a), len(self.b))
+        self.cost_model = cost_model
+        self.jobs = jobs
+        self.ram_budget = ram_budget
+        self.limits = limits
+        self._prepare_costs()
+        # Out of core, the table file is only created by `run`
+        self.table: list[list[int]] = None if self.out_of_core() else self._new_table()  # type: ignore
+
+    def out_of_core(self) -> bool:
+        """Checks if the permanent table exceeds `ram_budget`, i.e. if it is kept in a memory-mapped file."""
+        return self.ram_budget is not None and \
+            len(self.a) * len(self.b) * TABLE_CELL_BYTES > self.ram_budget
+
+    def _new_table(self, named: bool = False):
+        """Creates the permanent table, in memory or in a memory-mapped file if it exceeds `ram_budget`.
+        `named` indicates whether the file must keep a path other processes can open.
+        """
+        if not self.out_of_core():
+            return self._create_edit_distance_table(len(self.a), len(self.b))
+        table = _MappedTable.create(len(self.a), len(self.b), self._kernel.typecode())
+        if not named:
+            table.unlink()
+        return table
+
+    def _prepare_costs(self):
+        """Interns the labels of both trees and precomputes the costs used by the inner loop.
+        Node costs are indexed like the trees and rename costs by pairs of label ids.
+        """
+        self._kernel = _Kernel.between(PreparedTree(self.a, self.cost_model),
+                                       PreparedTree(self.b, self.cost_model))
 
     def run(self) -> int:  # TODO: return the Tree diffs
         """Runs the tree diff algorithm."""
-        self.table = self._create_edit_distance_table(
-            len(self.a), len(self.b))
-        # Compute keyroots
-        keyrootsa = self.a.keyroots()
-        keyrootsb = self.b.keyroots()
+        try:
+            if self.jobs > 1:
+                return self._run_parallel()
+            return self._run_serial()
+        except DiffTimeout as e:
+            # Past the deadline or once cancelled, there is no time left for the approximate matching
+            e.lower, e.upper = self.bounds(approximate=e.reason == 'budget')
+            raise
+
+    def _run_serial(self) -> int:
+        """Runs the tree diff algorithm in this process."""
+        self.table = self._new_table()
+        # Out of core, keep only the rows of each local table that later rows read.
+        # Each keyroot pair writes whole runs of columns of consecutive rows, so the file is accessed mostly sequentially.
+        keep = not self.out_of_core()
         # Compute tree distance between each pair of keyroots
-        for kra in keyrootsa:
-            for krb in keyrootsb:
-                self._treedist(kra, krb)
-        return self.table[len(self.a)][len(self.b)]
+        for ikra in self.a.keyroot_indices:
+            for ikrb in self.b.keyroot_indices:
+                self._treedist_at(ikra, ikrb, keep, self.limits)
+        # The table is 0-based, the roots are its last cell
+        return self.table[len(self.a)-1][len(self.b)-1]
+
+    def bounds(self, approximate: bool = True) -> tuple[int | float, int | float]:
+        """Returns lower and upper bounds of the distance, computed in near-linear time.
+        The lower bound is the cost of deleting (inserting) the cheapest nodes of the bigger tree, as many as the difference of sizes.
+        The upper bound is the cost of deleting and inserting every node, or, if `approximate` is set, of an approximate matching (see `approximate_tree_diff2`) when it is lower.
+        """
+        # Imported here, the approximate diff is built on this module
+        from src.srcdiff.gumtree import approximate_tree_diff2
+        n, m = len(self.a), len(self.b)
+        delete = self._kernel.delete_a[1:]
+        insert = self._kernel.insert_b[1:]
+        lower = sum(sorted(delete)[:n - m]) if n >= m else sum(sorted(insert)[:m - n])
+        upper = sum(delete) + sum(insert)
+        if approximate:
+            upper = min(upper, approximate_tree_diff2(self.a, self.b, self.cost_model, recovery_size=0)[0])
+        return lower, upper
+
+    def _run_parallel(self) -> int:
+        """Runs the tree diff algorithm in `jobs` processes.
+        A keyroot pair only reads the distances of pairs of smaller subtrees, so the pairs are grouped in dependency levels and the pairs of each level are computed concurrently.
+        The permanent table is shared by the workers through shared memory, or through a memory-mapped file if it exceeds `ram_budget`.
+        Returns the same distance as `run` does serially.
+        """
+        n, m = len(self.a), len(self.b)
+        typecode = self._kernel.typecode()
+        itemsize = array(typecode).itemsize
+        if self.out_of_core():
+            mapped = self._new_table(named=True)
+            try:
+                self._run_levels(('file', mapped.path), mapped, n, m, typecode)
+            finally:
+                mapped.unlink()
+            self.table = mapped
+            return self.table[n-1][m-1]
+        memory = shared_memory.SharedMemory(create=True, size=n * m * itemsize)
+        table = None
+        try:
+            table = _BufferTable(memory.buf, n, m, typecode)
+            table.fill(-1)
+            self._run_levels(('memory', memory.name), table, n, m, typecode)
+            # Keep a private copy of the table, the shared memory is released below
+            self.table = _BufferTable(bytearray(memory.buf[:n * m * itemsize]), n, m, typecode)  # type: ignore
+        finally:
+            if table is not None:
+                table.release()
+            memory.close()
+            memory.unlink()
+        return self.table[n-1][m-1]
+
+    def _run_levels(self, location: tuple[str, str], table: '_BufferTable', n: int, m: int, typecode: str):
+        """Computes the keyroot pairs level by level in a process pool.
+        `location` tells the workers where the permanent table `table` is: `('memory', name)` of a shared memory block or `('file', path)` of a file to map.
+        A level of a single pair, such as the last one of the roots, is computed in this process, where `limits` is checked while it runs.
+        """
+        levels = _pair_levels(self.a, self.b)
+        pairs_by_level: list[list[tuple[int, int]]] = \
+            [[] for _ in range(max(levels.values()) + 1)]
+        for pair, level in levels.items():
+            pairs_by_level[level].append(pair)
+        lmlds_a, lmlds_b = self.a.lmlds, self.b.lmlds
+        limits = self.limits
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                 initargs=(self._kernel, location, n, m, typecode)) as pool:
+            try:
+                for pairs in pairs_by_level:
+                    if len(pairs) == 1:
+                        ikra, ikrb = pairs[0]
+                        try:
+                            self._kernel.treedist(ikra, ikrb, table, False, limits)
+                        except BaseException as e:
+                            # The frames of the kernel hold rows of the shared table, which must be released to close it
+                            traceback.clear_frames(e.__traceback__)
+                            raise
+                        continue
+                    # Pairs of the same level are independent, split them in chunks among the workers
+                    chunk = max(1, len(pairs) // (self.jobs * 4))
+                    chunks = [pairs[k:k + chunk] for k in range(0, len(pairs), chunk)]
+                    futures = [pool.submit(_treedist_in_worker, c) for c in chunks]
+                    for c, future in zip(chunks, futures):
+                        future.result()
+                        if limits is not None:
+                            limits.charge(sum((ikra - lmlds_a[ikra] + 1) * (ikrb - lmlds_b[ikrb] + 1)
+                                              for ikra, ikrb in c))
+            except DiffTimeout:
+                # Drop the chunks that did not start, the running ones are short
+                pool.shutdown(cancel_futures=True)
+                raise
 
     def _treedist(self, kra: Tree, krb: Tree):
         """Computes the tree edit distance between the subtrees rooted at `kra` and `krb`.
         `kra` and `krb` are the keyroots `a` and `b`, respectively."""
-        # Get the size of the subtrees
-        n = len(kra)
-        m = len(krb)
-        # Indices of keyroots `a` and `b`, respectively
-        ikra = self.a.index_of[kra]
-        ikrb = self.b.index_of[krb]
+        return self._treedist_at(self.a.index_of[kra], self.b.index_of[krb])
+
+    def _treedist_at(self, ikra: int, ikrb: int, keep: bool = True, limits: Limits | None = None):
+        """Computes the tree edit distance between the subtrees rooted at the nodes of indices `ikra` and `ikrb`.
+        `keep` indicates whether to keep and return the whole local table. `limits` are charged as the table is computed."""
+        return self._kernel.treedist(ikra, ikrb, self.table, keep, limits)
+
+    def is_tree_comparison(self, ia0: int, ia1: int, ib0: int, ib1: int) -> bool:
+        a_is_tree = len(self.a.forest(ia0, ia1)) == 1
+        b_is_tree = len(self.b.forest(ib0, ib1)) == 1
+        return a_is_tree and b_is_tree
+
+    def _create_edit_distance_table(self, n: int, m: int) -> list[list[int]]:
+        """Creates an `n*m` tree edit distance table, where `n` and `m` are the number elements in tree `a` and `b`, respectively.
+        """
+        return [[-1] * m for _ in range(n)]
+
+
+class PreparedTree:
+    """A Tree preprocessed once for many diffs, e.g. against every other file of a project (see `distance_matrix`).
+    It holds the indices, labels and costs the inner loop of the diff needs from one side, and no `Tree`, so it is cheap to send to worker processes.
+
+    Attributes:
+    - `cost_model` is the cost model the costs were computed with.
+    - `size` is the number of nodes.
+    - `digest` is the digest of the tree (see `Tree.digest`). Trees with equal digests are at distance 0.
+    - `lmlds` are the indices of the leftmost leaf descendants of the nodes.
+    - `keyroots` are the indices of the keyroots, in increasing order.
+    - `labels` is the table of the labels of the nodes.
+    - `ids` are the label ids of the nodes.
+    - `delete` and `insert` are the costs of removing and inserting each node.
+
+    The per-node lists are indexed like the `Tree`, position 0 is unused.
+    """
+
+    def __init__(self, tree: Tree, cost_model: CostModel = UNIT_COSTS):
+        """Preprocesses `tree` for diffs with `cost_model`."""
+        self.cost_model = cost_model
+        self.size = len(tree)
+        self.digest = tree.digest()
+        self.lmlds = array('q', tree.lmlds)
+        self.keyroots = array('q', tree.keyroot_indices)
+        self.labels = LabelTable()
+        self.ids = array('q', self.labels.intern_tree(tree))
+        delete = cost_model.delete_costs(self.labels)
+        insert = cost_model.insert_costs(self.labels)
+        self.delete = [0] + [delete[id_] for id_ in self.ids[1:]]
+        self.insert = [0] + [insert[id_] for id_ in self.ids[1:]]
+
+    def __len__(self):
+        return self.size
+
+    def distance(self, other: 'PreparedTree', table: list[list] | None = None,
+                 rename: list[list] | None = None) -> int | float:
+        """Computes the tree edit distance from this tree to `other`, as `tree_diff2` does.
+        `table` is a permanent table of at least `len(self)` rows of `len(other)` cells to reuse, e.g. across the pairs computed by a worker. Its contents are overwritten.
+        `rename` are the rename costs by pair of label ids, for trees sharing their table of labels, so that they are computed once for many pairs (see `distance_matrix`). By default, they are computed for this pair.
+        """
+        kernel = _Kernel.between(self, other, rename)
+        n, m = self.size, other.size
+        if table is None:
+            table = [[-1] * m for _ in range(n)]
+        for ikra in self.keyroots:
+            for ikrb in other.keyroots:
+                kernel.treedist(ikra, ikrb, table, keep=False)
+        return table[n-1][m-1]
+
+
+class _Kernel:
+    """The inner loop of the tree diff, over the arrays precomputed from both trees.
+    It holds no `Tree`, so it can be sent to worker processes.
+
+    Attributes:
+    - `lmlds_a` and `lmlds_b` are the indices of the leftmost leaf descendants of the nodes.
+    - `ids_a` and `ids_b` are the label ids of the nodes.
+    - `delete_a` and `insert_b` are the costs of removing (inserting) each node.
+    - `rename` are the rename costs by pair of label ids.
+    """
+
+    def __init__(self, lmlds_a: list[int], lmlds_b: list[int], ids_a: list[int], ids_b: list[int],
+                 delete_a: list, insert_b: list, rename: list[list]):
+        self.lmlds_a = lmlds_a
+        self.lmlds_b = lmlds_b
+        self.ids_a = ids_a
+        self.ids_b = ids_b
+        self.delete_a = delete_a
+        self.insert_b = insert_b
+        self.rename = rename
+
+    @classmethod
+    def between(cls, a: PreparedTree, b: PreparedTree, rename: list[list] | None = None) -> '_Kernel':
+        """Creates the kernel of the diff from `a` to `b`, with the costs of `a`'s cost model.
+        `rename` are the rename costs between their label ids, if they are already known."""
+        if rename is None:
+            rename = a.cost_model.rename_matrix(a.labels, b.labels)
+        return cls(a.lmlds, b.lmlds, a.ids, b.ids, a.delete, b.insert, rename)
+
+    def typecode(self) -> str:
+        """Returns the `array` typecode able to hold the distances: `'q'` for integer costs and `'d'` otherwise."""
+        costs = [self.delete_a, self.insert_b] + self.rename
+        if all(type(c) is int for row in costs for c in row):
+            return 'q'
+        return 'd'
+
+    def treedist(self, ikra: int, ikrb: int, table, keep=True, limits: Limits | None = None):
+        """Computes the tree edit distance between the subtrees rooted at the nodes of indices `ikra` and `ikrb`, and between every pair of their subtrees sharing the leftmost leaf of the keyroots.
+        Each cell of the local table is the distance between two forests: prefixes, in postorder, of both subtrees. When both prefixes are single trees, i.e. when both nodes have the leftmost leaf of their keyroot, the distance is also a tree distance, stored in the permanent table. Otherwise, it combines the distance between the forests before both nodes' subtrees with their tree distance, already in the permanent table.
+        `table` is the permanent table, indexed as `table[i][j]`.
+        `keep` indicates whether to keep and return the whole local table. Otherwise, only the rows that later rows read are kept and `None` is returned.
+        `limits` is charged every `CHECK_CELLS` cells or so and once at the end, so that even the biggest pairs can be stopped.
+        """
+        lmlds_a = self.lmlds_a
         # Indices of leftmost leaves of keyroots `a` and `b`, respectively
-        ilkra = self.a.index_of[kra.leftmost_leaf()]
-        ilkrb = self.b.index_of[krb.leftmost_leaf()]
-        # Create the edit distance table, the +1's are for representing the empty subtree
-        temp = self._create_edit_distance_table(n+1, m+1)
-        # Initialize the edit distance table
-        for i in range(n+1):
-            temp[i][0] = i
-            for j in range(1, m+1):
-                temp[i][j] = j
+        ilkra = lmlds_a[ikra]
+        ilkrb = self.lmlds_b[ikrb]
+        # Get the size of the subtrees
+        n = ikra - ilkra + 1
+        m = ikrb - ilkrb + 1
+        # Subtrees are contiguous in postorder, so "local" indices from nodes in subtree `kra` are converted to "global" indices in tree `a` by adding an offset (analogous for `b` and `krb`)
+        offset_a = ilkra - 1
+        offset_b = ilkrb - 1
+        delete_a = self.delete_a
+        insert_b = self.insert_b
+        ids_b = self.ids_b
+        # Local row (column) of the forest before the subtree of each node of `a` (`b`): 0 for the nodes sharing the leftmost leaf of the keyroot
+        before_a = [0] + [lmlds_a[offset_a + i] - ilkra for i in range(1, n+1)]
+        before_b = [0] + [self.lmlds_b[offset_b + j] - ilkrb for j in range(1, m+1)]
+        # Rows of the local table, the +1's are for representing the empty forest
+        if keep:
+            rows: list[list] | dict[int, list] = [[]] * (n+1)
+        else:
+            # Only keep the rows read by later rows, until their last read
+            rows = {}
+            last_read = {}
+            for i in range(1, n+1):
+                last_read[before_a[i]] = i
+        # Initialize the edit distance table with the cost of removing (inserting) every node so far
+        row = [0] * (m+1)
+        for j in range(1, m+1):
+            row[j] = row[j-1] + insert_b[offset_b + j]
+        rows[0] = row
+        # Cells computed since `limits` was last charged
+        pending = 0
         # Compute the distance between the two subtrees at `kra` and `krb` locally
         for local_i in range(1, n+1):
+            global_i = offset_a + local_i
+            # Costs of the current node of `a`
+            rename_row = self.rename[self.ids_a[global_i]]
+            rmc = delete_a[global_i]
+            previous_row = row
+            row = [0] * (m+1)
+            row[0] = previous_row[0] + rmc
+            table_row = table[global_i-1]
+            # Row of the forest before the subtree of the current node
+            before = before_a[local_i]
+            before_row = rows[before]
             for local_j in range(1, m+1):
-                # Convert "local" indices from nodes in subtree `kra` to "global" indices in tree `a` (analogous for `b` and `krb`)
-                global_i = self.a.index_of[kra[local_i]]
-                global_j = self.b.index_of[krb[local_j]]
-                # Check if it is a tree or a forest comparison
-                if self.is_tree_comparison(ilkra, ikra, ilkrb, ikrb):
-                    # Check if the nodes are equal to get the edit cost
-                    equal, _, _ = kra[local_i].equals(
-                        krb[local_j], compare_children=False)
-                    # Replace cost
-                    rc = int(not equal)  # Equal nodes cost 0, different nodes cost 1
-                    # Tree comparison
-                    temp[local_i][local_j] = min(
-                        temp[local_i-1][local_j-1] + rc,  # Replace
-                        temp[local_i][local_j-1] + 1,     # Insert
-                        temp[local_i-1][local_j] + 1,     # Remove
+                global_j = offset_b + local_j
+                before_j = before_b[local_j]
+                if before == 0 and before_j == 0:
+                    # Tree comparison, equal nodes cost 0 to replace
+                    distance = min(
+                        previous_row[local_j-1] + rename_row[ids_b[global_j]],  # Replace
+                        row[local_j-1] + insert_b[global_j],                    # Insert
+                        previous_row[local_j] + rmc,                            # Remove
                     )
                     # Copy tree distances to permanent table
-                    self.table[global_i-1][global_j-1] = temp[local_i][local_j]
+                    table_row[global_j-1] = distance
                 else:
                     # Forest comparison
-                    temp[local_i][local_j] = min(
-                        temp[local_i-1][local_j-1] + \
-                            self.table[global_i-1][global_j-1],  # Replace
-                        temp[local_i][local_j-1] + 1,            # Insert
-                        temp[local_i-1][local_j] + 1,            # Remove
+                    distance = min(
+                        before_row[before_j] + table_row[global_j-1],           # Replace the subtrees
+                        row[local_j-1] + insert_b[global_j],                    # Insert
+                        previous_row[local_j] + rmc,                            # Remove
                     )
-        return temp
+                row[local_j] = distance
+            if keep:
+                rows[local_i] = row
+            else:
+                if local_i in last_read:
+                    rows[local_i] = row
+                if last_read[before] == local_i:
+                    del rows[before]
+            if limits is not None:
+                pending += m
+                if pending >= CHECK_CELLS:
+                    limits.charge(pending)
+                    pending = 0
+        if limits is not None:
+            limits.charge(pending)
+        return rows if keep else None
 
-    def is_tree_comparison(self, ia0: int, ia1: int, ib0: int, ib1: int) -> bool:
-        a_is_tree = len(self.a.forest(ia0, ia1)) == 1
-        b_is_tree = len(self.b.forest(ib0, ib1)) == 1
-        return a_is_tree and b_is_tree
 
-    def _create_edit_distance_table(self, n: int, m: int) -> list[list[int]]:
-        """Creates an `n*m` tree edit distance table, where `n` and `m` are the number elements in tree `a` and `b`, respectively.
-        """
-        table = []  # TODO: Create a dict instead
-        for i in range(n):
-            aux = []
-            for _ in range(m):
-                aux += [-1]
-            table += [aux]
+class _BufferTable:
+    """A `n*m` table of numbers stored in a buffer (e.g. shared memory), indexed as `table[i][j]`."""
+
+    def __init__(self, buffer, n: int, m: int, typecode: str):
+        self.n = n
+        self.m = m
+        self._view = memoryview(buffer).cast('B').cast(typecode)
+
+    def __getitem__(self, i: int) -> memoryview:
+        """Returns row `i`."""
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return self._view[i * self.m:(i + 1) * self.m]
+
+    def __len__(self):
+        return self.n
+
+    def fill(self, value):
+        """Sets every cell to `value`."""
+        for i in range(self.n):
+            self[i][:] = array(self._view.format, [value]) * self.m
+
+    def tolist(self) -> list[list]:
+        """Returns the table as a list of lists."""
+        return [self[i].tolist() for i in range(self.n)]
+
+    def release(self):
+        """Releases the buffer."""
+        self._view.release()
+
+
+class _MappedTable(_BufferTable):
+    """A table stored in a memory-mapped file, so that the operating system pages it in and out of RAM as needed.
+
+    Attributes:
+    - `path` is the path to the file, or `None` after it is unlinked.
+    """
+
+    def __init__(self, path: str, n: int, m: int, typecode: str):
+        """Maps the table stored in the file at `path`."""
+        self.path: str | None = path
+        with open(path, 'r+b') as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        super().__init__(self._map, n, m, typecode)
+
+    @classmethod
+    def create(cls, n: int, m: int, typecode: str, dir: str | None = None) -> '_MappedTable':
+        """Creates a table filled with -1 in a new temporary file in `dir`."""
+        fd, path = tempfile.mkstemp(prefix='srcdiff-', suffix='.table', dir=dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.truncate(n * m * array(typecode).itemsize)
+        table = cls(path, n, m, typecode)
+        table.fill(-1)
         return table
 
+    def unlink(self):
+        """Removes the file. The table stays mapped until it is closed."""
+        if self.path is not None:
+            os.unlink(self.path)
+            self.path = None
+
+    def close(self):
+        """Unmaps the table."""
+        self.release()
+        self._map.close()
+
 
 # FUNCTIONS
 
-def tree_diff2(a: Tree, b: Tree) -> int:
-    '''Performs a diff between Trees `a`and `b`.'''
-    result = TreeDiff2(a, b).run()
+def tree_diff2(a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS, jobs: int = 1,
+               ram_budget: int | None = None, limits: Limits | None = None) -> int:
+    '''Performs a diff between Trees `a`and `b`.
+    `cost_model` gives the costs of the edit operations.
+    `jobs` is the number of processes to use.
+    `ram_budget` is the maximum size, in bytes, of the table kept in memory (see `TreeDiff2`).
+    If `limits` is given and one of them is reached, `DiffTimeout` is raised with bounds of the distance.'''
+    result = TreeDiff2(a, b, cost_model, jobs, ram_budget, limits).run()
     return result
+
+
+def decomposed_tree_diff2(a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS, cache=None,
+                          **options) -> tuple[int | float, bool]:
+    '''Performs a diff between the `File` (or `Module`) Trees `a`and `b`, one top-level statement at a time.
+    Definitions (see `DEFINITIONS`) are matched by type and name, other statements only if they are identical.
+    Only the matched pairs that differ are diffed, with `tree_diff2` and `options`, or with the `cache` (a `DiffCache`) if given. Unmatched statements cost the removal (insertion) of all their nodes.
+    The result is exact when the decomposition is provably optimal: the costs are the unit ones, the roots are equal and the differences are confined to one matched pair, or to statements of a single side, surrounded by identical statements.
+    Otherwise, it is an approximation, which may also be lower than the distance, e.g. when matched statements moved.
+    Returns the distance and whether it is exact.'''
+    roots_a, items_a = _split_module(a)
+    roots_b, items_b = _split_module(b)
+    distance: int | float = 0
+    # The roots (`File` and `Module`) are compared pairwise, the missing ones are removed or inserted
+    for k in range(max(len(roots_a), len(roots_b))):
+        if k >= len(roots_a):
+            distance += cost_model.insert_cost(_label(roots_b[k]))
+        elif k >= len(roots_b):
+            distance += cost_model.delete_cost(_label(roots_a[k]))
+        else:
+            distance += cost_model.rename_cost(_label(roots_a[k]), _label(roots_b[k]))
+    roots_equal = distance == 0 and len(roots_a) == len(roots_b)
+    # Match the statements by key, in order of occurrence
+    positions_b: dict[tuple, list[int]] = {}
+    for j, item in enumerate(items_b):
+        positions_b.setdefault(_statement_key(item), []).append(j)
+    for positions in positions_b.values():
+        positions.reverse()
+    partner_of_a: list[int | None] = []
+    for item in items_a:
+        positions = positions_b.get(_statement_key(item))
+        partner_of_a.append(positions.pop() if positions else None)
+    matched_b = set(j for j in partner_of_a if j is not None)
+    # Diff the matched pairs that differ and charge the unmatched statements
+    dirty_a = []
+    dirty_b = []
+    for i, j in enumerate(partner_of_a):
+        if j is None:
+            distance += _subtree_cost(items_a[i], cost_model.delete_cost)
+            dirty_a.append(i)
+        elif not items_a[i].equals(items_b[j], report=False)[0]:
+            diff = tree_diff2 if cache is None else cache.tree_diff2
+            distance += diff(items_a[i], items_b[j], cost_model, **options)
+            dirty_a.append(i)
+            dirty_b.append(j)
+    for j, item in enumerate(items_b):
+        if j not in matched_b:
+            distance += _subtree_cost(item, cost_model.insert_cost)
+            dirty_b.append(j)
+    exact = cost_model is UNIT_COSTS and roots_equal and \
+        _confined(partner_of_a, dirty_a, dirty_b, len(items_b))
+    return distance, exact
+
+
+def _split_module(tree: Tree) -> tuple[list[Tree], list[Tree]]:
+    '''Splits a `File` or `Module` Tree into its roots, from the top down to the `Module`, and its top-level statements.'''
+    roots = [tree]
+    if tree.type == 'File' and len(tree.children) == 1:
+        roots.append(tree.children[0])
+    return roots, roots[-1].children
+
+
+def _label(node: Tree) -> tuple:
+    '''Returns the label of `node`.'''
+    return node.type, node.value
+
+
+def _statement_key(node: Tree) -> tuple:
+    '''Returns the key used to match a top-level statement: its type and name for definitions, its contents otherwise.'''
+    if node.type in DEFINITIONS:
+        return node.type, node.value
+    return node.type, node.structural_hash
+
+
+def _subtree_cost(node: Tree, cost) -> int | float:
+    '''Returns the sum of `cost` over the labels of the nodes of the subtree of `node`.'''
+    return sum(cost(_label(n)) for n in node.postorder[1:])
+
+
+def _confined(partner_of_a: list[int | None], dirty_a: list[int], dirty_b: list[int], size_b: int) -> bool:
+    '''Checks if the differences are confined to one matched pair, or to one side, surrounded by identical statements in the same order.'''
+    # Identical statements must be in the same order on both sides
+    partners = [j for j in partner_of_a if j is not None]
+    if partners != sorted(partners):
+        return False
+    if dirty_a and dirty_b:
+        # A single differing pair
+        return len(dirty_a) == 1 and len(dirty_b) == 1 and partner_of_a[dirty_a[0]] == dirty_b[0]
+    # Statements of a single side must be contiguous
+    dirty = dirty_a or dirty_b
+    return not dirty or dirty[-1] - dirty[0] == len(dirty) - 1
+
+
+def localized_tree_diff2(source_a: str, source_b: str, cost_model: CostModel = UNIT_COSTS, cache=None,
+                         **options) -> tuple[int | float, bool]:
+    '''Performs a diff between the Python sources `source_a` and `source_b`, computing tree distances only where they changed.
+    A line diff finds the unchanged lines first. Both trees are then walked from their roots: identical subtrees (by digest) are skipped, and the children of equal nodes are aligned by the lines they span, so that the unchanged ones are matched even if others were added or removed around them.
+    Only the regions left, pairs of unmatched sibling runs, are diffed with `tree_diff2` and `options`, or with the `cache` (a `DiffCache`) if given. Runs of more than one node are diffed under a common root. A run without counterpart costs the removal (insertion) of all its nodes.
+    The cost of a small edit of a big file is thus about the cost of diffing the smallest subtrees enclosing it.
+    The result is exact when the trees are equal. Otherwise, it is an upper bound of the distance, usually equal to it for local edits.
+    Returns the distance and whether it is exact.'''
+    a = Tree.from_AST(ast.parse(source_a))
+    b = Tree.from_AST(ast.parse(source_b))
+    regions = _changed_regions(a, b, _line_map(_LINE_BREAK.split(source_a), _LINE_BREAK.split(source_b)))
+    diff = tree_diff2 if cache is None else cache.tree_diff2
+    distance: int | float = 0
+    for forest_a, forest_b in regions:
+        if not forest_b:
+            distance += sum(_subtree_cost(node, cost_model.delete_cost) for node in forest_a)
+        elif not forest_a:
+            distance += sum(_subtree_cost(node, cost_model.insert_cost) for node in forest_b)
+        elif len(forest_a) == 1 and len(forest_b) == 1:
+            distance += diff(forest_a[0], forest_b[0], cost_model, **options)
+        else:
+            # The common roots cost nothing, their children are the runs
+            distance += diff(Tree('Forest', None, forest_a), Tree('Forest', None, forest_b), cost_model, **options)
+    return distance, not regions
+
+
+def _line_map(lines_a: list[str], lines_b: list[str]) -> list[int]:
+    '''Returns the line of `lines_b` each line of `lines_a` is unchanged as, or 0 if it changed.
+    Lines are numbered from 1, like `lineno`; the position 0 is unused.'''
+    result = [0] * (len(lines_a) + 1)
+    for equal, a0, a1, b0, _ in alignment(lines_a, lines_b):
+        if equal:
+            for k in range(a1 - a0):
+                result[a0 + k + 1] = b0 + k + 1
+    return result
+
+
+def _changed_regions(a: Tree, b: Tree, line_map: list[int]) -> list[tuple[list[Tree], list[Tree]]]:
+    '''Finds the regions where `a` and `b` differ, walking them from their roots. See `localized_tree_diff2`.
+    `line_map` maps the unchanged lines of `a` to their lines in `b` (see `_line_map`).
+    Returns a list of pairs of runs of sibling nodes, of `a` and `b`. Every node outside the runs is matched with an identical node.'''
+    regions: list[tuple[list[Tree], list[Tree]]] = []
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if x.digest() == y.digest():
+            continue
+        if x.type != y.type or x.value != y.value:
+            regions.append(([x], [y]))
+            continue
+        children_a, children_b = x.children, y.children
+        i0 = j0 = 0
+        for i, j in _anchors(children_a, children_b, line_map) + [(len(children_a), len(children_b))]:
+            # Drop the identical nodes at both ends of the runs, e.g. those without lines
+            while i0 < i and j0 < j and children_a[i0].digest() == children_b[j0].digest():
+                i0 += 1
+                j0 += 1
+            end_a, end_b = i, j
+            while end_a > i0 and end_b > j0 and children_a[end_a - 1].digest() == children_b[end_b - 1].digest():
+                end_a -= 1
+                end_b -= 1
+            run_a = children_a[i0:end_a]
+            run_b = children_b[j0:end_b]
+            if len(run_a) == len(run_b) and all(p.type == q.type for p, q in zip(run_a, run_b)):
+                # Pair the nodes by position, e.g. the fields of nodes of the same type
+                stack.extend(zip(run_a, run_b))
+            elif run_a or run_b:
+                regions.append((run_a, run_b))
+            i0, j0 = i + 1, j + 1
+    return regions
+
+
+def _anchors(children_a: list[Tree], children_b: list[Tree], line_map: list[int]) -> list[tuple[int, int]]:
+    '''Matches the children of two equal nodes that span unchanged lines and are identical on both sides.
+    Returns the list of pairs of indices of the matched children, in increasing order.'''
+    # Children of `b` by the lines they span
+    by_lines: dict[tuple[int, int], list[int]] = {}
+    for j, child in enumerate(children_b):
+        if child.lineno is not None:
+            by_lines.setdefault((child.lineno, child.end_lineno), []).append(j)  # type: ignore
+    result = []
+    next_j = 0
+    for i, child in enumerate(children_a):
+        if child.lineno is None:
+            continue
+        first, last = line_map[child.lineno], line_map[child.end_lineno]  # type: ignore
+        # The lines must be unchanged and contiguous in `b`
+        if not first or not last or last - first != child.end_lineno - child.lineno:  # type: ignore
+            continue
+        for j in by_lines.get((first, last), ()):
+            if j >= next_j and children_b[j].digest() == child.digest():
+                result.append((i, j))
+                next_j = j + 1
+                break
+    return result
+
+
+def _keyroot_levels(tree: Tree) -> dict[int, int]:
+    '''Returns the dependency level of each keyroot of `tree`: 0 if there is no other keyroot in its subtree, or 1 + the highest level of the keyroots in its subtree.'''
+    nodes = tree.postorder
+    keyroots = set(tree.keyroot_indices)
+    # Highest level of the keyroots in the subtree of each node, -1 if there is none
+    highest = [-1] * len(nodes)
+    levels = {}
+    index_of = tree.index_of
+    for i in range(1, len(nodes)):
+        inner = max((highest[index_of[c]] for c in nodes[i].children), default=-1)
+        if i in keyroots:
+            levels[i] = inner + 1
+            highest[i] = inner + 1
+        else:
+            highest[i] = inner
+    return levels
+
+
+def _pair_levels(a: Tree, b: Tree) -> dict[tuple[int, int], int]:
+    '''Returns the dependency level of each pair of keyroots of `a` and `b`.
+    A pair only depends on pairs of smaller subtrees, whose levels are smaller, so the pairs of a level are independent.'''
+    levels_a = _keyroot_levels(a)
+    levels_b = _keyroot_levels(b)
+    return {(ikra, ikrb): la + lb
+            for ikra, la in levels_a.items() for ikrb, lb in levels_b.items()}
+
+
+# WORKER FUNCTIONS
+# These run in the worker processes of `TreeDiff2._run_parallel`.
+
+_worker_kernel: _Kernel | None = None
+_worker_table: _BufferTable | None = None
+_worker_memory: shared_memory.SharedMemory | None = None
+
+
+def _init_worker(kernel: _Kernel, location: tuple[str, str], n: int, m: int, typecode: str):
+    '''Receives the kernel and attaches to the shared permanent table at `location` (see `TreeDiff2._run_levels`).'''
+    global _worker_kernel, _worker_table, _worker_memory
+    _worker_kernel = kernel
+    kind, name = location
+    if kind == 'file':
+        _worker_table = _MappedTable(name, n, m, typecode)
+    else:
+        _worker_memory = shared_memory.SharedMemory(name=name)
+        _worker_table = _BufferTable(_worker_memory.buf, n, m, typecode)
+
+
+def _treedist_in_worker(pairs: list[tuple[int, int]]):
+    '''Computes the tree distances of the keyroot pairs `pairs` into the shared table.'''
+    for ikra, ikrb in pairs:
+        _worker_kernel.treedist(ikra, ikrb, _worker_table, keep=False)  # type: ignore
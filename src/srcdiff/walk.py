@@ -0,0 +1,137 @@
+'''Walk directories of source files.'''
+
+
+import os
+import re
+from typing import Iterator, Sequence
+
+
+# CONSTANTS
+
+# Directories that never hold sources of interest
+DEFAULT_IGNORE = (
+    '__pycache__/', '.git/', '.hg/', '.svn/', '.tox/', '.nox/', '.venv/', 'venv/',
+    '.mypy_cache/', '.pytest_cache/', '.ruff_cache/', 'node_modules/', '*.egg-info/',
+)
+
+# Extensions of the files parsed by default
+DEFAULT_EXTENSIONS = ('.py',)
+
+
+# CLASSES
+
+class IgnoreRules:
+    """Glob rules, as in `.gitignore` files, telling which files and directories to ignore.
+    - A pattern without a slash (other than a trailing one) matches names at any depth, e.g. `__pycache__`.
+    - A pattern with a slash matches paths relative to the root of the walk, e.g. `/build` or `docs/*.py`.
+    - A trailing slash matches only directories, e.g. `.git/`.
+    - `*` and `?` do not match slashes, `**` does, e.g. `src/**/gen_*.py`.
+    - A leading `!` re-includes what previous rules ignored. The last matching rule wins.
+
+    Attributes:
+    - `patterns` is the list of patterns.
+    - `_rules` is the list of compiled rules `(regex, negated, dir_only, anchored)`.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        """Creates an IgnoreRules object from a sequence of patterns, which is copied. Blank patterns and comments (`#`) are skipped."""
+        self.patterns = list(patterns)
+        self._rules: list[tuple[re.Pattern, bool, bool, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            pattern = pattern.lstrip('/')
+            self._rules.append((re.compile(_translate(pattern)), negated, dir_only, anchored))
+
+    def ignored(self, relpath: str, is_dir: bool) -> bool:
+        """Checks if the file (or directory, if `is_dir` is set) at path `relpath`, relative to the root of the walk, is ignored."""
+        name = relpath.rsplit('/', 1)[-1]
+        ignored = False
+        for regex, negated, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(relpath if anchored else name):
+                ignored = not negated
+        return ignored
+
+
+# FUNCTIONS
+
+def _translate(pattern: str) -> str:
+    '''Translates a glob pattern to a regular expression.'''
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                negated = pattern[i + 1:i + 2] == '!'
+                body = pattern[i + 2 if negated else i + 1:end].replace('\\', '\\\\')
+                out.append(f'[{"^" if negated else ""}{body}]')
+                i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+
+def scan_dir(path: str, rules: IgnoreRules, relpath: str = '',
+             extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS) -> tuple[list[os.DirEntry], list[os.DirEntry]]:
+    '''Lists the entries of the directory at `path` that are not ignored, with a single `os.scandir` call.
+    `relpath` is the path of the directory relative to the root of the walk.
+    `extensions` filters the files by extension, `None` keeps every file.
+    Symbolic links to directories are not followed.
+    Returns the lists of files and of subdirectories, sorted by name.'''
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            entry_relpath = relpath + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if not rules.ignored(entry_relpath, True):
+                    dirs.append(entry)
+            elif entry.is_file():
+                if (extensions is None or entry.name.endswith(extensions)) and \
+                        not rules.ignored(entry_relpath, False):
+                    files.append(entry)
+    files.sort(key=lambda e: e.name)
+    dirs.sort(key=lambda e: e.name)
+    return files, dirs
+
+
+def walk_files(path: str, ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+               extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS, start: str = '') -> Iterator[str]:
+    '''Yields the paths, relative to `path`, of the files under the directory at `path` that are not ignored.
+    Ignored directories are pruned before descending into them.
+    `start` is the path of a subdirectory, relative to `path` and ending with '/', to walk instead of the whole directory.'''
+    rules = ignore if isinstance(ignore, IgnoreRules) else IgnoreRules(ignore)
+    stack = [start]
+    while stack:
+        relpath = stack.pop()
+        files, dirs = scan_dir(os.path.join(path, relpath), rules, relpath, extensions)
+        for f in files:
+            yield relpath + f.name
+        for d in reversed(dirs):
+            stack.append(relpath + d.name + '/')
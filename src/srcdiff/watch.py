@@ -0,0 +1,398 @@
+'''Watch a working tree and re-diff its files against a baseline as they change.
+
+The results are streamed as `(path, distance)` pairs, where `path` is relative to both roots:
+    python -m src.srcdiff.watch baseline/ working/
+prints one JSON object per line, e.g. `{"path": "pkg/mod.py", "distance": 3}`.
+The distance is `null` when the file is gone from both roots.
+'''
+
+
+import argparse
+import ast
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+from typing import Iterator, Sequence
+
+from src.srcdiff.diff2 import diff2_distance
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+from src.srcdiff.walk import DEFAULT_EXTENSIONS, DEFAULT_IGNORE, IgnoreRules, scan_dir, walk_files
+
+
+# TYPES
+
+# A change in a watched root: the position of the root and the path relative to it.
+# Paths ending with '/' are directories whose whole contents may have changed.
+Change = tuple[int, str]
+
+
+# CONSTANTS
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Events of interest on the watched directories
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK
+
+# Header of an inotify event: watch descriptor, mask, cookie and length of the name
+_EVENT = struct.Struct('iIII')
+
+
+# CLASSES
+
+class InotifyWatcher:
+    """Reports the changes of files under some roots with Linux inotify, without scanning them.
+    Every directory that is not ignored is watched. New directories are watched as they appear.
+
+    Attributes:
+    - `roots` are the paths of the watched directories.
+    - `rules` are the `IgnoreRules` of the files and directories not to watch.
+    - `extensions` are the extensions of the files to report, `None` reports every file.
+    - `_fd` is the inotify file descriptor.
+    - `_dirs` maps each watch descriptor to its root position and directory path relative to the root ('' for the root, 'a/b/' otherwise).
+    """
+
+    def __init__(self, roots: list[str], ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+                 extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS):
+        """Creates an InotifyWatcher and starts watching `roots`.
+        Raises `OSError` if inotify is not available.
+        """
+        self.roots = roots
+        self.rules = ignore if isinstance(ignore, IgnoreRules) else IgnoreRules(ignore)
+        self.extensions = extensions
+        self._libc = _libc()
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._fd = fd
+        self._dirs: dict[int, tuple[int, str]] = {}
+        for side in range(len(roots)):
+            self._watch_tree(side, '')
+
+    def close(self):
+        """Stops watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> 'InotifyWatcher':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _watch_tree(self, side: int, relpath: str) -> set[Change]:
+        """Watches the directory at `relpath` of root `side` and its subdirectories that are not ignored.
+        Returns the files found in them.
+        """
+        found: set[Change] = set()
+        stack = [relpath]
+        while stack:
+            relpath = stack.pop()
+            path = os.path.join(self.roots[side], relpath)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                # The directory is already gone
+                continue
+            self._dirs[wd] = (side, relpath)
+            try:
+                files, dirs = scan_dir(path, self.rules, relpath, self.extensions)
+            except OSError:
+                continue
+            found.update((side, relpath + f.name) for f in files)
+            stack.extend(relpath + d.name + '/' for d in dirs)
+        return found
+
+    def poll(self, timeout: float | None = None) -> set[Change]:
+        """Waits up to `timeout` seconds (forever if it is `None`) for changes.
+        Returns the changes read, which may be empty.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changes: set[Change] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._handle(wd, mask, name, changes)
+        return changes
+
+    def _handle(self, wd: int, mask: int, name: str, changes: set[Change]):
+        """Adds the changes of an inotify event to `changes`."""
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, everything may have changed, including the directories to watch
+            for side in range(len(self.roots)):
+                self._watch_tree(side, '')
+                changes.add((side, ''))
+            return
+        if mask & IN_IGNORED:
+            self._dirs.pop(wd, None)
+            return
+        where = self._dirs.get(wd)
+        if where is None:
+            return
+        side, relpath = where
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            changes.add((side, relpath))
+            return
+        entry = relpath + name
+        if mask & IN_ISDIR:
+            if self.rules.ignored(entry, True):
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                changes.update(self._watch_tree(side, entry + '/'))
+            else:
+                changes.add((side, entry + '/'))
+            return
+        if (self.extensions is None or name.endswith(self.extensions)) and \
+                not self.rules.ignored(entry, False):
+            changes.add((side, entry))
+
+
+class PollingWatcher:
+    """Reports the changes of files under some roots by comparing their modification times and sizes periodically.
+    It works everywhere, but each poll scans the roots.
+
+    Attributes:
+    - `roots`, `rules` and `extensions` work as in `InotifyWatcher`.
+    - `interval` is the time between scans, in seconds.
+    - `_snapshot` maps each file to its modification time and size at the last scan.
+    """
+
+    def __init__(self, roots: list[str], ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+                 extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS, interval: float = 1.0):
+        """Creates a PollingWatcher and takes the first snapshot of `roots`."""
+        self.roots = roots
+        self.rules = ignore if isinstance(ignore, IgnoreRules) else IgnoreRules(ignore)
+        self.extensions = extensions
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def close(self):
+        """Stops watching."""
+
+    def __enter__(self) -> 'PollingWatcher':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _scan(self) -> dict[Change, tuple[int, int]]:
+        """Returns the modification time and size of every file under the roots."""
+        snapshot = {}
+        for side, root in enumerate(self.roots):
+            for relpath in walk_files(root, self.rules, self.extensions):
+                try:
+                    st = os.stat(os.path.join(root, relpath))
+                except OSError:
+                    continue
+                snapshot[(side, relpath)] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self, timeout: float | None = None) -> set[Change]:
+        """Scans the roots every `interval` seconds, for up to `timeout` seconds (forever if it is `None`), until something changed.
+        Returns the changes, which may be empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            snapshot = self._scan()
+            changes = set(k for k in snapshot.keys() | self._snapshot.keys()
+                          if snapshot.get(k) != self._snapshot.get(k))
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+
+class DirectoryDiff:
+    """Diffs the files of a working directory against a baseline directory, keeping the parsed files and the results to update them incrementally.
+    Files are paired by their path relative to the roots. A file missing on one side costs its size (see `diff_revisions`).
+
+    Attributes:
+    - `roots` are the baseline and working directories.
+    - `engine` is `'tree'` to compare the files with `tree_diff2` or `'text'` to compare them with `diff2_distance`.
+    - `rules` and `extensions` select the files, as in `Tree.from_dir`.
+    - `results` maps each path to its distance.
+    - `_contents` maps each side and path to the parsed file (a `File` Tree or a text).
+    """
+
+    def __init__(self, baseline: str, working: str, engine: str = 'tree',
+                 ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+                 extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS):
+        """Creates a DirectoryDiff object. Call `update` to compute the results."""
+        if engine not in ('tree', 'text'):
+            raise ValueError(f'Unknown engine: {engine}')
+        self.roots = [baseline, working]
+        self.engine = engine
+        self.rules = ignore if isinstance(ignore, IgnoreRules) else IgnoreRules(ignore)
+        self.extensions = extensions
+        self.results: dict[str, int | float] = {}
+        self._contents: dict[Change, Tree | str] = {}
+
+    def all_changes(self) -> set[Change]:
+        """Returns the roots as changes, to (re)load everything."""
+        return set((side, '') for side in range(len(self.roots)))
+
+    def update(self, changes: set[Change]) -> list[tuple[str, int | float | None]]:
+        """Reloads the changed files and re-diffs the affected pairs.
+        Files that cannot be parsed (e.g. in the middle of an edit) keep their last contents.
+        Returns the `(path, distance)` of the pairs whose distance changed, sorted by path. The distance is `None` for pairs gone from both sides.
+        """
+        paths = set()
+        for side, relpath in changes:
+            if relpath == '' or relpath.endswith('/'):
+                paths.update(self._expand(side, relpath))
+            else:
+                paths.add(relpath)
+                self._load(side, relpath)
+        updated: list[tuple[str, int | float | None]] = []
+        for relpath in sorted(paths):
+            distance = self._diff(relpath)
+            if distance is None:
+                if self.results.pop(relpath, None) is not None:
+                    updated.append((relpath, None))
+            elif self.results.get(relpath) != distance:
+                self.results[relpath] = distance
+                updated.append((relpath, distance))
+        return updated
+
+    def _expand(self, side: int, relpath: str) -> set[str]:
+        """Reloads the files under the directory at `relpath` of root `side`, including the known ones that are gone.
+        Returns their paths.
+        """
+        paths = set(p for s, p in self._contents if s == side and p.startswith(relpath))
+        if os.path.isdir(os.path.join(self.roots[side], relpath)):
+            paths.update(walk_files(self.roots[side], self.rules, self.extensions, start=relpath))
+        for p in paths:
+            self._load(side, p)
+        return paths
+
+    def _load(self, side: int, relpath: str):
+        """Reads and parses the file at `relpath` of root `side`, or forgets it if it is gone."""
+        path = os.path.join(self.roots[side], relpath)
+        try:
+            with open(path) as f:
+                text = f.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            self._contents.pop((side, relpath), None)
+            return
+        except (OSError, UnicodeDecodeError):
+            return
+        if self.engine == 'text':
+            self._contents[(side, relpath)] = text
+            return
+        try:
+            module = ast.parse(text)
+        except (SyntaxError, ValueError):
+            return
+        self._contents[(side, relpath)] = Tree('File', relpath, [Tree.from_AST(module)])
+
+    def _diff(self, relpath: str) -> int | float | None:
+        """Returns the distance between both sides of `relpath`, or `None` if it is missing on both."""
+        a = self._contents.get((0, relpath))
+        b = self._contents.get((1, relpath))
+        if a is None and b is None:
+            return None
+        if a is None or b is None:
+            return len(a or b)  # type: ignore
+        if self.engine == 'text':
+            return diff2_distance(a, b)  # type: ignore
+        return tree_diff2(a, b)  # type: ignore
+
+
+# FUNCTIONS
+
+def _libc():
+    '''Returns the C library, with the inotify functions, or raises `OSError`.'''
+    if not sys.platform.startswith('linux'):
+        raise OSError('inotify is only available on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError('inotify is not available')
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def watcher(roots: list[str], ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+            extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS,
+            poll_interval: float | None = None) -> InotifyWatcher | PollingWatcher:
+    '''Returns an `InotifyWatcher` of `roots`, or a `PollingWatcher` scanning every `poll_interval` seconds if inotify is not available or `poll_interval` is given.'''
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(roots, ignore, extensions)
+        except OSError:
+            poll_interval = 1.0
+    return PollingWatcher(roots, ignore, extensions, poll_interval)
+
+
+def watch(baseline: str, working: str, engine: str = 'tree',
+          ignore: Sequence[str] | IgnoreRules = DEFAULT_IGNORE,
+          extensions: tuple[str, ...] | None = DEFAULT_EXTENSIONS,
+          debounce: float = 0.1, max_delay: float = 2.0,
+          poll_interval: float | None = None) -> Iterator[tuple[str, int | float | None]]:
+    '''Diffs the files of `working` against `baseline`, then watches both directories and re-diffs the files that change, forever.
+    Bursts of changes are gathered until nothing changes for `debounce` seconds, or for at most `max_delay` seconds.
+    Only the touched files are parsed again and only their pairs are diffed again.
+    `engine`, `ignore` and `extensions` work as in `DirectoryDiff`, `poll_interval` as in `watcher`.
+    Yields the `(path, distance)` of every pair first, then of the pairs whose distance changed.'''
+    diff = DirectoryDiff(baseline, working, engine, ignore, extensions)
+    with watcher([baseline, working], diff.rules, extensions, poll_interval) as w:
+        yield from diff.update(diff.all_changes())
+        while True:
+            changes = w.poll(None)
+            deadline = time.monotonic() + max_delay
+            while time.monotonic() < deadline:
+                more = w.poll(debounce)
+                if not more:
+                    break
+                changes |= more
+            yield from diff.update(changes)
+
+
+def main(argv: list[str] | None = None):
+    '''Command line entry point of the watch mode.'''
+    parser = argparse.ArgumentParser(description='Re-diff a working tree against a baseline as it changes.')
+    parser.add_argument('baseline')
+    parser.add_argument('working')
+    parser.add_argument('--engine', choices=['tree', 'text'], default='tree')
+    parser.add_argument('--debounce', type=float, default=0.1, help='quiet time that ends a burst of changes, in seconds')
+    parser.add_argument('--poll', type=float, default=None, help='scan every POLL seconds instead of using inotify')
+    args = parser.parse_args(argv)
+    try:
+        for path, distance in watch(args.baseline, args.working, args.engine,
+                                    debounce=args.debounce, poll_interval=args.poll):
+            print(json.dumps({'path': path, 'distance': distance}), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Reference implementations used to check the diffs independently of their engines."""
+
+import random
+from functools import lru_cache
+
+from src.srcdiff.costs import CostModel, UNIT_COSTS
+from src.srcdiff.tree import Tree
+
+
+def random_tree(rng: random.Random, size: int, types: str = 'abc') -> Tree:
+    """Builds a random Tree of `size` nodes whose types are characters of `types`."""
+    children = []
+    left = size - 1
+    while left:
+        child_size = rng.randint(1, left)
+        children.append(random_tree(rng, child_size, types))
+        left -= child_size
+    return Tree(rng.choice(types), None, children)
+
+
+def reference_distance(a: Tree, b: Tree, cost_model: CostModel = UNIT_COSTS) -> int | float:
+    """Computes the tree edit distance between `a` and `b` from its recursive definition on forests, in exponential time.
+    The rightmost root of either forest is removed, inserted, or replaced together with its subtree.
+    """
+    def freeze(node: Tree) -> tuple:
+        return (node.type, node.value), tuple(freeze(c) for c in node.children)
+
+    def size_cost(forest: tuple, cost) -> int | float:
+        return sum(cost(label) + size_cost(children, cost) for label, children in forest)
+
+    @lru_cache(maxsize=None)
+    def distance(f: tuple, g: tuple) -> int | float:
+        if not f:
+            return size_cost(g, cost_model.insert_cost)
+        if not g:
+            return size_cost(f, cost_model.delete_cost)
+        (v, v_children), (w, w_children) = f[-1], g[-1]
+        return min(
+            distance(f[:-1] + v_children, g) + cost_model.delete_cost(v),
+            distance(f, g[:-1] + w_children) + cost_model.insert_cost(w),
+            distance(v_children, w_children) + distance(f[:-1], g[:-1]) + cost_model.rename_cost(v, w),
+        )
+
+    return distance((freeze(a),), (freeze(b),))
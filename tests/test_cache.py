@@ -0,0 +1,78 @@
+"""Tests for the cache script."""
+
+import os
+import tempfile
+import unittest
+
+from src.srcdiff.cache import DiffCache, text_digest
+from src.srcdiff.costs import CostModel
+from src.srcdiff.diff2 import diff2
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import decomposed_tree_diff2, tree_diff2
+
+
+class TestDiffCache(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = Tree('Module', children=[Tree('Name', 'x'), Tree('Constant', 1)])
+        self.b = Tree('Module', children=[Tree('Name', 'y')])
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_tree_diff2(self):
+        """Test if equal inputs hit the cache and other settings miss it."""
+        cache = DiffCache()
+        expected = tree_diff2(self.a, self.b)
+        copy_a = Tree('Module', children=[Tree('Name', 'x'), Tree('Constant', 1)])
+
+        self.assertEqual(expected, cache.tree_diff2(self.a, self.b))
+        self.assertEqual(expected, cache.tree_diff2(copy_a, self.b))
+        self.assertEqual(3, cache.tree_diff2(self.a, self.b, CostModel(default_rename=4)))
+        self.assertEqual({'hits': 1, 'disk_hits': 0, 'misses': 2, 'entries': 2, 'disk_bytes': 0},
+                         cache.stats())
+
+    def test_diff2(self):
+        """Test if text diffs are cached by contents and kind."""
+        cache = DiffCache(max_entries=1)
+        self.assertEqual(tuple(diff2('abc', 'abd')), cache.diff2('abc', 'abd'))
+        self.assertEqual(tuple(diff2('abc', 'abd')), cache.diff2('abc', 'abd'))
+        cache.diff2(b'abc', b'abd')
+        self.assertEqual((1, 0, 2), (cache.hits, cache.disk_hits, cache.misses))
+        self.assertEqual(1, cache.stats()['entries'])
+        self.assertNotEqual(text_digest('abc'), text_digest(b'abc'))
+
+    def test_disk_layer(self):
+        """Test if results are reused by another cache on the same directory, within the size limit."""
+        directory = os.path.join(self.tempdir.name, 'cache')
+        DiffCache(directory=directory).tree_diff2(self.a, self.b)
+
+        cache = DiffCache(directory=directory, max_disk_bytes=30)
+        self.assertEqual(tree_diff2(self.a, self.b), cache.tree_diff2(self.a, self.b))
+        self.assertEqual((0, 1, 0), (cache.hits, cache.disk_hits, cache.misses))
+        for k in range(10):
+            cache.diff2('x' * k, 'y')
+        self.assertLessEqual(cache.stats()['disk_bytes'], 30)
+        self.assertEqual(cache.stats()['disk_bytes'],
+                         sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)))
+
+        cache.clear()
+        self.assertEqual([], os.listdir(directory))
+
+    def test_decomposed_tree_diff2(self):
+        """Test if the decomposed diff reuses the diffs of the definition pairs."""
+        def module(value):
+            return Tree('Module', children=[
+                Tree('FunctionDef', 'f', [Tree('Return', children=[Tree('Constant', value)])]),
+            ])
+        cache = DiffCache()
+        expected = decomposed_tree_diff2(module(1), module(2))
+        self.assertEqual(expected, decomposed_tree_diff2(module(1), module(2), cache=cache))
+        self.assertEqual(expected, decomposed_tree_diff2(module(1), module(2), cache=cache))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
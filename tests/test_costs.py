@@ -0,0 +1,70 @@
+"""Tests for the costs script."""
+
+import unittest
+from src.srcdiff.costs import CostModel, LabelTable
+from src.srcdiff.tree import Tree
+
+
+class TestLabelTable(unittest.TestCase):
+    def test_intern(self):
+        """Tests if equal labels get the same id."""
+        table = LabelTable()
+
+        self.assertEqual(0, table.intern(('Name', 'a')))
+        self.assertEqual(1, table.intern(('Name', 'b')))
+        self.assertEqual(0, table.intern(('Name', 'a')))
+        self.assertEqual(2, len(table))
+        self.assertEqual([('Name', 'a'), ('Name', 'b')], table.labels)
+
+    def test_intern_tree(self):
+        """Tests if the ids are indexed like the tree."""
+        tree = Tree('f', children=[Tree('Name', 'a'), Tree('Name', 'a')])
+        table = LabelTable()
+
+        ids = table.intern_tree(tree)
+
+        self.assertEqual([-1, 0, 0, 1], ids)
+        self.assertEqual([('Name', 'a'), ('f', None)], table.labels)
+
+
+class TestCostModel(unittest.TestCase):
+    def test_default_costs(self):
+        """Tests if every operation costs 1 by default and equal labels cost 0."""
+        model = CostModel()
+
+        self.assertEqual(1, model.insert_cost(('Name', 'a')))
+        self.assertEqual(1, model.delete_cost(('Name', 'a')))
+        self.assertEqual(1, model.rename_cost(('Name', 'a'), ('Name', 'b')))
+        self.assertEqual(0, model.rename_cost(('Name', 'a'), ('Name', 'a')))
+
+    def test_custom_costs(self):
+        """Tests per-type costs and the fallback to the defaults."""
+        model = CostModel(insert={'Load': 0}, delete={'Pass': 2},
+                          rename={('Name', 'Name'): 0.5}, default_rename=3)
+
+        self.assertEqual(0, model.insert_cost(('Load', None)))
+        self.assertEqual(1, model.insert_cost(('Pass', None)))
+        self.assertEqual(2, model.delete_cost(('Pass', None)))
+        self.assertEqual(0.5, model.rename_cost(('Name', 'a'), ('Name', 'b')))
+        self.assertEqual(3, model.rename_cost(('Name', 'a'), ('arg', 'a')))
+
+    def test_is_symmetric(self):
+        """Tests if symmetric and integral cost models are detected."""
+        self.assertTrue(CostModel().is_symmetric())
+        self.assertTrue(CostModel(insert={'Name': 2}, delete={'Name': 2}, rename={('a', 'b'): 3, ('b', 'a'): 3}).is_symmetric())
+        self.assertFalse(CostModel(insert={'Name': 2}).is_symmetric())
+        self.assertFalse(CostModel(rename={('a', 'b'): 3}).is_symmetric())
+        self.assertTrue(CostModel(insert={'Name': 2}).is_integral())
+        self.assertFalse(CostModel(rename={('Name', 'Name'): 0.5}).is_integral())
+
+    def test_rename_matrix(self):
+        """Tests if the rename matrix is indexed by pairs of label ids."""
+        model = CostModel(rename={('Name', 'Name'): 0.5})
+        table_a = LabelTable()
+        table_a.intern(('Name', 'a'))
+        table_a.intern(('Pass', None))
+        table_b = LabelTable()
+        table_b.intern(('Name', 'b'))
+        table_b.intern(('Name', 'a'))
+
+        self.assertEqual([[0.5, 0], [1, 1]], model.rename_matrix(table_a, table_b))
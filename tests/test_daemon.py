@@ -0,0 +1,105 @@
+"""Tests for the daemon script."""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.srcdiff.daemon import DiffClient, DiffDaemon
+
+
+class TestDiffDaemon(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tempdir.name, 'srcdiff.sock')
+        self.daemon = DiffDaemon(jobs=1)
+        self.server = await self.daemon.start_unix(self.socket_path)
+        self.client = await DiffClient.connect_unix(self.socket_path)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+        self.daemon.close()
+        self.tempdir.cleanup()
+
+    async def test_ping(self):
+        """Tests if the daemon answers a ping."""
+        response = await self.client.request('ping')
+
+        self.assertEqual({'id': 1, 'ok': True, 'result': 'pong'}, response)
+
+    async def test_tree_diff2(self):
+        """Tests if repeated diffs are answered from the cache."""
+        a = 'tests/data/scripts/int.py'
+        b = 'tests/data/scripts/float.py'
+
+        first = await self.client.request('tree_diff2', a, b)
+        second = await self.client.request('tree_diff2', a, b)
+        stats = await self.client.request('stats')
+
+        self.assertEqual(2, first['result'])
+        self.assertEqual(first['result'], second['result'])
+        self.assertEqual(1, stats['result']['hits'])
+        self.assertEqual(1, stats['result']['misses'])
+
+    async def test_diff2(self):
+        """Tests a text diff."""
+        response = await self.client.request(
+            'diff2', 'tests/data/scripts/int.py', 'tests/data/scripts/int.py')
+
+        distance, diffa, diffb = response['result']
+        self.assertEqual(0, distance)
+        self.assertEqual(diffa, diffb)
+
+    async def test_errors(self):
+        """Tests if errors are reported in the response."""
+        missing = await self.client.request('tree_diff2', 'missing.py', 'missing.py')
+        unknown = await self.client.request('unknown')
+
+        self.assertFalse(missing['ok'])
+        self.assertIn('FileNotFoundError', missing['error'])
+        self.assertFalse(unknown['ok'])
+
+    async def test_unexpected_errors(self):
+        """Tests if unexpected errors, such as a malformed timeout, are reported instead of leaving the client waiting."""
+        malformed = await asyncio.wait_for(self.client.request(
+            'tree_diff2', 'tests/data/scripts/int.py', 'tests/data/scripts/int.py', timeout='soon'), 5)  # type: ignore
+        ping = await asyncio.wait_for(self.client.request('ping'), 5)
+
+        self.assertFalse(malformed['ok'])
+        self.assertIn('TypeError', malformed['error'])
+        self.assertTrue(ping['ok'])
+
+    async def test_timeout(self):
+        """Tests if a request that takes too long times out."""
+        executor = ThreadPoolExecutor(max_workers=1)
+        daemon = DiffDaemon(executor=executor)
+        # Keep the only worker busy
+        blocker = asyncio.get_running_loop().run_in_executor(executor, lambda: time.sleep(0.5))
+
+        response = await daemon.handle({'id': 7, 'op': 'tree_diff2', 'timeout': 0.01,
+                                        'a': 'tests/data/scripts/int.py',
+                                        'b': 'tests/data/scripts/int.py'})
+
+        self.assertEqual({'id': 7, 'ok': False, 'error': 'timeout'}, response)
+        self.assertEqual({}, daemon._running)
+        await blocker
+        daemon.close()
+
+    async def test_long_request(self):
+        """Tests if a request longer than the stream limit is answered with an error without closing the connection."""
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        writer.write(b'{"id": 1, "op": "' + b'x' * (1 << 17) + b'"}\n{"id": 2, "op": "ping"}\n')
+        await writer.drain()
+
+        long = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        ping = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        writer.close()
+        await writer.wait_closed()
+
+        self.assertEqual({'id': None, 'ok': False, 'error': 'Request too long'}, long)
+        self.assertEqual({'id': 2, 'ok': True, 'result': 'pong'}, ping)
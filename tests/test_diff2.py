@@ -1,8 +1,10 @@
 """Tests for the diff2 script."""
 
+import os
+import tempfile
 import unittest  # TODO: Switch to pytest
 from src.srcdiff import EMPTY
-from src.srcdiff.diff2 import Diff2
+from src.srcdiff.diff2 import Diff2, diff2, diff2_distance, diff2_files, hunks, segments
 
 
 class TestDiff2(unittest.TestCase):
@@ -160,4 +162,147 @@ class TestDiff2(unittest.TestCase):
 
         diffa, diffb = self.diff._build_diffs()
         self.assertEqual(['p', 'a', 'p', EMPTY, EMPTY, EMPTY, 'e', 'r'], diffa)
-        self.assertEqual(['p', EMPTY, EMPTY, 'o', 's', 't', 'e', 'r'], diffb)
\ No newline at end of file
+        self.assertEqual(['p', EMPTY, EMPTY, 'o', 's', 't', 'e', 'r'], diffb)
+
+    def test_max_distance(self):
+        """
+        Test if the banded diff returns the same result as the full one when the distance is within `max_distance`.
+        """
+        expected = Diff2(self.a, self.b).run()
+
+        for k in [5, 6, 10]:
+            with self.subTest(f'max_distance={k}'):
+                self.assertEqual(expected, Diff2(self.a, self.b, max_distance=k).run())
+
+    def test_max_distance_exceeded(self):
+        """
+        Test if the banded diff reports distances above `max_distance`.
+        """
+        for k in [0, 1, 4]:
+            with self.subTest(f'max_distance={k}'):
+                self.assertEqual((None, None, None), Diff2(self.a, self.b, max_distance=k).run())
+        # Sizes too different to even start
+        self.assertEqual((None, None, None), diff2('a', 'abcd', max_distance=2))
+
+    def test_band(self):
+        """
+        Test if only the band of the matrix is stored.
+        """
+        diff = Diff2(self.a, self.b, max_distance=1)
+        diff._initialize()
+        diff._compute_distance_matrix()
+
+        self.assertEqual(self.diff.n + 1, len(diff.matrix))
+        self.assertTrue(all(len(row) == 3 for row in diff.matrix))
+        self.assertEqual(1, diff._cell(1, 2))
+        self.assertEqual(2, diff._cell(1, 3))
+
+    def test_segments(self):
+        """
+        Test if the common prefix and suffix are split into equal segments.
+        """
+        a = 'def f():\n    return 1\nx = 2\n'
+        b = 'def f():\n    return 2\nz = 0\nx = 2\n'
+
+        self.assertEqual([
+            (True, 0, 20, 0, 20),
+            (False, 20, 21, 20, 27),
+            (True, 21, 28, 27, 34),
+        ], segments(a, b))
+
+    def test_segments_of_lists(self):
+        """
+        Test if the elements are the tokens of sequences other than strings, and unique ones become anchors.
+        """
+        a = ['a', 'b', 'c', 'x']
+        b = ['c', 'b', 'a', 'x']
+
+        self.assertEqual([
+            (False, 0, 2, 0, 0),
+            (True, 2, 3, 0, 1),
+            (False, 3, 3, 1, 3),
+            (True, 3, 4, 3, 4),
+        ], segments(a, b))
+
+    def test_preprocess(self):
+        """
+        Test if the preprocessed diff stitches the segments back into the usual diffs.
+        """
+        a = 'x = 1\nkeep\ny = 2\n'
+        b = 'x = 3\nkeep\ny = 4\n'
+
+        distance, diffa, diffb = diff2(a, b, preprocess=True)
+
+        self.assertEqual(diff2(a, b)[0], distance)
+        self.assertEqual(a, ''.join(c for c in diffa if c is not EMPTY))
+        self.assertEqual(b, ''.join(c for c in diffb if c is not EMPTY))
+        self.assertEqual((None, None, None), diff2(a, b, max_distance=3, preprocess=True))
+
+    def test_bytes(self):
+        """
+        Test if bytes-like objects are compared byte by byte.
+        """
+        expected = Diff2(self.a, self.b).run()[0]
+
+        for a, b in [(b'paper', b'poster'), (memoryview(b'paper'), bytearray(b'poster'))]:
+            with self.subTest(f'{type(a).__name__}, {type(b).__name__}'):
+                distance, diffa, diffb = diff2(a, b)
+                self.assertEqual(expected, distance)
+                self.assertEqual([ord('p'), ord('a'), ord('p'), EMPTY, EMPTY, EMPTY, ord('e'), ord('r')], diffa)
+
+    def test_hunks(self):
+        """
+        Test if the changed regions of the diffs are found.
+        """
+        self.diff._initialize()
+        self.diff._compute_distance_matrix()
+        diffa, diffb = self.diff._build_diffs()
+
+        self.assertEqual([(1, 3, 1, 4)], hunks(diffa, diffb))
+        self.assertEqual([(11, 13, 21, 24)], hunks(diffa, diffb, 10, 20))
+
+    def test_diff2_files(self):
+        """
+        Test if files are diffed and only the changed regions are decoded.
+        """
+        with tempfile.TemporaryDirectory() as tempdir:
+            paths = [os.path.join(tempdir, name) for name in ['a', 'b', 'empty', 'c', 'd']]
+            contents = ['x = 1\ny = "ação"\n', 'x = 1\ny = "acção"\n', '', 'ab\nb\nb\n', 'b\na\na\n']
+            for path, text in zip(paths, contents):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+
+            self.assertEqual((1, [(12, '', 12, 'c')]), diff2_files(paths[0], paths[1]))
+            self.assertEqual((0, []), diff2_files(paths[0], paths[0]))
+            self.assertEqual((19, [(0, '', 0, contents[0])]), diff2_files(paths[2], paths[0]))
+            self.assertEqual((None, None), diff2_files(paths[2], paths[0], max_distance=5))
+            # Matching the unique lines gives an upper bound, the exact distance needs the whole files
+            self.assertEqual(diff2(contents[3], contents[4])[0], diff2_files(paths[3], paths[4], preprocess=False)[0])
+            self.assertGreater(diff2_files(paths[3], paths[4])[0], diff2(contents[3], contents[4])[0])
+            self.assertEqual((1, [(12, '', 12, 'c')]), diff2_files(paths[0], paths[1], preprocess=False))
+
+    def test_distance(self):
+        """
+        Test if the bit-parallel distance is the same as the one from the matrix.
+        """
+        data = [
+            ['paper', 'poster'],
+            ['poster', 'paper'],
+            ['', 'abc'],
+            ['abc', ''],
+            ['same', 'same'],
+            [b'paper', b'poster'],
+            [['x', 'y', 'z'], ['y', 'z', 'x']],
+        ]
+        for a, b in data:
+            with self.subTest(f'{a!r}, {b!r}'):
+                self.assertEqual(Diff2(a, b).run()[0], Diff2(a, b).distance())
+                self.assertEqual(diff2(a, b)[0], diff2_distance(a, b))
+
+    def test_distance_max_distance(self):
+        """
+        Test if the bit-parallel distance reports distances above `max_distance`.
+        """
+        self.assertEqual(5, diff2_distance(self.a, self.b, max_distance=5))
+        self.assertIsNone(diff2_distance(self.a, self.b, max_distance=4))
+        self.assertEqual(2, diff2_distance('keep\nx = 1\nkeep\n', 'keep\nx = 2\nkeep\n', preprocess=True))
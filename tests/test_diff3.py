@@ -0,0 +1,70 @@
+"""Tests for the diff3 script."""
+
+import ast
+import io
+import unittest
+
+from src.srcdiff.diff3 import Diff3, diff3, merge3, tree_merge3
+from src.srcdiff.tree import Tree
+
+
+class TestDiff3(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.base = ''.join(f'line {k}\n' for k in range(10))
+        self.ours = self.base.replace('line 2\n', 'ours 2\n').replace('line 8\n', 'same 8\n')
+        self.theirs = self.base.replace('line 2\n', 'theirs 2\n').replace('line 5\n', '').replace('line 8\n', 'same 8\n')
+
+    def test_diff3(self):
+        """Test if the chunks are classified, in order."""
+        expected = [('equal', 0, 2, 0, 2, 0, 2), ('conflict', 2, 3, 2, 3, 2, 3), ('equal', 3, 5, 3, 5, 3, 5),
+                    ('theirs', 5, 6, 5, 6, 5, 5), ('equal', 6, 8, 6, 8, 5, 7), ('both', 8, 9, 8, 9, 7, 8),
+                    ('equal', 9, 10, 9, 10, 8, 9)]
+        self.assertEqual(expected, list(diff3(self.base, self.ours, self.theirs)))
+        self.assertEqual(expected, list(diff3(self.base, self.ours, self.theirs, jobs=2)))
+        self.assertEqual([('equal', 0, 10, 0, 10, 0, 10)], list(diff3(self.base, self.base, self.base)))
+        self.assertEqual([('ours', 0, 0, 0, 1, 0, 0)], list(diff3('', 'x', '')))
+
+    def test_interning(self):
+        """Test if the tokens of the three inputs share their ids."""
+        d = Diff3(['a', 'b'], ['b', 'c'], ['c', 'a'])
+        self.assertEqual([0, 1, 1, 2, 2, 0], list(d._base_ids + d._ours_ids + d._theirs_ids))
+
+    def test_merge3(self):
+        """Test the merged output and the conflict markers."""
+        out = io.StringIO()
+        self.assertEqual(1, merge3(out, self.base, self.ours, self.theirs, name_base='base'))
+        self.assertEqual('line 0\nline 1\n<<<<<<< ours\nours 2\n||||||| base\nline 2\n=======\ntheirs 2\n'
+                         '>>>>>>> theirs\nline 3\nline 4\nline 6\nline 7\nsame 8\nline 9\n', out.getvalue())
+
+        out = io.BytesIO()
+        self.assertEqual(1, merge3(out, b'a\nb\n', b'a\nx', b'a\ny\n', 'left', 'right'))
+        self.assertEqual(b'a\n<<<<<<< left\nx\n=======\ny\n>>>>>>> right\n', out.getvalue())
+
+    def test_tree_merge3(self):
+        """Test if changes to different nodes merge and changes to the same node conflict."""
+        def tree(source):
+            return Tree.from_AST(ast.parse(source))
+
+        base = tree('def f(x):\n    return x\n\ndef g():\n    pass\n')
+        ours = tree('def f(x):\n    return x + 1\n\ndef g():\n    pass\n')
+        theirs = tree('def f(y):\n    return x\n\ndef g():\n    return 3\n')
+        merged, conflicts = tree_merge3(base, ours, theirs)
+        self.assertEqual(0, conflicts)
+        self.assertTrue(merged.equals(tree('def f(y):\n    return x + 1\n\ndef g():\n    return 3\n'))[0])
+        # The inputs are not modified
+        self.assertIsNone(ours.parent)
+        self.assertIs(ours, ours.children[0].parent)
+
+        merged, conflicts = tree_merge3(base, ours, tree('def f(x):\n    return -x\n\ndef g():\n    pass\n'))
+        self.assertEqual(1, conflicts)
+        conflict = merged.find('Conflict')[0]
+        self.assertEqual(['Base', 'Ours', 'Theirs'], [c.type for c in conflict.children])
+        self.assertEqual(['Name', 'BinOp', 'UnaryOp'], [c.children[0].type for c in conflict.children])
+
+        merged, conflicts = tree_merge3(base, tree('x = 1\n'), tree('def x():\n    pass\n'))
+        self.assertEqual(1, conflicts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for the git script."""
+
+import os
+import subprocess
+import tempfile
+import unittest
+
+from src.srcdiff.git import GitRepository, NULL_SHA, diff_revisions
+
+
+class TestGit(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = self.tempdir.name
+        self._git('init', '-q')
+        self._commit({'same.py': 'x = 1\n', 'changed.py': 'y = 2\n',
+                      'removed.py': 'pass\n', 'notes.txt': 'a\n'})
+        os.remove(os.path.join(self.path, 'removed.py'))
+        self._commit({'changed.py': 'y = 3\n', 'added.py': 'z\n', 'notes.txt': 'b\n'})
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _git(self, *args):
+        subprocess.run(['git', '-C', self.path, '-c', 'user.name=test',
+                        '-c', 'user.email=test@example.com', *args],
+                       check=True, capture_output=True)
+
+    def _commit(self, files):
+        for name, contents in files.items():
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write(contents)
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'commit')
+
+    def test_changes(self):
+        """Tests if only the files whose blobs changed are listed."""
+        with GitRepository(self.path) as repo:
+            changes = repo.changes('HEAD~1', 'HEAD')
+
+        paths = sorted(path for path, _, _ in changes)
+        self.assertEqual(['added.py', 'changed.py', 'notes.txt', 'removed.py'], paths)
+        added = [c for c in changes if c[0] == 'added.py'][0]
+        self.assertEqual(NULL_SHA, added[1])
+
+    def test_read_blob(self):
+        """Tests if blobs are read through the same cat-file process."""
+        with GitRepository(self.path) as repo:
+            _, sha_a, sha_b = [c for c in repo.changes('HEAD~1', 'HEAD') if c[0] == 'changed.py'][0]
+            self.assertEqual(b'y = 2\n', repo.read_blob(sha_a))
+            process = repo._cat_file
+            self.assertEqual(b'y = 3\n', repo.read_blob(sha_b))
+            self.assertIs(process, repo._cat_file)
+            self.assertIs(repo.parse(sha_a), repo.parse(sha_a))
+
+    def test_diff_revisions(self):
+        """Tests the diff of two revisions with both engines."""
+        tree = dict(diff_revisions(self.path, 'HEAD~1', 'HEAD'))
+        text = dict(diff_revisions(self.path, 'HEAD~1', 'HEAD', engine='text'))
+
+        self.assertEqual({'added.py': 5, 'changed.py': 1, 'removed.py': 3}, tree)
+        self.assertEqual({'added.py': 2, 'changed.py': 2, 'removed.py': 5}, text)
+
+    def test_file_tree(self):
+        """Tests if a blob at several paths does not share its cached tree."""
+        with GitRepository(self.path) as repo:
+            _, _, sha = [c for c in repo.changes('HEAD~1', 'HEAD') if c[0] == 'changed.py'][0]
+            a = repo.file_tree('a.py', sha)
+            b = repo.file_tree('b.py', sha)
+            self.assertIs(a, a.children[0].parent)
+            self.assertIs(b, b.children[0].parent)
+            self.assertIsNone(repo.parse(sha).parent)
+            self.assertTrue(a.children[0].equals(b.children[0])[0])
+
+    def test_diff_revisions_unparsable(self):
+        """Tests if an unparsable file is reported without aborting the diff."""
+        self._commit({'broken.py': 'def (\n', 'changed.py': 'y = 4\n'})
+        tree = dict(diff_revisions(self.path, 'HEAD~1', 'HEAD'))
+
+        self.assertEqual({'broken.py': None, 'changed.py': 1}, tree)
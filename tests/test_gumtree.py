@@ -0,0 +1,82 @@
+"""Tests for the gumtree script."""
+
+import ast
+import random
+import unittest
+
+from src.srcdiff.gumtree import GumTreeMatcher, approximate_tree_diff2
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import tree_diff2
+from tests.reference import random_tree, reference_distance
+
+
+class TestGumTree(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = Tree.from_AST(ast.parse(
+            'def f(x):\n    return x + 1\n\n'
+            'def g(y):\n    if y:\n        return y\n    return 0\n\n'
+            'z = f(2) + g(3)\n'))
+        self.b = Tree.from_AST(ast.parse(
+            'def f(x):\n    return x + 2\n\n'
+            'def g(y):\n    if y:\n        print(y)\n        return y\n    return 0\n\n'
+            'w = f(2) + g(3)\n'))
+
+    def test_match(self):
+        """Test if the matching is a valid edit mapping."""
+        pairs = GumTreeMatcher(self.a, self.b).match()
+        self.assertIn((len(self.a), len(self.b)), pairs)
+        lmlds_a, lmlds_b = self.a.lmlds, self.b.lmlds
+        for i1, j1 in pairs:
+            for i2, j2 in pairs:
+                self.assertEqual(i1 < i2, j1 < j2)
+                # Descendants are matched to descendants
+                self.assertEqual(lmlds_a[i2] <= i1 < i2, lmlds_b[j2] <= j1 < j2)
+
+    def test_approximate_tree_diff2(self):
+        """Test if the approximation is an upper bound of the exact distance, and exact when the roots are recovered."""
+        exact = tree_diff2(self.a, self.b)
+        distance, is_exact = approximate_tree_diff2(self.a, self.b, recovery_size=0)
+        self.assertGreaterEqual(distance, exact)
+        self.assertFalse(is_exact)
+        distance, is_exact = approximate_tree_diff2(self.a, self.b, recovery_size=20)
+        self.assertGreaterEqual(distance, exact)
+        self.assertEqual((exact, True), approximate_tree_diff2(self.a, self.b, recovery_size=len(self.b)))
+        self.assertEqual((0, True), approximate_tree_diff2(self.a, self.a, recovery_size=0))
+
+    def test_approximate_tree_diff2_inner_root(self):
+        """Test if the approximation is not exact when the root of `a` is recovered with an inner node of `b`."""
+        a = Tree('a', None, [Tree('a', None, [Tree('c')]), Tree('c', None, [Tree('a')])])
+        b = Tree('c', None, [Tree('b', None, [Tree('b')]), Tree('a', None, [Tree('c', None, [Tree('a')])]), Tree('c'),
+                             Tree('b', None, [Tree('b')])])
+        self.assertIn((len(a), 5), GumTreeMatcher(a, b).match())
+        distance, is_exact = approximate_tree_diff2(a, b)
+        self.assertGreater(distance, tree_diff2(a, b))
+        self.assertFalse(is_exact)
+
+    def test_reference(self):
+        """Test the approximation against the recursive definition of the distance, on random trees."""
+        rng = random.Random(0)
+        for k in range(300):
+            a = random_tree(rng, rng.randint(1, 8))
+            b = random_tree(rng, rng.randint(1, 10))
+            expected = reference_distance(a, b)
+            for recovery_size in [0, 3, 100]:
+                with self.subTest(k=k, recovery_size=recovery_size):
+                    distance, is_exact = approximate_tree_diff2(a, b, recovery_size=recovery_size)
+                    self.assertGreaterEqual(distance, expected)
+                    if is_exact:
+                        self.assertEqual(expected, distance)
+
+    def test_scripts(self):
+        """Test the approximation on the scripts used by the other tests."""
+        names = ['blank', 'bool', 'class', 'dict', 'function', 'list']
+        trees = [Tree.from_file(f'tests/data/scripts/{name}.py') for name in names]
+        for a, b in zip(trees, trees[1:]):
+            with self.subTest(f'{a.value} {b.value}'):
+                self.assertGreaterEqual(approximate_tree_diff2(a, b, recovery_size=0)[0], tree_diff2(a, b))
+                self.assertEqual((tree_diff2(a, b), True), approximate_tree_diff2(a, b))
+
+
+if __name__ == '__main__':
+    unittest.main()
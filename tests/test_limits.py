@@ -0,0 +1,138 @@
+"""Tests for the limits script."""
+
+import asyncio
+import random
+import threading
+import unittest
+
+from src.srcdiff.diff2 import Diff2, diff2, diff2_distance
+from src.srcdiff.limits import CancellationToken, DiffTimeout, Limits, run_in_thread
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import TreeDiff2, tree_diff2
+from tests.reference import random_tree, reference_distance
+
+
+def chain(types: str) -> Tree:
+    """Builds a Tree with a node per character of `types`, each one the parent of the next."""
+    node = None
+    for type_ in reversed(types):
+        node = Tree(type_, children=[node] if node else [])
+    return node  # type: ignore
+
+
+class TestLimits(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = 'abcab' * 40
+        self.b = 'bacba' * 40
+        self.distance = Diff2(self.a, self.b).distance()
+
+    def test_charge(self):
+        """Test if each limit raises with its reason."""
+        limits = Limits(budget=10)
+        limits.charge(10)
+        with self.assertRaises(DiffTimeout) as cm:
+            limits.charge(1)
+        self.assertEqual('budget', cm.exception.reason)
+        with self.assertRaises(DiffTimeout) as cm:
+            Limits(timeout=0).charge(0)
+        self.assertEqual('deadline', cm.exception.reason)
+        token = CancellationToken()
+        thread = threading.Thread(target=token.cancel)
+        thread.start()
+        thread.join()
+        with self.assertRaises(DiffTimeout) as cm:
+            Limits(token=token).charge(0)
+        self.assertEqual('cancelled', cm.exception.reason)
+
+    def test_diff2(self):
+        """Test if the diffs stop with bounds of the distance."""
+        runs = [
+            ['matrix', lambda limits: diff2(self.a, self.b, limits=limits)],
+            ['band', lambda limits: diff2(self.a, self.b, max_distance=150, limits=limits)],
+            ['bit-parallel', lambda limits: diff2_distance(self.a, self.b, limits=limits)],
+        ]
+        for label, run in runs:
+            with self.subTest(label):
+                with self.assertRaises(DiffTimeout) as cm:
+                    run(Limits(budget=5000))
+                self.assertLessEqual(cm.exception.lower, self.distance)
+                self.assertGreaterEqual(cm.exception.upper, self.distance)
+                self.assertLess(cm.exception.lower, cm.exception.upper)
+
+        self.assertEqual(self.distance, diff2(self.a, self.b, limits=Limits(budget=10**6))[0])
+
+    def test_tree_diff2(self):
+        """Test if the tree diff stops with bounds of the distance."""
+        a = chain('abcdefgh' * 4)
+        b = chain('bcdefgha' * 4)
+        with self.assertRaises(DiffTimeout) as cm:
+            tree_diff2(a, b, limits=Limits(budget=100))
+        distance = tree_diff2(a, b)
+        self.assertLessEqual(cm.exception.lower, distance)
+        self.assertGreaterEqual(cm.exception.upper, distance)
+
+    def test_tree_diff2_bounds(self):
+        """Test the bounds of the tree diff against the recursive definition of the distance, on random trees."""
+        rng = random.Random(0)
+        for k in range(200):
+            a = random_tree(rng, rng.randint(1, 8))
+            b = random_tree(rng, rng.randint(1, 8))
+            expected = reference_distance(a, b)
+            with self.subTest(k=k):
+                for approximate in [True, False]:
+                    lower, upper = TreeDiff2(a, b).bounds(approximate)
+                    self.assertLessEqual(lower, expected)
+                    self.assertGreaterEqual(upper, expected)
+
+    def test_tree_diff2_deadline_bounds(self):
+        """Test if the approximate matching is skipped once the deadline passed."""
+        a = chain('abcdefgh' * 4)
+        b = chain('bcdefgha' * 4)
+        with self.assertRaises(DiffTimeout) as cm:
+            tree_diff2(a, b, limits=Limits(timeout=0))
+        self.assertEqual('deadline', cm.exception.reason)
+        self.assertEqual(len(a) + len(b), cm.exception.upper)
+
+    def test_tree_diff2_cancel_root_pair(self):
+        """Test if cancelling the tree diff stops it while the only keyroot pair, of the roots, is computed."""
+        # Chains have a single keyroot, their root
+        a = chain('abcdefgh' * 250)
+        b = chain('bcdefgha' * 250)
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                token = CancellationToken()
+                limits = Limits(token=token)
+                timer = threading.Timer(0.05, token.cancel)
+                timer.start()
+                try:
+                    with self.assertRaises(DiffTimeout) as cm:
+                        tree_diff2(a, b, jobs=jobs, limits=limits)
+                finally:
+                    timer.cancel()
+                self.assertEqual('cancelled', cm.exception.reason)
+                self.assertLess(limits.used, len(a) * len(b))
+
+
+class TestRunInThread(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel(self):
+        """Test if cancelling the awaiting task stops the diff."""
+        token = CancellationToken()
+        stopped = threading.Event()
+
+        def work():
+            limits = Limits(token=token)
+            try:
+                while True:
+                    limits.charge(1)
+            finally:
+                stopped.set()
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(run_in_thread(work, token=token), 0.05)
+        self.assertTrue(token.cancelled)
+        self.assertTrue(await asyncio.to_thread(stopped.wait, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
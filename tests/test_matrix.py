@@ -0,0 +1,76 @@
+"""Tests for the matrix script."""
+
+import ast
+import unittest
+
+from src.srcdiff.costs import CostModel
+from src.srcdiff.matrix import DistanceMatrix, distance_matrix
+from src.srcdiff.tree import Tree
+from src.srcdiff.treediff2 import PreparedTree, tree_diff2
+from tests.reference import reference_distance
+
+
+class TestMatrix(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        sources = ['x = 1\n', 'def f(a):\n    return a\n', 'x = 1\n', 'def f(a, b):\n    return a + b\n',
+                   'for i in range(3):\n    print(i)\n', '']
+        self.trees = [Tree.from_AST(ast.parse(s)) for s in sources]
+
+    def test_distance_matrix(self):
+        """Test if the distances match tree_diff2, serially and in parallel."""
+        expected = [[tree_diff2(a, b) for b in self.trees] for a in self.trees]
+        self.assertEqual(expected, distance_matrix(self.trees).tolist())
+        self.assertEqual(expected, distance_matrix(self.trees, jobs=2).tolist())
+
+    def test_reference(self):
+        """Test the matrix against distances computed independently of the diff engine."""
+        matrix = distance_matrix(self.trees)
+        # Only the value of the constant differs
+        self.assertEqual(1, distance_matrix([self.trees[0], Tree.from_AST(ast.parse('x = 2\n'))])[0, 1])
+        # The empty module is the root of every tree
+        self.assertEqual(len(self.trees[1]) - 1, matrix[1, 5])
+        cost_model = CostModel(rename={('Name', 'Name'): 0.25, ('Constant', 'Constant'): 0.5})
+        trees = [Tree.from_AST(ast.parse(s)) for s in ['x = y\n', 'z = w\n', 'x = 2\n', 'x = "2"\n']]
+        expected = [[reference_distance(a, b, cost_model) for b in trees] for a in trees]
+        self.assertEqual(expected, distance_matrix(trees, cost_model).tolist())
+        self.assertEqual(expected, distance_matrix(trees, cost_model, jobs=2).tolist())
+
+    def test_asymmetric_costs(self):
+        """Test if both distances of each pair are computed when the cost model is not symmetric."""
+        cost_model = CostModel(insert={'Name': 3}, default_rename=0.5)
+        self.assertFalse(cost_model.is_symmetric())
+        matrix = distance_matrix(self.trees, cost_model)
+        self.assertEqual('d', matrix.values.typecode)
+        for i, a in enumerate(self.trees):
+            for j, b in enumerate(self.trees):
+                self.assertEqual(tree_diff2(a, b, cost_model), matrix[i, j])
+
+    def test_shared_labels(self):
+        """Test if labels found in a single tree, numbered together, still cost their rename."""
+        cost_model = CostModel(rename={('Name', 'Name'): 0.25, ('Constant', 'Constant'): 0.5})
+        sources = ['x = y\n', 'z = w\n', 'x = 2\n', 'x = "2"\n', 'x = y\n']
+        trees = [Tree.from_AST(ast.parse(s)) for s in sources]
+        expected = [[tree_diff2(a, b, cost_model) for b in trees] for a in trees]
+        self.assertEqual(expected, distance_matrix(trees, cost_model).tolist())
+        self.assertEqual(expected, distance_matrix(trees, cost_model, jobs=2).tolist())
+
+    def test_prepared_trees(self):
+        """Test if prepared trees are reused and must match the cost model."""
+        prepared = [PreparedTree(t) for t in self.trees]
+        self.assertEqual(tree_diff2(self.trees[1], self.trees[3]), prepared[1].distance(prepared[3]))
+        self.assertEqual(distance_matrix(self.trees).tolist(), distance_matrix(prepared).tolist())
+        with self.assertRaises(ValueError):
+            distance_matrix(prepared, CostModel(default_insert=2))
+
+    def test_distance_matrix_class(self):
+        """Test the indexing of the matrix."""
+        matrix = DistanceMatrix(3)
+        matrix[1, 2] = 7
+        self.assertEqual(7, matrix[1, 2])
+        self.assertEqual([0, 0, 7], matrix.row(1).tolist())
+        self.assertEqual(3, len(matrix))
+
+
+if __name__ == '__main__':
+    unittest.main()
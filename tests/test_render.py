@@ -0,0 +1,60 @@
+"""Tests for the render script."""
+
+import io
+import unittest
+
+from src.srcdiff.diff2 import diff2
+from src.srcdiff.render import hunks_of, runs, write_side_by_side, write_unified
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = [f'line {k}\n' for k in range(20)]
+        self.b = list(self.a)
+        self.b[2] = 'changed\n'
+        self.b.insert(15, 'added\n')
+
+    def test_runs(self):
+        """Test if the alignment of diff2 is coalesced into runs."""
+        _, diffa, diffb = diff2(['x', 'a', 'b'], ['a', 'c', 'b'])
+        self.assertEqual([(False, 0, 1, 0, 0), (True, 1, 2, 0, 1), (False, 2, 2, 1, 2), (True, 2, 3, 2, 3)],
+                         list(runs(diffa, diffb)))
+
+    def test_hunks_of(self):
+        """Test if changes close to each other share a hunk and long equal stretches are cut."""
+        segs = [(True, 0, 1000, 0, 1000), (False, 1000, 1001, 1000, 1000),
+                (True, 1001, 1003, 1000, 1002), (False, 1003, 1003, 1002, 1003),
+                (True, 1003, 5000, 1003, 5000)]
+        self.assertEqual([[(True, 997, 1000, 997, 1000), (False, 1000, 1001, 1000, 1000),
+                           (True, 1001, 1003, 1000, 1002), (False, 1003, 1003, 1002, 1003),
+                           (True, 1003, 1006, 1003, 1006)]],
+                         list(hunks_of(iter(segs))))
+        self.assertEqual(2, len(list(hunks_of(iter(segs), context=0))))
+
+    def test_write_unified(self):
+        """Test the unified diff output."""
+        out = io.StringIO()
+        self.assertEqual(2, write_unified(out, self.a, self.b, context=1))
+        self.assertEqual('--- a\n+++ b\n'
+                         '@@ -2,3 +2,3 @@\n line 1\n-line 2\n+changed\n line 3\n'
+                         '@@ -15,2 +15,3 @@\n line 14\n+added\n line 15\n',
+                         out.getvalue())
+
+        out = io.StringIO()
+        self.assertEqual(0, write_unified(out, self.a, self.a))
+        self.assertEqual('', out.getvalue())
+
+    def test_write_side_by_side(self):
+        """Test the side-by-side output."""
+        out = io.StringIO()
+        self.assertEqual(2, write_side_by_side(out, self.a, self.b, context=0, width=23))
+        self.assertEqual('@@ -3 +3 @@\n'
+                         'line 2     | changed\n'
+                         '@@ -15,0 +16 @@\n'
+                         '           > added\n',
+                         out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests for the serialize script."""
+
+import io
+import sys
+import unittest
+
+from src.srcdiff.serialize import read_json, read_sexp, write_json, write_sexp
+from src.srcdiff.tree import Tree
+
+
+class TestSerialize(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tree = Tree('File', 'a b.py', [
+            Tree('Module', children=[
+                Tree('FunctionDef', 'f', [
+                    Tree('arguments', children=[Tree('arg', 'x')]),
+                    Tree('Return', children=[Tree('Constant', 1.5)]),
+                ]),
+                Tree('Expr', children=[Tree('Constant', True), Tree('Constant', -3), Tree('Constant', 'say "(hi)"\n')]),
+                Tree('Odd type (x)', float('inf')),
+                Tree('', ''),
+            ]),
+        ])
+
+    def _assert_same(self, a: Tree, b: Tree):
+        self.assertEqual(a.digest(), b.digest())
+        self.assertEqual(len(a), len(b))
+
+    def test_write_json(self):
+        """Test the JSON output."""
+        out = io.StringIO()
+        write_json(out, Tree('Module', children=[Tree('Name', 'x'), Tree('Pass')]))
+        self.assertEqual('{"type":"Module","value":null,"children":['
+                         '{"type":"Name","value":"x","children":[]},'
+                         '{"type":"Pass","value":null,"children":[]}]}', out.getvalue())
+
+    def test_write_sexp(self):
+        """Test the S-expression output."""
+        out = io.StringIO()
+        write_sexp(out, Tree('Module', children=[Tree('Name', 'x'), Tree('Constant', False), Tree('a b', 2)]))
+        self.assertEqual('(Module (Name "x") (Constant #f) ("a b" 2))', out.getvalue())
+
+    def test_round_trip(self):
+        """Test if the trees are read back as written, across chunk boundaries."""
+        for write, read in ((write_json, read_json), (write_sexp, read_sexp)):
+            out = io.StringIO()
+            write(out, self.tree)
+            for chunk_size in (1, 3, 1 << 16):
+                with self.subTest(write=write.__name__, chunk_size=chunk_size):
+                    tree = read(io.StringIO(out.getvalue()), chunk_size)
+                    self._assert_same(self.tree, tree)
+                    self.assertIs(True, tree[6].value)
+                    self.assertEqual(-3, tree[7].value)
+
+    def test_deep_tree(self):
+        """Test if trees deeper than the recursion limit are written and read back."""
+        tree = Tree('leaf')
+        for k in range(sys.getrecursionlimit() * 2):
+            tree = Tree('node', k, [tree])
+        for write, read in ((write_json, read_json), (write_sexp, read_sexp)):
+            with self.subTest(write=write.__name__):
+                out = io.StringIO()
+                write(out, tree)
+                self._assert_same(tree, read(io.StringIO(out.getvalue())))
+
+    def test_invalid(self):
+        """Test if invalid inputs raise ValueError."""
+        for text in ('', '{"type":"a"', '{"type":"a","other":1}', '{"value":1,"children":[]}',
+                     '{"type":"a","children":[1]}', '{"type":"a"} {}', '{"type":1}'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                read_json(io.StringIO(text))
+        for text in ('', '(a', '(a 1 2)', '(a (b) 1)', 'a', '(a) (b)', '(())', '(a "x'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                read_sexp(io.StringIO(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 """
 Tests for the tree script.
 """
+import ast
 import unittest
 
 from src.srcdiff.tree import Tree
@@ -354,4 +355,159 @@ class TestTree(unittest.TestCase):
         for expected, first, last in data:
             subtest_label = f'First: {first}, last: {last}'
             with self.subTest(subtest_label):
-                self.assertEqual(expected, tree.forest(first, last))
\ No newline at end of file
+                self.assertEqual(expected, tree.forest(first, last))
+
+    def test_depth(self):
+        """Test the depth property."""
+        f = self.example_tree
+        d = f.children[0]
+        c = d.children[1]
+        b = c.children[0]
+
+        self.assertEqual(0, f.depth)
+        self.assertEqual(1, d.depth)
+        self.assertEqual(2, c.depth)
+        self.assertEqual(3, b.depth)
+
+    def test_depth_after_adoption(self):
+        """Test if the depths are updated when a root becomes a child."""
+        child = Tree('c', children=[Tree('l')])
+        leaf = child.children[0]
+        self.assertEqual(1, leaf.depth)
+
+        Tree('p', children=[child])
+
+        self.assertEqual(1, child.depth)
+        self.assertEqual(2, leaf.depth)
+
+    def test_height(self):
+        """Test the height property."""
+        f = self.example_tree
+        d = f.children[0]
+        c = d.children[1]
+        e = f.children[1]
+
+        self.assertEqual(3, f.height)
+        self.assertEqual(2, d.height)
+        self.assertEqual(1, c.height)
+        self.assertEqual(0, e.height)
+
+    def test_lmlds(self):
+        """Test the lmlds property."""
+        self.assertEqual([0, 1, 2, 2, 1, 5, 1], self.example_tree.lmlds)
+        self.assertEqual([0, 1, 1], self.example_tree.children[0].children[1].lmlds)
+
+    def test_keyroot_indices(self):
+        """Test the keyroot_indices property."""
+        self.assertEqual([3, 5, 6], self.example_tree.keyroot_indices)
+
+    def test_invalidate(self):
+        """Test if the metadata is updated after changing the children."""
+        f = self.example_tree
+        d = f.children[0]
+        new = Tree('g', children=[Tree('h')])
+        self.assertEqual(6, len(f))
+
+        d.children.append(new)
+        d.invalidate()
+
+        self.assertEqual(8, len(f))
+        self.assertEqual(6, len(d))
+        self.assertEqual(d, new.parent)
+        self.assertEqual(3, new.children[0].depth)
+        self.assertEqual(new, f[5])
+        self.assertEqual([3, 5, 7, 8], f.keyroot_indices)
+
+    def test_invalidate_leaf(self):
+        """Test if adding children to a leaf built without children leaves the other leaves unchanged."""
+        x = Tree('x')
+        x.children.append(Tree('c', children=[]))
+        x.invalidate()
+        z = Tree('z')
+
+        self.assertEqual(2, len(x))
+        self.assertEqual([], z.children)
+        self.assertEqual(1, len(z))
+
+    def test_source_lines(self):
+        """Test if the source lines of the AST nodes are kept."""
+        tree = Tree.from_AST(ast.parse('x = 1\n\ndef f():\n    return x\n'))
+        self.assertEqual((None, None), (tree.lineno, tree.end_lineno))
+        self.assertEqual([(1, 1), (3, 4)], [(c.lineno, c.end_lineno) for c in tree.children])
+        self.assertEqual((4, 4), (tree.find('Return')[0].lineno, tree.find('Return')[0].end_lineno))
+
+    def test_find(self):
+        """Test the queries by node type and value."""
+        tree = Tree('Module', children=[
+            Tree('FunctionDef', 'f', [Tree('Call', 'g'), Tree('Call', 'h')]),
+            Tree('FunctionDef', 'k', [Tree('Call', 'g')]),
+        ])
+        f = tree.children[0]
+        self.assertEqual([1, 2, 4], list(tree.indices('Call')))
+        self.assertEqual([1, 4], list(tree.indices('Call', 'g')))
+        self.assertEqual([f, tree.children[1]], tree.find('FunctionDef'))
+        self.assertEqual([f.children[0]], tree.find('Call', 'g', within=f))
+        self.assertEqual(0, tree.count('Call', 'x'))
+        self.assertEqual(0, tree.count('Missing'))
+
+        f.children.append(Tree('Call', 'g'))
+        f.invalidate()
+
+        self.assertEqual(3, tree.count('Call', 'g'))
+        self.assertEqual([1, 3], list(tree.indices('Call', 'g', within=f)))
+
+    def test_equals_without_report(self):
+        """Test if the equals method skips the paths when they are not requested."""
+        treea = Tree('Name', 'a', [Tree('Expr')])
+        treeb = Tree('Name', 'a', [Tree('Constant')])
+
+        self.assertEqual((False, None, None), treea.equals(treeb, report=False))
+        self.assertEqual((True, None, None), treea.equals(treea, report=False))
+
+    def test_equals_deep_trees(self):
+        """Test the equals method on trees deeper than the recursion limit."""
+        def chain(leaf_type):
+            node = Tree(leaf_type)
+            for _ in range(5000):
+                node = Tree('Expr', children=[node])
+            return node
+        treea = chain('Pass')
+        treeb = chain('Pass')
+        treec = chain('Break')
+
+        self.assertTrue(treea.equals(treeb)[0])
+        res, diffa, diffb = treea.equals(treec)
+        self.assertFalse(res)
+        self.assertTrue(diffa.endswith('/0/Pass'))
+        self.assertTrue(diffb.endswith('/0/Break'))
+
+    def test_structural_hash(self):
+        """Test if equal trees have equal structural hashes and the hash is updated on changes."""
+        treea = Tree('Name', 'a', [Tree('Load')])
+        treeb = Tree('Name', 'a', [Tree('Load')])
+        self.assertEqual(treea.structural_hash, treeb.structural_hash)
+
+        treeb.children.append(Tree('Load'))
+        treeb.invalidate()
+
+        self.assertNotEqual(treea.structural_hash, treeb.structural_hash)
+
+    def test_digest(self):
+        """Test if trees whose values compare equal have equal digests, and only those."""
+        numbers = [Tree('Constant', value) for value in (1, 1.0, True)]
+        for tree in numbers:
+            self.assertTrue(numbers[0].equals(tree)[0])
+            self.assertEqual(numbers[0].digest(), tree.digest())
+
+        for value in ('1', 1.5, 2, None):
+            self.assertNotEqual(numbers[0].digest(), Tree('Constant', value).digest())
+        self.assertEqual(Tree('Constant', 0).digest(), Tree('Constant', -0.0).digest())
+
+    def test_forest_of_subtree(self):
+        """Test the forest method on a subtree, whose root has a parent."""
+        d = self.example_tree.children[0]
+        a = d.children[0]
+        c = d.children[1]
+
+        self.assertEqual([a, c], d.forest(1, 3))
+        self.assertEqual([d], d.forest(1, 4))
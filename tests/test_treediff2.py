@@ -1,9 +1,14 @@
 """Tests for the treediff2 script."""
 
+import ast
+import random
 import unittest
 from src.srcdiff import EMPTY
+from src.srcdiff.costs import CostModel
 from src.srcdiff.tree import Tree
-from src.srcdiff.treediff2 import TreeDiff2
+from src.srcdiff.treediff2 import TreeDiff2, _changed_regions, _line_map, _pair_levels, decomposed_tree_diff2, \
+    localized_tree_diff2, tree_diff2
+from tests.reference import random_tree, reference_distance
 
 
 class TestTreeDiff2(unittest.TestCase):
@@ -93,8 +98,8 @@ class TestTreeDiff2(unittest.TestCase):
                 [4, 4],
                 [5, 4],
                 [6, 5]]
-        ''' BUG: The resulting 6x6 forest distance table is different from the paper* where I got this algorithm from.
-        In the paper, the 6x6 table is
+        # Table 6x6 of the paper*
+        # * ZHANG, K. and SHASHA, D. Simple Fast Algorithms For the Editing Distance Between Trees and Related Problems. 1989. Available at: https://grantjenks.com/wiki/_media/ideas/simple_fast_algorithms_for_the_editing_distance_between_tree_and_related_problems.pdf
         t6_6 = [[0, 1, 2, 3, 4, 5, 6],
                 [1, 0, 1, 2, 3, 4, 5],
                 [2, 1, 0, 1, 2, 3, 4],
@@ -102,20 +107,6 @@ class TestTreeDiff2(unittest.TestCase):
                 [4, 3, 2, 1, 2, 3, 4],
                 [5, 4, 3, 2, 3, 2, 3],
                 [6, 5, 4, 3, 3, 3, 2]]
-        (lines 3, 4, and 5 changed, starting at position [3,3]).
-        Apparently that is because it is not allowed to replace node c by node d.
-        Gotta find out why.
-
-        * ZHANG, K. and SHASHA, D. Simple Fast Algorithms For the Editing Distance Between Trees and Related Problems. 1989. Available at: https://grantjenks.com/wiki/_media/ideas/simple_fast_algorithms_for_the_editing_distance_between_tree_and_related_problems.pdf
-        '''
-
-        t6_6 = [[0, 1, 2, 3, 4, 5, 6],
-                [1, 0, 1, 2, 3, 4, 5],
-                [2, 1, 0, 1, 2, 3, 4],
-                [3, 2, 1, 1, 1, 2, 3],
-                [4, 3, 2, 1, 2, 2, 3],
-                [5, 4, 3, 2, 2, 2, 3],
-                [6, 5, 4, 3, 3, 3, 2]]
         # Keyroots of A are 3, 5, 6
         # Keyroots of B are 2, 5, 6
         # The tests explore all the possibilities (cartesian product)
@@ -158,3 +149,167 @@ class TestTreeDiff2(unittest.TestCase):
             with self.subTest(f'{desc} (a[{ia0}..{ia1}], b[{ib0}..{ib1}]. {expected})'):
                 res = td.is_tree_comparison(ia0, ia1, ib0, ib1)
                 self.assertEqual(res, expected)
+
+    def test_run(self):
+        """Tests if the tree edit distance between the roots is returned."""
+        td = TreeDiff2(self.example_tree_a, self.example_tree_b)
+
+        self.assertEqual(2, td.run())
+        self.assertEqual(0, tree_diff2(self.example_tree_a, self.example_tree_a))
+        self.assertEqual(1, tree_diff2(Tree('a'), Tree('b')))
+
+    def test_reference(self):
+        """Tests the distance against its recursive definition, on random trees."""
+        rng = random.Random(0)
+        model = CostModel(insert={'a': 2}, rename={('b', 'c'): 0.5})
+        for k in range(300):
+            a = random_tree(rng, rng.randint(1, 8))
+            b = random_tree(rng, rng.randint(1, 8))
+            with self.subTest(k=k):
+                self.assertEqual(reference_distance(a, b), tree_diff2(a, b))
+                self.assertEqual(reference_distance(a, b, model), tree_diff2(a, b, model))
+                # Out of core, only the rows of the local tables read later are kept
+                self.assertEqual(reference_distance(a, b), tree_diff2(a, b, ram_budget=0))
+
+    def test_cost_model(self):
+        """Tests if the costs of the cost model are used."""
+        a = Tree('Module', children=[Tree('Name', 'x'), Tree('Pass')])
+        b = Tree('Module', children=[Tree('Name', 'y')])
+        model = CostModel(delete={'Pass': 3}, rename={('Name', 'Name'): 0.5},
+                          default_rename=5)
+
+        self.assertEqual(2, tree_diff2(a, b))
+        self.assertEqual(3.5, tree_diff2(a, b, model))
+
+    def test_pair_levels(self):
+        """Tests if keyroot pairs are grouped by their dependencies."""
+        # Keyroots of A are 3, 5, 6 and the subtree of 6 contains the others
+        # Keyroots of B are 2, 5, 6 and the subtree of 6 contains the others
+        levels = _pair_levels(self.example_tree_a, self.example_tree_b)
+
+        self.assertEqual({
+            (3, 2): 0, (3, 5): 0, (3, 6): 1,
+            (5, 2): 0, (5, 5): 0, (5, 6): 1,
+            (6, 2): 1, (6, 5): 1, (6, 6): 2,
+        }, levels)
+
+    def test_run_parallel(self):
+        """Tests if the parallel mode gives the same distance and table as the serial one."""
+        serial = TreeDiff2(self.example_tree_a, self.example_tree_b)
+        parallel = TreeDiff2(self.example_tree_a, self.example_tree_b, jobs=2)
+        model = CostModel(rename={('c', 'd'): 0.5})
+
+        self.assertEqual(serial.run(), parallel.run())
+        self.assertEqual(serial.table, parallel.table.tolist())
+        self.assertEqual(tree_diff2(self.example_tree_a, self.example_tree_b, model),
+                         tree_diff2(self.example_tree_a, self.example_tree_b, model, jobs=2))
+
+    def test_run_parallel_reference(self):
+        """Tests the parallel mode against the recursive definition of the distance, on random trees."""
+        rng = random.Random(1)
+        for k in range(12):
+            a = random_tree(rng, rng.randint(4, 9))
+            b = random_tree(rng, rng.randint(4, 9))
+            expected = reference_distance(a, b)
+            with self.subTest(k=k):
+                self.assertEqual(expected, tree_diff2(a, b, jobs=2))
+                self.assertEqual(expected, tree_diff2(a, b, jobs=2, ram_budget=0))
+
+    def test_out_of_core(self):
+        """Tests if tables above the RAM budget are spilled to a memory-mapped file with the same results."""
+        serial = TreeDiff2(self.example_tree_a, self.example_tree_b)
+        spilled = TreeDiff2(self.example_tree_a, self.example_tree_b, ram_budget=64)
+        spilled_parallel = TreeDiff2(self.example_tree_a, self.example_tree_b, jobs=2, ram_budget=64)
+
+        self.assertFalse(serial.out_of_core())
+        self.assertTrue(spilled.out_of_core())
+        self.assertEqual(serial.run(), spilled.run())
+        self.assertEqual(serial.table, spilled.table.tolist())
+        self.assertEqual(serial.run(), spilled_parallel.run())
+        self.assertEqual(serial.table, spilled_parallel.table.tolist())
+        self.assertEqual(2, tree_diff2(self.example_tree_a, self.example_tree_b, ram_budget=0))
+
+    def test_decomposed_tree_diff2(self):
+        """Tests the diff of files one top-level statement at a time."""
+        def file(source):
+            return Tree('File', 'f.py', [Tree.from_AST(ast.parse(source))])
+        a = file('import os\ndef f(x):\n    return x + 1\ndef g():\n    pass\n')
+        b = file('import os\ndef f(x):\n    return x + 2\ndef g():\n    pass\n')
+        c = file('import os\ndef g():\n    pass\ndef f(x):\n    return x\nz = 1\n')
+
+        self.assertEqual((0, True), decomposed_tree_diff2(a, a))
+        self.assertEqual((tree_diff2(a, b), True), decomposed_tree_diff2(a, b))
+        # f moved and changed, z was added
+        distance, exact = decomposed_tree_diff2(a, c)
+        self.assertFalse(exact)
+        self.assertEqual(tree_diff2(a.children[0].children[1], c.children[0].children[2]) + 4, distance)
+
+    def test_decomposed_reference(self):
+        """Tests if the decomposed diffs said to be exact match the recursive definition of the distance."""
+        def statement(rng):
+            if rng.random() < 0.5:
+                return Tree('FunctionDef', rng.choice('fgh'), [random_tree(rng, rng.randint(1, 3))])
+            return random_tree(rng, rng.randint(1, 3))
+
+        def copy(node):
+            return Tree(node.type, node.value, [copy(c) for c in node.children])
+
+        rng = random.Random(0)
+        exact_count = 0
+        for k in range(300):
+            items_a = [statement(rng) for _ in range(rng.randint(0, 3))]
+            items_b = [copy(item) if rng.random() < 0.6 else statement(rng) for item in items_a]
+            if rng.random() < 0.3:
+                items_b.insert(rng.randint(0, len(items_b)), statement(rng))
+            a = Tree('File', 'f.py', [Tree('Module', None, items_a)])
+            b = Tree('File', 'f.py', [Tree('Module', None, items_b)])
+            distance, exact = decomposed_tree_diff2(a, b)
+            exact_count += exact
+            if exact:
+                with self.subTest(k=k):
+                    self.assertEqual(reference_distance(a, b), distance)
+        self.assertGreater(exact_count, 100)
+
+    def test_localized_tree_diff2(self):
+        """Tests the diff of the regions of the trees enclosing the changed lines."""
+        def module(source):
+            return Tree.from_AST(ast.parse(source))
+        functions = ''.join(f'def f{k}(x):\n    y = x * {k}\n    return y\n\n' for k in range(8))
+        a = functions + 'z = f1(2)\n'
+        b = functions.replace('def f7(x):\n', 'def f7(x):\n    print(x)\n') + 'z = f1(3)\n'
+        c = functions.replace('    return y\n\ndef f3', '    return -y\n\ndef f3')
+
+        self.assertEqual((0, True), localized_tree_diff2(a, a))
+        self.assertEqual((tree_diff2(module(a), module(b)), False), localized_tree_diff2(a, b))
+        self.assertEqual(tree_diff2(module(a), module(c)), localized_tree_diff2(a, c)[0])
+        # Only the changed statements are diffed
+        regions = _changed_regions(module(a), module(b), _line_map(a.split('\n'), b.split('\n')))
+        self.assertEqual([(['Constant'], ['Constant']), ([], ['Expr'])],
+                         [([n.type for n in x], [n.type for n in y]) for x, y in regions])
+        self.assertEqual((tree_diff2(module('x = 1\n'), module('def x(): pass\n')), False),
+                         localized_tree_diff2('x = 1\n', 'def x(): pass\n'))
+
+    def test_localized_reference(self):
+        """Tests if the localized diff is an upper bound of the recursive definition of the distance, reached when it is exact."""
+        statements = ['x = 1', 'y = x', 'z = f(x)', 'x = 2', 'def f(a):\n    return a', 'def f(a):\n    return 1',
+                      'if x:\n    y = 1', 'pass', 'y = [x]']
+        rng = random.Random(0)
+        for k in range(200):
+            lines_a = [rng.choice(statements) for _ in range(rng.randint(1, 3))]
+            lines_b = list(lines_a)
+            for _ in range(rng.randint(1, 2)):
+                edit = rng.random()
+                if edit < 0.4 and lines_b:
+                    lines_b[rng.randrange(len(lines_b))] = rng.choice(statements)
+                elif edit < 0.7:
+                    lines_b.insert(rng.randint(0, len(lines_b)), rng.choice(statements))
+                elif lines_b:
+                    lines_b.pop(rng.randrange(len(lines_b)))
+            source_a = '\n'.join(lines_a) + '\n'
+            source_b = '\n'.join(lines_b) + '\n'
+            expected = reference_distance(Tree.from_AST(ast.parse(source_a)), Tree.from_AST(ast.parse(source_b)))
+            distance, exact = localized_tree_diff2(source_a, source_b)
+            with self.subTest(k=k):
+                self.assertGreaterEqual(distance, expected)
+                if exact:
+                    self.assertEqual(expected, distance)
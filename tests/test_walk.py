@@ -0,0 +1,77 @@
+"""Tests for the walk script."""
+
+import os
+import tempfile
+import unittest
+
+from src.srcdiff.tree import Tree
+from src.srcdiff.walk import IgnoreRules, walk_files
+
+
+class TestIgnoreRules(unittest.TestCase):
+    def test_ignored(self):
+        """Test the gitignore-style matching of paths."""
+        rules = IgnoreRules(['__pycache__/', '*.pyc', '/build', 'docs/*.py',
+                             'src/**/gen_*.py', 'keep_*', '!keep_me.py'])
+        # Subtest label, relpath, is_dir, expected
+        data = [
+            ['dir only', 'a/__pycache__', True, True],
+            ['dir only, file', 'a/__pycache__', False, False],
+            ['name at any depth', 'a/b/c.pyc', False, True],
+            ['anchored', 'build', True, True],
+            ['anchored, nested', 'a/build', True, False],
+            ['slash in pattern', 'docs/conf.py', False, True],
+            ['star does not cross slashes', 'docs/api/conf.py', False, False],
+            ['double star', 'src/a/b/gen_x.py', False, True],
+            ['double star, zero dirs', 'src/gen_x.py', False, True],
+            ['negated', 'keep_me.py', False, False],
+            ['not negated', 'keep_it.py', False, True],
+            ['no match', 'a/b.py', False, False],
+        ]
+        for label, relpath, is_dir, expected in data:
+            with self.subTest(label):
+                self.assertEqual(rules.ignored(relpath, is_dir), expected)
+
+
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = self.tempdir.name
+        for relpath in ['b.py', 'a.py', 'notes.txt', 'pkg/c.py', 'pkg/__pycache__/c.py',
+                        '.venv/lib/d.py', 'pkg/sub/e.py']:
+            path = os.path.join(self.path, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('x = 1\n')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_walk_files(self):
+        """Test if it lists the source files, pruning ignored directories."""
+        self.assertEqual(list(walk_files(self.path)),
+                         ['a.py', 'b.py', 'pkg/c.py', 'pkg/sub/e.py'])
+        self.assertEqual(list(walk_files(self.path, ['pkg/sub/'], extensions=None)),
+                         ['a.py', 'b.py', 'notes.txt', '.venv/lib/d.py', 'pkg/c.py',
+                          'pkg/__pycache__/c.py'])
+
+    def test_from_dir(self):
+        """Test if `Tree.from_dir` uses the ignore rules and the extension filter."""
+        tree = Tree.from_dir(self.path, ignore=['__pycache__/', '.venv/', 'b.py'])
+        got = [(node.type, os.path.relpath(node.value, self.path))
+               for node in tree.postorder[1:] if node.type in ('File', 'Directory')]
+        self.assertEqual(got, [('File', 'a.py'), ('File', 'pkg/c.py'), ('File', 'pkg/sub/e.py'),
+                               ('Directory', 'pkg/sub'), ('Directory', 'pkg'), ('Directory', '.')])
+
+    def test_from_dir_not_recursive(self):
+        """Test if subdirectories are leaves when not exploring recursively."""
+        tree = Tree.from_dir(self.path, recursive=False)
+        subdir = tree.children[-1]
+        self.assertEqual((subdir.type, subdir.value, subdir.children),
+                         ('Directory', self.path + '/pkg', []))
+
+
+if __name__ == '__main__':
+    unittest.main()
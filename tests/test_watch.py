@@ -0,0 +1,105 @@
+"""Tests for the watch script."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.srcdiff.watch import IN_Q_OVERFLOW, DirectoryDiff, InotifyWatcher, PollingWatcher, watch
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.baseline = os.path.join(self.tempdir.name, 'baseline')
+        self.working = os.path.join(self.tempdir.name, 'working')
+        for root in (self.baseline, self.working):
+            self._write(root, 'same.py', 'x = 1\n')
+            self._write(root, 'pkg/changed.py', 'y = 2\n')
+        self._write(self.baseline, 'removed.py', 'pass\n')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def _write(self, root, relpath, text):
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_directory_diff(self):
+        """Test if only the changed pairs are reported."""
+        diff = DirectoryDiff(self.baseline, self.working)
+        self.assertEqual([('pkg/changed.py', 0), ('removed.py', 3), ('same.py', 0)],
+                         diff.update(diff.all_changes()))
+
+        self._write(self.working, 'pkg/changed.py', 'y = 3\n')
+        self._write(self.working, 'same.py', 'x = (\n')  # Syntax error, keeps the last contents
+        self.assertEqual([('pkg/changed.py', 1)],
+                         diff.update({(1, 'pkg/changed.py'), (1, 'same.py')}))
+
+        os.remove(os.path.join(self.baseline, 'removed.py'))
+        self.assertEqual([('removed.py', None)], diff.update({(0, 'removed.py')}))
+        shutil.rmtree(os.path.join(self.baseline, 'pkg'))
+        self.assertEqual([('pkg/changed.py', 6)], diff.update({(0, 'pkg/')}))
+
+    def test_polling_watcher(self):
+        """Test if the polling watcher finds changed, new and removed files."""
+        with PollingWatcher([self.baseline, self.working], interval=0.01) as w:
+            self.assertEqual(set(), w.poll(0.02))
+            self._write(self.working, 'pkg/changed.py', 'y = 30\n')
+            self._write(self.working, 'new/new.py', 'z\n')
+            os.remove(os.path.join(self.baseline, 'removed.py'))
+            self.assertEqual({(1, 'pkg/changed.py'), (1, 'new/new.py'), (0, 'removed.py')}, w.poll(1))
+
+    def test_inotify_watcher(self):
+        """Test if the inotify watcher finds changed, new and removed files."""
+        try:
+            w = InotifyWatcher([self.baseline, self.working])
+        except OSError:
+            self.skipTest('inotify is not available')
+        with w:
+            self.assertEqual(set(), w.poll(0))
+            self._write(self.working, 'pkg/changed.py', 'y = 30\n')
+            self._write(self.working, 'notes.txt', 'ignored\n')
+            os.makedirs(os.path.join(self.working, '__pycache__'))
+            os.makedirs(os.path.join(self.working, 'new'))
+            changes = w.poll(1)
+            self._write(self.working, 'new/new.py', 'z\n')
+            os.remove(os.path.join(self.baseline, 'removed.py'))
+            changes |= w.poll(1)
+            self.assertEqual({(1, 'pkg/changed.py'), (1, 'new/new.py'), (0, 'removed.py')}, changes)
+
+    def test_inotify_overflow(self):
+        """Test if the inotify watcher watches the directories created while its events were lost."""
+        try:
+            w = InotifyWatcher([self.baseline, self.working])
+        except OSError:
+            self.skipTest('inotify is not available')
+        with w:
+            os.makedirs(os.path.join(self.working, 'lost'))
+            # Drop the pending events, then report an overflow
+            os.read(w._fd, 65536)
+            changes = set()
+            w._handle(-1, IN_Q_OVERFLOW, '', changes)
+            self.assertEqual({(0, ''), (1, '')}, changes)
+            self._write(self.working, 'lost/new.py', 'z\n')
+            self.assertEqual({(1, 'lost/new.py')}, w.poll(1))
+
+    def test_watch(self):
+        """Test if the results are streamed, then updated as the files change."""
+        for poll_interval in (None, 0.01):
+            with self.subTest(poll_interval=poll_interval):
+                self._write(self.working, 'pkg/changed.py', 'y = 2\n')
+                results = watch(self.baseline, self.working, debounce=0.05, poll_interval=poll_interval)
+                self.assertEqual([('pkg/changed.py', 0), ('removed.py', 3), ('same.py', 0)],
+                                 [next(results) for _ in range(3)])
+                self._write(self.working, 'pkg/changed.py', 'y = 3\n')
+                self.assertEqual(('pkg/changed.py', 1), next(results))
+                results.close()
+
+
+if __name__ == '__main__':
+    unittest.main()